@@ -1,9 +1,14 @@
 from fastapi import APIRouter
 
+from api.api_v1.endpoints.admin import router as admin_router
 from api.api_v1.endpoints.authentication import router as auth_router
 from api.api_v1.endpoints.health import router as health_router
 from api.api_v1.endpoints.fileshandling import router as files_router
+from api.api_v1.endpoints.jobs import router as jobs_router
+from api.api_v1.endpoints.materials import router as materials_router
+from api.api_v1.endpoints.parsing import router as parsing_router
 from api.api_v1.endpoints.project import router as projects_router
+from api.api_v1.endpoints.uploads import router as uploads_router
 from api.api_v1.endpoints.user_projects import router as user_proj_info_router
 from api.api_v1.endpoints.stats import router as stats
 
@@ -12,5 +17,10 @@ router.include_router(auth_router)
 router.include_router(health_router)
 router.include_router(files_router)
 router.include_router(projects_router)
+router.include_router(uploads_router)
+router.include_router(jobs_router)
+router.include_router(parsing_router)
 router.include_router(user_proj_info_router)
 router.include_router(stats)
+router.include_router(materials_router)
+router.include_router(admin_router)
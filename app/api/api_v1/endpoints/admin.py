@@ -0,0 +1,122 @@
+import logging
+from typing import Optional
+from fastapi import APIRouter, Depends, Path, Query, status
+
+from db.mongodb import AsyncIOMotorClient, get_database
+
+# NECESSARY TO HANDLE FASTAPI_USERS
+from db.mongodb_utils import UserAuth
+from models.users import fastapi_users
+from crud.indexes import collection_scans, index_usage
+from db.indexes import ensure_indexes
+from core.blobstore import get_blob_store, storage_usage
+from crud.quotas import set_storage_quota, top_storage_usage
+
+logger = logging.getLogger("ai4mat")
+router = APIRouter()
+
+# only superusers can access admin routes
+current_superuser = fastapi_users.current_user(active=True, superuser=True)
+
+
+# http://0.0.0.0:8001/api/v1/admin/indexes
+# GET INDEXES USAGE AND COLLECTION SCANS
+@router.get(
+    "/admin/indexes",
+    tags=["admin"],
+    status_code=status.HTTP_200_OK,
+    summary="Indexes usage",
+    description="This route reports $indexStats usage and collection scans",
+)
+async def get_indexes_usage(
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_superuser),
+) -> dict:
+    """Get indexes usage and collection scans
+
+    Args:
+        db (AsyncIOMotorClient): Motor client connection to MongoDB. Defaults to Depends(get_database).
+
+    Returns:
+        dict: {"indexes": {collection: [index usage]},
+               "collectionScans": {"total", "nonTailable", "profiled"}}
+    """
+    return {
+        "indexes": await index_usage(db),
+        "collectionScans": await collection_scans(db),
+    }
+
+
+# http://0.0.0.0:8001/api/v1/admin/indexes/reconcile
+# CREATE MISSING INDEXES
+@router.post(
+    "/admin/indexes/reconcile",
+    tags=["admin"],
+    status_code=status.HTTP_200_OK,
+    summary="Reconcile indexes",
+    description="This route creates/rebuilds indexes declared in the index registry",
+)
+async def reconcile_indexes(
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_superuser),
+) -> dict:
+    return await ensure_indexes(db)
+
+
+# http://0.0.0.0:8001/api/v1/admin/storage
+# GET FILES STORAGE USAGE AND COMPRESSION RATIO
+@router.get(
+    "/admin/storage",
+    tags=["admin"],
+    status_code=status.HTTP_200_OK,
+    summary="Files storage usage",
+    description="This route reports size of stored files and compression ratio, by extension",
+)
+async def get_storage_usage(
+    user: UserAuth = Depends(current_superuser),
+) -> dict:
+    """Get files storage usage (walks the whole blob store)
+
+    Returns:
+        dict: {"blobs", "size", "stored_size", "compressed", "ratio",
+               "extensions": {ext: {"blobs", "size", "stored_size", "compressed", "ratio"}}}
+    """
+    return await storage_usage(get_blob_store())
+
+
+# http://0.0.0.0:8001/api/v1/admin/storage/usage?kind=user&limit=20
+# GET USERS (OR AFFILIATIONS) USING MOST STORAGE
+@router.get(
+    "/admin/storage/usage",
+    tags=["admin"],
+    status_code=status.HTTP_200_OK,
+    summary="Storage used by users or affiliations",
+    description="This route reports users (or affiliations) using most storage, with their quotas",
+)
+async def get_top_storage_usage(
+    kind: str = Query("user", regex="^(user|affiliation)$"),
+    limit: int = Query(20, ge=1, le=1000),
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_superuser),
+) -> dict:
+    # read storage counters maintained on files attach/detach
+    return {"data": await top_storage_usage(db, kind, limit)}
+
+
+# http://0.0.0.0:8001/api/v1/admin/storage/quota/user/someone@enea.it?quota_bytes=10737418240
+# SET STORAGE QUOTA OF A USER OR AFFILIATION
+@router.put(
+    "/admin/storage/quota/{kind}/{key}",
+    tags=["admin"],
+    status_code=status.HTTP_200_OK,
+    summary="Set storage quota",
+    description="This route sets storage quota (bytes, 0 unlimited) of a user or affiliation, without quota_bytes the default quota is restored",
+)
+async def put_storage_quota(
+    kind: str = Path(..., regex="^(user|affiliation)$"),
+    key: str = Path(...),
+    quota_bytes: Optional[int] = Query(None, ge=0),
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_superuser),
+) -> dict:
+    return await set_storage_quota(db, kind, key, quota_bytes)
@@ -1,18 +1,34 @@
-import hashlib
-from pathlib import Path
-from core.utils import get_dir_uploaded, hash_file
-from os import getcwd, remove, rename, path
+from core.blobstore import blob_key, get_blob_store
+from core.ranges import strong_etag
+from core.utils import blob_response
+from core.uploads import store_upload
 from dotenv import dotenv_values, find_dotenv
 
 # import json
-from fastapi import APIRouter, UploadFile, File, HTTPException, status
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import (
+    APIRouter,
+    Depends,
+    UploadFile,
+    File,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    status,
+)
+from fastapi.responses import JSONResponse, Response
 
 # import aiofiles
 
 router = APIRouter()
 from core.config import Config
 
+# NECESSARY TO HANDLE FASTAPI_USERS
+from db.mongodb_utils import UserAuth
+from models.users import fastapi_users
+
+current_user = fastapi_users.current_user(verified=True)
+
 # config = {
 #     **dotenv_values(
 #         find_dotenv(raise_error_if_not_found=True)
@@ -40,40 +56,23 @@ async def create_upload_file(file: UploadFile = File(...)):
     if file.content_type not in allowed_mime_types:
         raise HTTPException(400, detail="Invalid document type")
 
-    file_to_write = f"{upload_dir}/{file.filename}"
-    with open(file_to_write, "wb+") as file_object:
-        file_object.write(file.file.read())
-
-    # SLOWER VERSION BUT DOES NOT LOAD ENTIRE FILE IN MEMORY
-    # async with aiofiles.open(file_to_write, 'wb') as out_file:
-    #     while content := await file.read(1024):  # async read chunk
-    #         await out_file.write(content)  # async write chunk
-
-    # compute hash of file
-    hash = hash_file(file_to_write)
-    return {"info": f"file '{file.filename}' hash: {hash}"}
+    # saved in blob store as <hash>.<ext> (see core.uploads)
+    stored = await store_upload(file, get_blob_store())
+    return {"info": f"file '{file.filename}' hash: {stored.hash}"}
 
 
 @router.post("/files/uploadandhashing", response_description="Items retrieved")
 async def create_upload_file(file: UploadFile = File(...)):
     if file.content_type not in allowed_mime_types:
         raise HTTPException(400, detail="Invalid document type")
-    file_to_write = f"{upload_dir}/{file.filename}"
-    h = hashlib.sha1()
-    with open(file_to_write, "wb+") as file_object:
-        content = file.file.read()
-        h.update(content)
-        hash = h.hexdigest()
-        file_object.write(file.file.read())
-        ext = file.filename.split(".")[-1]
-        rename(file_to_write, f"{upload_dir}/{hash}.{ext}")
-
-        return {"info": f"file '{file.filename}' hash: {hash}"}
+    # hash while writing to a temporary file, then rename it to <hash>.<ext>
+    stored = await store_upload(file, get_blob_store())
+    return {"info": f"file '{file.filename}' hash: {stored.hash}"}
 
 
 @router.get("/files/{name_file}")
-def get_file(name_file: str) -> FileResponse:
-    """Download file from server
+async def get_file(name_file: str, request: Request) -> Response:
+    """Download file from server (supports Range, If-Range and If-None-Match)
 
     Args:
         name_file (str): file name to download expressed as <hash>.<ext>
@@ -82,32 +81,49 @@ def get_file(name_file: str) -> FileResponse:
         HTTPException: HTTP Error 404 if file not found
 
     Returns:
-        FileResponse: binary stream of file
+        Response: binary stream of file
     """
-    # get directory path for uploaded_dir
-    # if app is in path then use parent (remove 'app' from path) dir and concat with uploaded_dir
-    # if app in NOT in path the is not necessary to get parent dir
-    base_dir = get_dir_uploaded(upload_dir)
-
-    # path for file to write on file system
-    file_path = base_dir / name_file
-
-    # print(file_path)
-    isExisting = file_path.is_file()
-    if isExisting:
-        content = FileResponse(file_path)
-        return content
-    else:
+    return await blob_response(get_blob_store(), name_file, request)
+
+
+# CHECK IF A FILE IS ALREADY STORED (upload deduplication)
+# http://0.0.0.0:8001/api/v1/blobs/<sha1>?ext=cif
+@router.head("/blobs/{sha1}")
+async def head_blob(
+    sha1: str = Path(..., regex="^[0-9a-f]{40}$"),
+    ext: str = Query(..., regex="^[A-Za-z0-9]+$"),
+    user: UserAuth = Depends(current_user),
+) -> Response:
+    """Check if a file with the given SHA-1 (computed by client) and extension is stored,
+    if so it can be attached to a project by POST /project/{project_id}/files/by-hash
+    without uploading it again
+
+    Args:
+        sha1 (str): SHA-1 of file content
+        ext (str): file extension
+
+    Raises:
+        HTTPException: HTTP Error 404 if file not found
+
+    Returns:
+        Response: empty response with file size as Content-Length
+    """
+    info = await get_blob_store().stat(blob_key(sha1, ext))
+    if info is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="File not found")
+    return Response(
+        headers={"Content-Length": str(info.size), "ETag": strong_etag(sha1)}
+    )
 
 
 @router.delete("/files/delete/{name_file}")
-def delete_file(name_file: str):
+async def delete_file(name_file: str):
 
-    file_path = f"{getcwd()}/{upload_dir}/{name_file}"
-    isExisting = path.exists(file_path)
-    if isExisting:
-        remove(file_path)
+    try:
+        isRemoved = await get_blob_store().delete(name_file)
+    except ValueError:
+        isRemoved = False
+    if isRemoved:
         return JSONResponse(content={"removed": True}, status_code=200)
     else:
         return JSONResponse(
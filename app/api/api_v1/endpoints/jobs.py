@@ -0,0 +1,67 @@
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Path, status
+
+from crud.jobs import count_jobs, get_job
+from db.mongodb import AsyncIOMotorClient, get_database
+
+# NECESSARY TO HANDLE FASTAPI_USERS
+from db.mongodb_utils import UserAuth
+from models.users import fastapi_users
+
+logger = logging.getLogger("ai4mat")
+
+router = APIRouter()
+
+current_user = fastapi_users.current_user(verified=True)
+current_superuser = fastapi_users.current_user(active=True, superuser=True)
+
+# fields of a job returned to clients
+JOB_FIELDS = ("type", "key", "status", "attempts", "runAt", "result", "error", "createdAt", "updatedAt")
+
+
+# http://0.0.0.0:8001/api/v1/jobs/parse_cif:<sha1>.cif
+# GET STATUS (AND RESULT) OF A BACKGROUND JOB (ids are returned by upload routes)
+@router.get(
+    "/jobs/{job_id}",
+    tags=["jobs"],
+    status_code=status.HTTP_200_OK,
+    summary="Status of a background job",
+    description="This route returns status and result of a job processing an uploaded file",
+)
+async def get_job_status(
+    job_id: str = Path(..., max_length=200),
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_user),
+) -> dict:
+    """Get status of job job_id
+
+    Raises:
+        HTTPException: HTTP 404 if job is not found
+
+    Returns:
+        dict:{"id", "type", "key", "status": pending|running|done|failed, "attempts", "result", "error", ...}
+    """
+    job = await get_job(db, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found",
+        )
+    return {"id": job["_id"], **{k: job.get(k) for k in JOB_FIELDS}}
+
+
+# http://0.0.0.0:8001/api/v1/admin/jobs
+# GET NUMBER OF JOBS BY STATUS
+@router.get(
+    "/admin/jobs",
+    tags=["admin"],
+    status_code=status.HTTP_200_OK,
+    summary="Jobs queue",
+    description="This route reports the number of background jobs by status",
+)
+async def get_jobs_count(
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_superuser),
+) -> dict:
+    return {"data": await count_jobs(db)}
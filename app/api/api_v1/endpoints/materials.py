@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, Query, status
+
+from crud.catalog import formula_index
+from db.mongodb import AsyncIOMotorClient, get_database
+
+router = APIRouter()
+
+
+# http://0.0.0.0:8001/api/v1/materials/autocomplete?prefix=LiFe
+# GET FORMULAS STARTING WITH PREFIX (most used first)
+@router.get(
+    "/materials/autocomplete",
+    tags=["materials"],
+    status_code=status.HTTP_200_OK,
+    summary="Autocomplete materials' formulas",
+    description="This route gets formulas in IEMAP DB starting with the given prefix (case insensitive), with their counts",
+)
+async def autocomplete_formulas(
+    prefix: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncIOMotorClient = Depends(get_database),
+):
+    # search in-memory sorted formulas index (reloaded from catalog collection)
+    result = await formula_index.search(db, prefix, limit)
+    return {"data": result}
+    # return a JSON response as
+    # {
+    #     "data": [
+    #         {"formula": "LiFePO4", "count": 12},
+    #         {"formula": "LiFeO2", "count": 3}
+    #     ]
+    # }
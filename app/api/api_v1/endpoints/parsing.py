@@ -0,0 +1,54 @@
+import logging
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+
+from core.cif import CifParseError, CifTooLarge, parse_cif
+from core.config import Config
+from db.mongodb import AsyncIOMotorClient, get_database
+
+# NECESSARY TO HANDLE FASTAPI_USERS
+from db.mongodb_utils import UserAuth
+from models.users import fastapi_users
+
+logger = logging.getLogger("ai4mat")
+
+router = APIRouter()
+
+current_user = fastapi_users.current_user(verified=True)
+
+
+# http://0.0.0.0:8001/api/v1/parse/cif
+# PARSE A CIF FILE (NOT SAVED) RETURNING ITS STRUCTURE
+@router.post(
+    "/parse/cif",
+    tags=["parsing"],
+    status_code=status.HTTP_200_OK,
+    summary="Parse a CIF file",
+    description="This route parses a CIF file returning formula, elements, lattice, cell, sites and species (files already parsed are not parsed again)",
+)
+async def post_parse_cif(
+    file: UploadFile = File(...),
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_user),
+) -> dict:
+    """Parse CIF file in a worker process
+
+    Raises:
+        HTTPException: HTTP 413 if file is bigger than Config.cif_parse_max_size
+        HTTPException: HTTP 422 if file cannot be parsed
+
+    Returns:
+        dict:{"formula", "elements", "lattice": {"a", "b", "c", "alpha", "beta", "gamma"}, "cell", "sites", "species"}
+    """
+    # read at most one byte more than allowed to detect bigger files
+    data = await file.read(Config.cif_parse_max_size + 1)
+    try:
+        return await parse_cif(db, data)
+    except CifTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)
+        )
+    except CifParseError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
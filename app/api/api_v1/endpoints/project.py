@@ -1,21 +1,24 @@
 import logging
-import aiofiles.os
-from fastapi.concurrency import run_in_threadpool
-from shutil import copyfileobj
-from typing import Optional, List, Union
+from math import ceil
+from typing import AsyncIterator, Optional, List, Union
 from bson.objectid import ObjectId as BsonObjectId
-from core.parsing import parse_cif
 from core.utils import (
     delete_file_with_hash,
-    get_dir_uploaded,
-    get_str_file_size,
-    hash_file,
-    rename_file_with_its_hash,
+    get_str_size,
+    json_array_chunks,
+    ndjson_lines,
     save_file,
 )
+from core.blobstore import blob_key, get_blob_store
+from core.uploads import store_upload
+from core.jobs import enqueue_file_jobs
+from core.zipstream import entry_name, zip_blobs
+from core.structures import decode_structures
+from core.cif_archive import InvalidArchive, import_cif_archive
 from os import path, rename
 from dotenv import dotenv_values, find_dotenv
 from pydantic import Json
+from pymongo.errors import DuplicateKeyError
 from fastapi import (
     APIRouter,
     Depends,
@@ -28,14 +31,18 @@ from fastapi import (
     Request,
 )
 
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sentry_sdk import capture_exception
 from db.mongodb import AsyncIOMotorClient, get_database
+from api.quota import QuotaRoute, storage_quota
 
 # NECESSARY TO HANDLE FASTAPI_USERS
 from db.mongodb_utils import UserAuth
 from models.users import fastapi_users
 
+from crud.query_plans import compile_query
+from crud.blob_refs import BlobBeingDeleted, get_blob_refs, hold_blob
+from crud.quotas import QuotaExceeded, check_storage_quota
 from crud.projects import (
     add_project,
     add_project_file,
@@ -44,14 +51,18 @@ from crud.projects import (
     check_documents_having_files_with_hash,
     count_projects,
     find_all_project_paginated,
-    find_proj_having_file_with_hash,
     list_project_properties_files,
     list_projects,
     add_property_file,
     exec_query,
+    get_project_files,
+    compile_stream_query,
+    iter_query,
+    iter_query_files,
     pull_files_from_documents,
 )
 from models.iemap import (
+    CifArchiveMetadata,
     PropertyFile,
     PropertyForm,
     newProject as NewProjectModel,
@@ -59,6 +70,7 @@ from models.iemap import (
     # PydanticObjectId,
     ObjectIdStr,
     Provenance,
+    FileByHash,
     FileProject,
     ProjectFileForm,
     Property,
@@ -69,19 +81,42 @@ from models.iemap import (
 
 
 from core.config import Config
+from core.cursor import DEFAULT_SORT, encode_cursor, parse_sort
 
 
 logger = logging.getLogger("ai4mat")
 
-router = APIRouter()
+# routes depending on storage_quota check it before receiving files
+router = APIRouter(route_class=QuotaRoute)
 
 upload_dir = Config.files_dir
 
 # Get the current user (active or not)¶
 current_user = fastapi_users.current_user(verified=True)
+optional_user = fastapi_users.current_user(verified=True, optional=True)
+
+
+async def zip_entries(docs: AsyncIterator[dict], folders: bool):
+    """ZIP entries (name, blob key) for files of projects, named after
+    FileProject name and extention (in a folder per project if folders)"""
+    used = set()
+    async for doc in docs:
+        folder = str(doc.get("iemap_id") or doc["_id"]) if folders else ""
+        for f in doc.get("files") or []:
+            if f.get("hash") and f.get("extention"):
+                name = entry_name(f.get("name") or f["hash"], f["extention"], used, folder)
+                yield name, blob_key(f["hash"], f["extention"])
+
+
+def zip_response(entries: AsyncIterator, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        zip_blobs(get_blob_store(), entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-# http://0.0.0.0:8001/api/v1/project/list/?page_size=1&page_number=3
-# GET ALL PROJECTS PAGINATED (using skip & limit)
+# http://0.0.0.0:8001/api/v1/project/list/?page_size=10&sort=provenance.createdAt:-1&cursor=
+# GET ALL PROJECTS PAGINATED (using keyset pagination, skip & limit only for legacy page_number)
 @router.get(
     "/project/list/",
     tags=["projects"],
@@ -93,13 +128,25 @@ async def show_projects(
     # project: NewProjectModel = None,
     page_size: Optional[int] = 10,
     page_number: Optional[int] = 1,
+    cursor: Optional[str] = None,
+    sort: Optional[str] = DEFAULT_SORT,
 ):
-    """Get all projects paginated (using skip & limit)
+    """Get all projects paginated
+
+    Note:
+        Pages are retrieved using keyset pagination: pass the returned "next_cursor"
+        as "cursor" to get the following page (latency does not depend on page depth).
+        If no cursor is provided page_number is still honoured using skip & limit.
 
     Args:
         db (AsyncIOMotorClient): Motor client connection to MongoDB. Defaults to Depends(get_database).
         page_size (Optional[int], optional): size paginated results. Defaults to 10.
-        page_number (Optional[int], optional): actual page number returned. Defaults to 1.
+        page_number (Optional[int], optional): actual page number returned (ignored if cursor is provided). Defaults to 1.
+        cursor (Optional[str], optional): opaque cursor returned with the previous page.
+        sort (Optional[str], optional): sort as "field:dir,field:dir" (same dir for every field). Defaults to "_id:-1".
+
+    Raises:
+        HTTPException: HTTP 400 if sort or cursor are not valid
 
     Returns:
         dict:  {"skip" (int): number of docs to skip,
@@ -107,17 +154,31 @@ async def show_projects(
                 "page_number" (int): actual page number returned,
                 "page_tot" (int): total number of pages available,
                 "number_docs" (int): total number of documents in collection,
+                "exact" (bool): False as number_docs is an estimate (show it as "~N"),
+                "next_cursor" (str|None): cursor to get next page (None if last page),
                 "data" list[ProjetModel]: list of all projects saved in database}
     """
 
     # id is a ObjectId
+    # estimated from collection metadata (no collection scan)
     n_docs = await count_projects(db)
-    skip = page_size * (page_number - 1)
-    if page_size > n_docs:
-        page_tot = 1
-    else:
-        page_tot = (n_docs // page_size) + (n_docs - page_size) if n_docs > 0 else 0
-    result = await list_projects(db, page_size, skip)
+    skip = 0 if cursor else page_size * (page_number - 1)
+    page_tot = max(ceil(n_docs / page_size), 1)
+    try:
+        sort_spec = parse_sort(sort)
+        if skip > 0:
+            result = await list_projects(db, page_size, skip, sort_spec)
+            next_cursor = (
+                encode_cursor(sort_spec, result[-1])
+                if len(result) == page_size
+                else None
+            )
+        else:
+            result, next_cursor = await find_all_project_paginated(
+                db, query={}, limit=page_size, sort=sort_spec, next_key=cursor
+            )
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     return {
         "skip": skip,
@@ -125,12 +186,17 @@ async def show_projects(
         "page_number": page_number,
         "page_tot": page_tot,
         "number_docs": n_docs,
-        "data": result,
+        "exact": False,
+        "next_cursor": next_cursor,
+        "data": [
+            decode_structures({k: v for k, v in d.items() if k != "_id"})
+            for d in result
+        ],
     }
 
 
-# http://0.0.0.0:8001/api/v1/project/list/?page_size=1&page_number=3&next_key=
-# GET ALL PROJECTS PAGINATED (using skip & limit)
+# http://0.0.0.0:8001/api/v1/project/listfast/?page_size=10&next_key=
+# GET ALL PROJECTS PAGINATED (using keyset pagination)
 @router.get(
     "/project/listfast/",
     tags=["projects"],
@@ -142,22 +208,30 @@ async def show_projects(
     next_key: str = None,
     page_size: Optional[int] = 10,
     page_number: Optional[int] = 1,
+    sort: Optional[str] = DEFAULT_SORT,
 ):
 
     # id is a ObjectId
     n_docs = await count_projects(db)
-    page_tot = n_docs // page_size
-    result, next = await find_all_project_paginated(
-        db, query={}, limit=page_size, sort=["_id", -1], next_key=next_key
-    )
+    page_tot = max(ceil(n_docs / page_size), 1)
+    try:
+        result, next = await find_all_project_paginated(
+            db, query={}, limit=page_size, sort=parse_sort(sort), next_key=next_key
+        )
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     return {
-        "next_key": str(next),
+        "next_key": next,
         "page_size": page_size,
         "page_number": page_number,
         "page_tot": page_tot,
         "number_docs": n_docs,
-        "data": [{k: d[k] for k in set(list(d.keys())) - set(["_id"])} for d in result],
+        "exact": False,
+        "data": [
+            decode_structures({k: d[k] for k in set(list(d.keys())) - set(["_id"])})
+            for d in result
+        ],
     }
 
 
@@ -187,7 +261,13 @@ async def add_new_project(
 
     # RETRIEVE USER DATA FROM JWT
     project.provenance = Provenance(email=user.email, affiliation=user.affiliation)
-    id = await add_project(db, project=project)
+    try:
+        id = await add_project(db, project=project)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status.HTTP_409_CONFLICT,
+            detail=f"A project with iemap_id {project.iemap_id} already exists",
+        )
     # content=json.dumps(dict(project), default=str)
     # JSONResponse(content=json.dumps(dict(project), default=str))
     return newProjectResponse(inserted_id=id)
@@ -204,14 +284,14 @@ async def create_project_file(
     db: AsyncIOMotorClient = Depends(get_database),
     # COMMENT user:...below TO REMOVE AUTHORIZATION ~~~~~~~~~~~~~~~
     user: UserAuth = Depends(current_user),
+    quota: None = Depends(storage_quota),
 ):
     """Add a new file to an existing project
 
     Note:
         project_id, file_name and file extention (retrieved by backend) are used
-        to find the project to which add the file, if these details does not match that
-        already on server, the file is not added to the project,
-        and a HTTP_500_INTERNAL_SERVER_ERROR is returned.
+        to find the project to which add the file, if a file with the same content
+        is already attached to the project it is not added again (uploaded is False).
 
     Args:
         file_name (str): name of file to add
@@ -221,7 +301,9 @@ async def create_project_file(
 
     Raises:
         HTTPException: HTTP 400 if the file to add to project is not a PDF,CSV, TXT, CIF or DOC
-        HTTPException: HTTP 500 INTERNAL_SERVER_ERROR if it fails to update document in DB
+        HTTPException: HTTP 404 if project is not found
+        HTTPException: HTTP 409 if a file with the same content is being deleted (retry)
+        HTTPException: HTTP 413 if storage quota of user (or affiliation) would be exceeded
 
     Returns:
         dict:{"file_name": name of file, "file_hash": hash of file as saved on file system, "file_size": file size in human readable form}
@@ -235,53 +317,19 @@ async def create_project_file(
             status.HTTP_400_BAD_REQUEST,
             detail="Invalid document type (allowed only PDF,CSV, XLS, XLSX, TXT, CIF or DOC)",
         )
-    # retrieve file extension
-    file_ext = file.filename.split(".")[-1]
-    # file to write full path
-    file_to_write = get_dir_uploaded(upload_dir) / file.filename
-
     try:
-        f = await run_in_threadpool(open, file_to_write, "wb")
-        await run_in_threadpool(copyfileobj, file.file, f, 1024 * 1024 * 10)
+        # hash while writing to a temporary file, then rename it to <hash>.<ext>
+        stored = await store_upload(file, get_blob_store(), db)
+    except BlobBeingDeleted as e:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=str(e))
     except Exception as e:
         logger.error(e)
         capture_exception(e)
         return {"message": "There was an error uploading the file"}
-    finally:
-        if "f" in locals():
-            await run_in_threadpool(f.close)
-        await file.close()
-
-    # OLD VERSION
-    # try:
-    #     with open(file_to_write, "wb+") as file_object:
-    #         async with aiofiles.open(file_to_write, "wb") as out_file:
-    #             # read entire file in memory NOT IN CHUNCKS
-    #             content = await file.read()
-    #             # SLOWER VERSION BUT DOES NOT LOAD ENTIRE FILE IN MEMORY
-    #             # # async read chunk
-    #             # while content := await file.read(
-    #             #     Config.files_chunk_size
-    #             # ):
-    #             await out_file.write(content)  # async write chunk
-    #         # content = file.file.read()
-    #         # structure, distinct_species, lattice = None, None, None
-    #         # if file_ext == "cif":
-    #         #     structure, distinct_species, lattice = parse_cif(file_to_write)
-    # except Exception as e:
-    #     logger.error(e)
-    #     capture_exception(e)
-
-    # compute file hash & rename file on FileSystem accordingly
-    new_file_name, wasSavedOnFS = await rename_file_with_its_hash(
-        file_to_write, file_ext, upload_dir
-    )
 
-    # if new_file_name != None:
-    # extract HASH part only
-    hash = str(new_file_name).split("/")[-1].split(".")[0]
+    file_ext, hash = stored.ext, stored.hash
     # get file size
-    file_size = get_str_file_size(new_file_name)
+    file_size = get_str_size(stored.size)
     fp = FileProject(
         hash=hash,
         # if file_name is not passed as property in url endpoint then save file name in DB
@@ -289,6 +337,7 @@ async def create_project_file(
         name=file_name.split(".")[0] if file_name else file.filename,
         extention=file_ext,
         size=file_size,
+        size_bytes=stored.size,
     )
     # add file to docoment in DB having id == project_id
     # wasSavedOnFS means that file is already present on File System
@@ -296,24 +345,163 @@ async def create_project_file(
         db, id_mongodb, fp
     )
     if update_modified_count > 0:
+        # file is processed in background (e.g. CIF parsing), see core.jobs
+        jobs = await enqueue_file_jobs(db, stored.key)
         return {
             "uploaded": True,
             "file_name": fp.name,
             "file_hash": hash,
             "file_size": file_size,
+            "jobs": jobs,
         }
-    if update_modified_count == 0 and update_matched_count == 0:
-        return {
-            "uploaded": False,
-            "file_name": fp.name,
-            "file_hash": hash,
-            "file_size": file_size,
-        }
-    if update_modified_count == 0:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Document not updated",
+    # not attached to any project: collected after the grace period (held when stored)
+    if update_matched_count == 0:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Project not found")
+    # file already attached to project
+    return {
+        "uploaded": False,
+        "file_name": fp.name,
+        "file_hash": hash,
+        "file_size": file_size,
+    }
+
+
+# ADD PROJECT FILE ALREADY STORED ON SERVER (upload deduplication)
+# client computes SHA-1 locally, checks HEAD /api/v1/blobs/{sha1}?ext=... and,
+# if the file exists, attaches it to the project without uploading it
+# http://0.0.0.0:8001/api/v1/project/5eb8f8f8f8f8f8f8f8f8f8f8/files/by-hash
+@router.post("/project/{project_id}/files/by-hash", tags=["projects"])
+async def attach_project_file_by_hash(
+    project_id: ObjectIdStr,
+    file: FileByHash,
+    db: AsyncIOMotorClient = Depends(get_database),
+    # COMMENT user:...below TO REMOVE AUTHORIZATION ~~~~~~~~~~~~~~~
+    user: UserAuth = Depends(current_user),
+):
+    """Add a file already stored on server to an existing project (metadata only)
+
+    Args:
+        project_id (ObjectIdStr): the project ID as saved on DB
+        file (FileByHash): SHA-1, name and extention of the file
+        db (AsyncIOMotorClient): Motor client connection to MongoDB.
+
+    Raises:
+        HTTPException: HTTP 404 if no file with that hash and extention is stored (upload it) or project is not found
+        HTTPException: HTTP 413 if storage quota of user (or affiliation) would be exceeded
+
+    Returns:
+        dict:{"uploaded": True if file was added to project, "file_name", "file_hash", "file_size"}
+    """
+    try:
+        # not deleted by the garbage collector until attached
+        await hold_blob(db, file.hash, file.extention)
+    except BlobBeingDeleted as e:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f"{e}, upload it")
+    info = await get_blob_store().stat(blob_key(file.hash, file.extention))
+    if info is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="File not found, upload it")
+    try:
+        # attached files count in storage used, even if stored once
+        await check_storage_quota(db, user.email, user.affiliation, info.size)
+    except QuotaExceeded as e:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    file_size = get_str_size(info.size)
+    fp = FileProject(
+        hash=file.hash,
+        name=file.name.split(".")[0],
+        extention=file.extention,
+        size=file_size,
+        size_bytes=info.size,
+    )
+    update_modified_count, update_matched_count = await add_project_file(
+        db, BsonObjectId(project_id), fp
+    )
+    if update_matched_count == 0:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Project not found")
+    # jobs are keyed by file: already processed files are not processed again
+    jobs = await enqueue_file_jobs(db, info.key) if update_modified_count > 0 else []
+    return {
+        "uploaded": update_modified_count > 0,
+        "file_name": fp.name,
+        "file_hash": file.hash,
+        "file_size": file_size,
+        "jobs": jobs,
+    }
+
+
+# DOWNLOAD ALL FILES OF PROJECT AS ZIP ARCHIVE (streamed while files are read)
+# http://0.0.0.0:8001/api/v1/project/5eb8f8f8f8f8f8f8f8f8f8f8/files.zip
+@router.get("/project/{project_id}/files.zip", tags=["projects"])
+async def get_project_files_zip(
+    project_id: ObjectIdStr,
+    db: AsyncIOMotorClient = Depends(get_database),
+    # COMMENT user:...below TO REMOVE AUTHORIZATION ~~~~~~~~~~~~~~~
+    user: UserAuth = Depends(current_user),
+):
+    """Download all files of a project as a ZIP archive, entries named after
+    files' name and extention (no temporary files, constant memory)
+
+    Args:
+        project_id (ObjectIdStr): the project ID as saved on DB
+        db (AsyncIOMotorClient): Motor client connection to MongoDB.
+
+    Raises:
+        HTTPException: HTTP 404 if project does not exist
+
+    Returns:
+        StreamingResponse: ZIP archive
+    """
+    doc = await get_project_files(db, BsonObjectId(project_id))
+    if doc is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Project not found")
+
+    async def docs():
+        yield doc
+
+    filename = f"{doc.get('iemap_id') or project_id}.zip"
+    return zip_response(zip_entries(docs(), folders=False), filename)
+
+
+# IMPORT A ZIP OR TAR ARCHIVE OF CIF FILES (ONE PROJECT PER CIF FILE)
+# metadata is a JSON form field: {"project": {...}, "process": {...}, "parameters": [...], "properties": [...]}
+# http://0.0.0.0:8001/api/v1/project/import/cif-archive
+@router.post("/project/import/cif-archive", tags=["projects"])
+async def import_cif_archive_projects(
+    archive: UploadFile = File(...),
+    metadata: Json[CifArchiveMetadata] = Form(...),
+    db: AsyncIOMotorClient = Depends(get_database),
+    # COMMENT user:...below TO REMOVE AUTHORIZATION ~~~~~~~~~~~~~~~
+    user: UserAuth = Depends(current_user),
+    quota: None = Depends(storage_quota),
+):
+    """Create a project for each CIF file of an archive: material (formula,
+    elements, lattice, structure) is read from the CIF file, the other
+    metadata are shared, the CIF file is attached to its project
+
+    Args:
+        archive (UploadFile): ZIP or tar (.tar, .tar.gz, .tar.bz2, .tar.xz) archive of CIF files
+        metadata (CifArchiveMetadata): project, process, parameters and properties of projects
+        db (AsyncIOMotorClient): Motor client connection to MongoDB.
+
+    Raises:
+        HTTPException: HTTP 400 if archive is invalid or exceeds import limits
+        HTTPException: HTTP 413 if storage quota of user (or affiliation) would be exceeded
+
+    Returns:
+        dict:{"imported", "failed", "entries": [{"name", "status", "inserted_id", "file_hash", "formula", "error", "parse_ms", "store_ms"}],
+              "timings": {"extract_ms", "parse_ms", "insert_ms", "total_ms"}}
+    """
+    provenance = Provenance(email=user.email, affiliation=user.affiliation)
+    try:
+        return await import_cif_archive(
+            db, get_blob_store(), archive.file, metadata, provenance
         )
+    except InvalidArchive as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except QuotaExceeded as e:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    finally:
+        await archive.close()
 
 
 # ADD PROPERTY FILE TO PROJECT
@@ -327,6 +515,7 @@ async def create_property_file(
     db: AsyncIOMotorClient = Depends(get_database),
     # COMMENT user:...below TO REMOVE AUTHORIZATION ~~~~~~~~~~~~~~~
     user: UserAuth = Depends(current_user),
+    quota: None = Depends(storage_quota),
 ):
     """Add a new property file to an existing project
 
@@ -340,6 +529,7 @@ async def create_property_file(
     Raises:
         HTTPException: HTTP Error 400 is returned if a file not allowed is uploaded
         HTTPException: HTTP Error 400 is returned no file is provided
+        HTTPException: HTTP Error 409 is returned if a file with the same content is being deleted (retry)
         HTTPException: HTTP Error 500 is returned if it was not possible to add the file to the project
 
     Returns:
@@ -356,32 +546,18 @@ async def create_property_file(
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid document type")
     if file.filename == "":
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="No file provided")
-    # retrieve file extension
-    file_ext = file.filename.split(".")[-1]
-    # file to write full path
-    file_to_write = get_dir_uploaded(upload_dir) / file.filename
-
     try:
-        chunk_size = 1024 * 1024 * 10
-        fpro = await run_in_threadpool(open, file_to_write, "wb")
-        await run_in_threadpool(copyfileobj, file.file, fpro, chunk_size)
+        # hash while writing to a temporary file, then rename it to <hash>.<ext>
+        stored = await store_upload(file, get_blob_store(), db)
+    except BlobBeingDeleted as e:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=str(e))
     except Exception as e:
         logger.error(e)
         capture_exception(e)
         return {"message": f"There was an error uploading the file for property {name}"}
-    finally:
-        if "fpro" in locals():
-            await run_in_threadpool(fpro.close)
-        await file.close()
 
-    new_file_name, wasSavedOnFS = await rename_file_with_its_hash(
-        file_to_write, file_ext, upload_dir
-    )
-
-    # if new_file_name != None:
-    # extract HASH part only
-    hash = str(new_file_name).split("/")[-1].split(".")[0]
-    str_file_size = get_str_file_size(new_file_name)
+    file_ext, hash = stored.ext, stored.hash
+    str_file_size = get_str_size(stored.size)
 
     fp = FileProject(
         hash=hash,
@@ -390,10 +566,11 @@ async def create_property_file(
         name=name.split(".")[0] if name else file.filename,
         extention=file_ext,
         size=str_file_size,
+        size_bytes=stored.size,
     )
     isPropFile, isProjFileAdded = await add_property_file(db, id_mongodb, fp, name)
     if not isPropFile:
-        await aiofiles.os.remove(new_file_name)
+        # blob is held: collected after the grace period unless attached
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Unable to add property file",
@@ -403,6 +580,7 @@ async def create_property_file(
         "file_name": f"{file.filename}",
         "file_hash": f"{hash}",
         "file_size": str_file_size,
+        "jobs": await enqueue_file_jobs(db, stored.key),
     }
 
 
@@ -486,8 +664,7 @@ async def form_add_property_and_file(
         file = PropertyFile()
         file.extention = fileupload.filename.split(".")[-1]
         file.name = fileupload.filename.split(file.extention)[0]
-        upload_dir = Config.files_dir
-        file_hash, file_size, file_ext = await save_file(fileupload, upload_dir)
+        file_hash, file_size, file_ext = await save_file(fileupload, get_blob_store(), db)
         file.hash = file_hash
         file.size = file_size
 
@@ -600,33 +777,77 @@ async def form_add_property_and_file(
 
 @router.get("/project/query/", tags=["projects"])
 async def form_add_project_file(
+    request: Request,
     params: queryModel = Depends(),
+    stream: bool = False,
+    bundle: Optional[str] = Query(None, regex="^zip$"),
     db: AsyncIOMotorClient = Depends(get_database),
+    user: Optional[UserAuth] = Depends(optional_user),
     # response_model=queryModel, #THIS broke swagger auto documentation, FIX THIS!!
 ):
-    """Add file to project using Multi-Part Form data
+    """Query projects
+
+    Note:
+        With "Accept: application/x-ndjson" results are streamed as newline delimited JSON,
+        with stream=true they are streamed as a (chunked) JSON array.
+        In both cases documents are serialized while read from DB (constant memory).
+        With bundle=zip files of projects found are streamed as a ZIP archive
+        (a folder per project, authentication required).
 
     Args:
-        project_id (ObjectIdStr): document id to add file to
-        form_data (ProjectFileForm): form data fields. Defaults to Depends(ProjectFileForm.as_form).
-        fileupload (UploadFile ): file to upload (as form key use 'fileupload').
+        request (Request): used to read the Accept header
+        params (queryModel): query parameters (see models.iemap.query_params)
+        stream (bool, optional): stream results as chunked JSON array. Defaults to False.
+        bundle (str, optional): "zip" to download files of projects found. Defaults to None.
         db (AsyncIOMotorClient ): Motor client connection to MongoDb. Defaults to Depends(get_database).
 
     Raises:
-        HTTPException: HTTP 500 Internal Server Error if unable to save file
-        HTTPException: HTTP 400 bad request if file was not provided
-
+        HTTPException: HTTP 400 bad request if a parameter (e.g. sort or cursor) is not valid
+        HTTPException: HTTP 401 if bundle=zip is requested without authentication
 
     Returns:
-        dict: {
-            "hash_file"(str): hash file saved on file system,
-            "file_size"(str): file size in human readable format,
-            "file_ext"(str): file extension
-        }
+        list|dict|StreamingResponse: list of projects found
+            (as {"number_docs", "exact", "next_cursor", "data"} if paginated)
     """
     # params_as_dict = params.dict()
 
-    result = await exec_query(db, params)
+    if bundle == "zip":
+        if user is None:
+            raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+        try:
+            # invalid parameters are reported before the response starts
+            plan = compile_stream_query(params)
+        except ValueError as e:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+        entries = zip_entries(iter_query_files(db, plan, params.limit), folders=True)
+        return zip_response(entries, "iemap_files.zip")
+
+    if stream or "application/x-ndjson" in request.headers.get("accept", ""):
+        try:
+            # invalid parameters are reported before the response starts
+            plan = compile_stream_query(params)
+        except ValueError as e:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+        rows = iter_query(db, plan, params.limit)
+        if stream:
+            return StreamingResponse(
+                json_array_chunks(rows), media_type="application/json"
+            )
+        return StreamingResponse(ndjson_lines(rows), media_type="application/x-ndjson")
+
+    try:
+        result, next_cursor = await exec_query(db, params)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if params.limit or params.cursor:
+        # filtered counts are cached and invalidated on writes
+        n_docs = await count_projects(db, compile_query(params).filter)
+        return {
+            "number_docs": n_docs,
+            "exact": True,
+            "next_cursor": next_cursor,
+            "data": result,
+        }
     return result
 
 
@@ -651,18 +872,16 @@ async def delete_project_file_by_hash(
         ext = listDocs[0]["files"][0]["extention"]
         size = listDocs[0]["files"][0]["size"]
         file_hash_and_ext = hash_file + "." + ext
-        # FIRST check if file belongs to other projects
-        isRemoved = False
-        num_proj = await find_proj_having_file_with_hash(db, hash_file)
-        if num_proj > 0:
-            isRemoved = await delete_file_with_hash(file_hash_and_ext, upload_dir)
         for doc in listDocs:
             n_modified, n_matched = await pull_files_from_documents(
                 db, doc["_id"], hash_file
             )
+        # file is deleted from storage by the garbage collector
+        # (after a grace period) once no project references it
+        refs = await get_blob_refs(db, file_hash_and_ext)
         msg = f"File {file_hash_and_ext} ({size}), removed from project"
-        if isRemoved:
-            msg += " and from File System"
+        if not refs:
+            msg += " and scheduled for removal from File System"
         return {"status": msg}
     else:
         return {"status": f"No file with hash:{hash_file} was found on DB"}
@@ -43,7 +43,7 @@ async def stats_project(
     response: Response = Response(status_code=status.HTTP_200_OK),
 ):
 
-    # dictionary result aggreation pipeline
+    # dictionary result read from statistics counters
     result = await project_stat(db)
     if type(result) is dict:
         return {"data": result}
@@ -73,8 +73,8 @@ async def stats_project(
     user: UserAuth = Depends(current_user),
 ):
 
-    # dictionary result aggreation pipeline
-    result = await iemap_formulas_elements(db)
+    # dictionary result read from statistics counters
+    result = await project_stat_user(db, user.email)
     if type(result) is dict:
         return {"data": result}
     # return a JSON response as
@@ -108,7 +108,7 @@ async def stats_project(
     response: Response = Response(status_code=status.HTTP_200_OK),
 ):
 
-    # dictionary result aggreation pipeline
+    # dictionary result read from formulas/elements catalog
     result = await iemap_formulas_elements(db)
     if type(result) is dict:
         return {"data": result}
@@ -131,6 +131,8 @@ async def stats_project(
     #             "Ni",
     #             "O"
     #         ],
+    #         "formulas_count": {"C6H12": 2, "GAZ2058": 1, ...},
+    #         "elements_count": {"C": 4, "H": 3, ...},
     #         "n_formulas": 5,
     #         "n_elements": 7
     #     }
@@ -0,0 +1,266 @@
+import logging
+
+from bson.objectid import ObjectId as BsonObjectId
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status
+from fastapi.responses import JSONResponse, Response
+from sentry_sdk import capture_exception
+
+from core.blobstore import get_blob_store
+from core.config import Config
+from core.jobs import enqueue_file_jobs
+from core.uploads import ChunkTooLarge, assemble_blobs, store_stream
+from core.utils import get_str_size
+from crud.blob_refs import BlobBeingDeleted
+from crud.projects import add_project_file
+from crud.quotas import QuotaExceeded, check_storage_quota
+from crud.upload_sessions import (
+    add_part,
+    claim_session,
+    create_session,
+    delete_session,
+    get_session,
+    ordered_parts,
+    part_key,
+    received_offset,
+    release_session,
+)
+from db.mongodb import AsyncIOMotorClient, get_database
+from models.iemap import FileProject, UploadSessionCreate
+
+# NECESSARY TO HANDLE FASTAPI_USERS
+from db.mongodb_utils import UserAuth
+from models.users import fastapi_users
+
+logger = logging.getLogger("ai4mat")
+
+router = APIRouter()
+
+current_user = fastapi_users.current_user(verified=True)
+
+# RESUMABLE UPLOADS (tus-like protocol, for large files e.g. raw instrument data)
+# 1. POST /uploads {"filename", "length", "project_id"} -> {"upload_id", ...}
+# 2. PUT /uploads/{upload_id}?offset=N with raw bytes as body (chunks can be sent
+#    in parallel and sent again after a failure)
+# 3. HEAD /uploads/{upload_id} -> Upload-Offset header (where to resume from)
+# 4. POST /uploads/{upload_id}/finalize -> file saved as <sha1>.<ext>
+#    (and added to project if project_id was given)
+# chunks are streamed to blob store as they arrive (no multipart spooling),
+# sessions not finalized expire after UPLOAD_SESSION_TTL seconds of inactivity
+
+UPLOAD_ID = Path(..., regex=r"^[0-9a-f]{32}$")
+
+
+def session_status(session: dict) -> dict:
+    return {
+        "upload_id": session["_id"],
+        "filename": session["filename"],
+        "length": session["length"],
+        "offset": received_offset(session),
+        "parts": sorted([int(k), v] for k, v in session["parts"].items()),
+        "chunk_max_size": Config.upload_chunk_max_size,
+        "expires_at": session["expiresAt"],
+    }
+
+
+async def get_user_session(db: AsyncIOMotorClient, upload_id: str, user: UserAuth):
+    session = await get_session(db, upload_id, user.email)
+    if session is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Upload not found or expired")
+    return session
+
+
+@router.post("/uploads", tags=["uploads"], status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    upload: UploadSessionCreate,
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_user),
+):
+    """Start a resumable upload
+
+    Args:
+        upload (UploadSessionCreate): file name, size in bytes, MIME type and project to add the file to
+        db (AsyncIOMotorClient): Motor client connection to MongoDB.
+
+    Raises:
+        HTTPException: HTTP 400 if the file type is not allowed
+        HTTPException: HTTP 413 if storage quota of user (or affiliation) would be exceeded
+
+    Returns:
+        dict: {"upload_id", "filename", "length", "offset", "parts", "chunk_max_size", "expires_at"}
+    """
+    if upload.content_type not in Config.allowed_mime_types:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail="Invalid document type (allowed only PDF,CSV, XLS, XLSX, TXT, CIF or DOC)",
+        )
+    try:
+        # file size is declared: quota is checked before any chunk is received
+        await check_storage_quota(db, user.email, user.affiliation, upload.length)
+    except QuotaExceeded as e:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    session = await create_session(
+        db, user.email, upload.filename, upload.length, upload.project_id
+    )
+    return session_status(session)
+
+
+@router.put("/uploads/{upload_id}", tags=["uploads"])
+async def upload_chunk(
+    request: Request,
+    upload_id: str = UPLOAD_ID,
+    offset: int = Query(..., ge=0),
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_user),
+):
+    """Upload a chunk of file starting at byte offset (raw request body),
+    a chunk sent again replaces the previous one
+
+    Raises:
+        HTTPException: HTTP 404 if upload is not found or expired
+        HTTPException: HTTP 409 if upload is being finalized
+        HTTPException: HTTP 413 if chunk is larger than chunk_max_size or exceeds file length
+
+    Returns:
+        dict: status of upload (offset is the number of contiguous bytes received)
+    """
+    session = await get_user_session(db, upload_id, user)
+    if session.get("finalizing"):
+        raise HTTPException(status.HTTP_409_CONFLICT, detail="Upload is being finalized")
+    if offset >= session["length"]:
+        raise HTTPException(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Offset beyond file length"
+        )
+    store = get_blob_store()
+    key = part_key(upload_id, offset)
+    max_size = min(Config.upload_chunk_max_size, session["length"] - offset)
+    try:
+        size = await store_stream(request.stream(), store, key, max_size)
+    except ChunkTooLarge:
+        raise HTTPException(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Chunk larger than {max_size} bytes",
+        )
+    if size == 0:
+        await store.delete(key)
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Empty chunk")
+    session = await add_part(db, upload_id, offset, size)
+    if session is None:
+        await store.delete(key)
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Upload not found or expired")
+    result = session_status(session)
+    return JSONResponse(
+        content={**result, "expires_at": result["expires_at"].isoformat()},
+        headers={"Upload-Offset": str(result["offset"])},
+    )
+
+
+@router.head("/uploads/{upload_id}", tags=["uploads"])
+async def get_upload_offset(
+    upload_id: str = UPLOAD_ID,
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_user),
+) -> Response:
+    """Number of contiguous bytes received (where to resume the upload from)
+    as Upload-Offset header, file size as Upload-Length header"""
+    session = await get_user_session(db, upload_id, user)
+    return Response(
+        headers={
+            "Upload-Offset": str(received_offset(session)),
+            "Upload-Length": str(session["length"]),
+            "Cache-Control": "no-store",
+        }
+    )
+
+
+@router.get("/uploads/{upload_id}", tags=["uploads"])
+async def get_upload(
+    upload_id: str = UPLOAD_ID,
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_user),
+):
+    """Status of upload: received parts as [offset, size] and contiguous offset"""
+    return session_status(await get_user_session(db, upload_id, user))
+
+
+@router.post("/uploads/{upload_id}/finalize", tags=["uploads"])
+async def finalize_upload(
+    upload_id: str = UPLOAD_ID,
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_user),
+):
+    """Assemble chunks into <sha1>.<ext> (hash computed while reading parts once)
+    and add file to project if the upload was started with a project_id
+
+    Raises:
+        HTTPException: HTTP 404 if upload is not found or expired
+        HTTPException: HTTP 404 if project of the upload is not found (file is assembled anyway)
+        HTTPException: HTTP 409 if chunks are missing/overlap or upload is already being finalized
+        HTTPException: HTTP 409 if a file with the same content is being deleted (retry)
+        HTTPException: HTTP 500 INTERNAL_SERVER_ERROR if chunks cannot be assembled
+
+    Returns:
+        dict:{"uploaded": True if file was added to project, "file_name", "file_hash", "file_size"}
+    """
+    session = await claim_session(db, upload_id, user.email)
+    if session is None:
+        await get_user_session(db, upload_id, user)
+        raise HTTPException(status.HTTP_409_CONFLICT, detail="Upload is being finalized")
+    keys = ordered_parts(session)
+    if keys is None:
+        await release_session(db, upload_id)
+        raise HTTPException(
+            status.HTTP_409_CONFLICT,
+            detail=f"Upload incomplete or chunks overlap (offset {received_offset(session)})",
+        )
+    store = get_blob_store()
+    try:
+        # held until attached (collected after the grace period otherwise)
+        stored = await assemble_blobs(store, keys, session["ext"], db)
+    except BlobBeingDeleted as e:
+        await release_session(db, upload_id)
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=str(e))
+    except Exception as e:
+        await release_session(db, upload_id)
+        logger.error(e)
+        capture_exception(e)
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="There was an error assembling the file",
+        )
+    await delete_session(db, store, session)
+
+    file_size = get_str_size(stored.size)
+    fp = FileProject(
+        hash=stored.hash,
+        name=session["filename"].split(".")[0],
+        extention=stored.ext,
+        size=file_size,
+        size_bytes=stored.size,
+    )
+    uploaded = False
+    if session["project_id"]:
+        update_modified_count, update_matched_count = await add_project_file(
+            db, BsonObjectId(session["project_id"]), fp
+        )
+        if update_matched_count == 0:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Project not found")
+        uploaded = update_modified_count > 0
+    return {
+        "uploaded": uploaded,
+        "file_name": fp.name,
+        "file_hash": stored.hash,
+        "file_size": file_size,
+        "jobs": await enqueue_file_jobs(db, stored.key),
+    }
+
+
+@router.delete("/uploads/{upload_id}", tags=["uploads"])
+async def abort_upload(
+    upload_id: str = UPLOAD_ID,
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_user),
+):
+    """Abort upload deleting chunks received"""
+    session = await get_user_session(db, upload_id, user)
+    await delete_session(db, get_blob_store(), session)
+    return {"message": f"Upload {upload_id} aborted"}
@@ -0,0 +1,57 @@
+from typing import Callable
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.dependencies.utils import get_dependant, solve_dependencies
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+
+from crud.quotas import QuotaExceeded, check_storage_quota
+from db.mongodb import AsyncIOMotorClient, get_database
+
+# NECESSARY TO HANDLE FASTAPI_USERS
+from db.mongodb_utils import UserAuth
+from models.users import fastapi_users
+
+current_user = fastapi_users.current_user(verified=True)
+
+
+async def storage_quota(
+    request: Request,
+    db: AsyncIOMotorClient = Depends(get_database),
+    user: UserAuth = Depends(current_user),
+):
+    """Reject request if its body (declared Content-Length) would exceed
+    storage quota of user or of user's affiliation"""
+    if getattr(request.state, "quota_checked", False):
+        # already checked by QuotaRoute before reading body
+        return
+    size = int(request.headers.get("content-length") or 0)
+    try:
+        await check_storage_quota(db, user.email, user.affiliation, size)
+    except QuotaExceeded as e:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    request.state.quota_checked = True
+
+
+class QuotaRoute(APIRoute):
+    """Route solving the storage_quota dependency of its endpoint before the
+    request body is read: FastAPI parses (and spools) multipart bodies before
+    solving dependencies, so files over quota would be received anyway"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        if not any(d.call is storage_quota for d in self.dependant.dependencies):
+            return handler
+        quota_dependant = get_dependant(path=self.path_format, call=storage_quota)
+
+        async def quota_handler(request: Request):
+            _, errors, _, _, _ = await solve_dependencies(
+                request=request,
+                dependant=quota_dependant,
+                dependency_overrides_provider=self.dependency_overrides_provider,
+            )
+            if errors:
+                raise RequestValidationError(errors)
+            return await handler(request)
+
+        return quota_handler
@@ -0,0 +1,103 @@
+"""Throughput of CIF parsing over a synthetic corpus: inline parsing (blocking
+the event loop) versus process pool, and cached results (see core.cif)
+
+Run from app directory (needs MongoDB, cache entries of the corpus are removed):
+    python -m benchmarks.cif_parsing [--files 200] [--sites 64]
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from typing import Awaitable, Callable, List
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from core.cif import cif_cache, parse_cif
+from core.config import Config
+from core.parsing import parse_cif_data
+from core.processpool import run_in_process, shutdown_process_pool
+from crud.cif_structures import delete_cif_structures
+
+ELEMENTS = ["Li", "Na", "K", "Mg", "Ca", "Fe", "Co", "Ni", "Mn", "O", "S", "Cl", "P"]
+
+
+def make_cif(rng: random.Random, n_sites: int) -> bytes:
+    """P1 cell with random lattice and n_sites random atoms"""
+    a, b, c = (rng.uniform(3, 12) for _ in range(3))
+    alpha, beta, gamma = (rng.uniform(80, 100) for _ in range(3))
+    lines = [
+        f"data_synthetic_{rng.getrandbits(32):08x}",
+        "_symmetry_space_group_name_H-M   'P 1'",
+        "_symmetry_Int_Tables_number   1",
+        f"_cell_length_a   {a:.5f}",
+        f"_cell_length_b   {b:.5f}",
+        f"_cell_length_c   {c:.5f}",
+        f"_cell_angle_alpha   {alpha:.4f}",
+        f"_cell_angle_beta   {beta:.4f}",
+        f"_cell_angle_gamma   {gamma:.4f}",
+        "loop_",
+        " _symmetry_equiv_pos_as_xyz",
+        "  'x, y, z'",
+        "loop_",
+        " _atom_site_label",
+        " _atom_site_type_symbol",
+        " _atom_site_fract_x",
+        " _atom_site_fract_y",
+        " _atom_site_fract_z",
+        " _atom_site_occupancy",
+    ]
+    for i in range(n_sites):
+        element = rng.choice(ELEMENTS)
+        x, y, z = (rng.random() for _ in range(3))
+        lines.append(f"  {element}{i} {element} {x:.6f} {y:.6f} {z:.6f} 1")
+    return ("\n".join(lines) + "\n").encode()
+
+
+async def timed(name: str, n: int, parse: Callable[[], Awaitable[List]]):
+    start = time.perf_counter()
+    await parse()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>20}: {elapsed:7.2f}s  {n / elapsed:9.1f} files/s")
+
+
+async def run(n_files: int, n_sites: int, seed: int):
+    rng = random.Random(seed)
+    corpus = [make_cif(rng, n_sites) for _ in range(n_files)]
+    conn = AsyncIOMotorClient(str(Config.mongo_uri))
+    try:
+
+        async def inline():
+            return [parse_cif_data(data) for data in corpus]
+
+        async def pool():
+            return await asyncio.gather(
+                *(run_in_process(parse_cif_data, data) for data in corpus)
+            )
+
+        async def service():
+            return await asyncio.gather(*(parse_cif(conn, data) for data in corpus))
+
+        # start pool processes (and import pymatgen in them) out of timings
+        await run_in_process(parse_cif_data, corpus[0])
+        await timed("inline", n_files, inline)
+        await timed("process pool", n_files, pool)
+        await delete_cif_structures(conn, (hashlib.sha1(d).hexdigest() for d in corpus))
+        cif_cache.invalidate()
+        await timed("service (parse)", n_files, service)
+        await timed("service (memory)", n_files, service)
+        cif_cache.invalidate()
+        await timed("service (mongodb)", n_files, service)
+        await delete_cif_structures(conn, (hashlib.sha1(d).hexdigest() for d in corpus))
+    finally:
+        conn.close()
+        shutdown_process_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--sites", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args.files, args.sites, args.seed))
@@ -0,0 +1,71 @@
+"""Throughput of upload pipelines: legacy copy then re-read to hash
+versus single pass hash-while-write (core.uploads.store_upload)
+
+Run from app directory (needs 2-3x size free space in --dir):
+    python -m benchmarks.uploads [--size-mb 1024] [--dir /tmp]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+from shutil import copyfileobj
+
+from fastapi import UploadFile
+
+from core.blobstore import LocalBlobStore
+from core.config import Config
+from core.uploads import store_upload
+from core.utils import hash_file
+
+
+def make_source(directory: Path, size_mb: int) -> Path:
+    """Random file of size_mb MB (written once, reused by every run)"""
+    source = directory / f"upload-source-{size_mb}MB.bin"
+    if not source.exists() or source.stat().st_size != size_mb * 1024 * 1024:
+        with open(source, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+    return source
+
+
+async def legacy_upload(source: Path, target_dir: Path) -> str:
+    # what endpoints did before: copy to client file name, re-read to hash, rename
+    with open(source, "rb") as src:
+        file_to_write = target_dir / source.name
+        with open(file_to_write, "wb") as dst:
+            copyfileobj(src, dst, Config.files_chunk_size)
+    file_hash = hash_file(file_to_write)
+    os.replace(file_to_write, target_dir / f"{file_hash}.bin")
+    return file_hash
+
+
+async def single_pass_upload(source: Path, target_dir: Path) -> str:
+    stored = await store_upload(
+        UploadFile(filename=source.name, file=open(source, "rb")),
+        LocalBlobStore(target_dir),
+    )
+    return stored.hash
+
+
+async def run(size_mb: int, directory: Path, repeat: int):
+    source = make_source(directory, size_mb)
+    for name, upload in [("legacy", legacy_upload), ("single pass", single_pass_upload)]:
+        timings = []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory(dir=directory) as target_dir:
+                start = time.perf_counter()
+                file_hash = await upload(source, Path(target_dir))
+                timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"{name:>12}: {best:.2f}s  {size_mb / best:8.1f} MB/s  sha1={file_hash}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--dir", type=Path, default=Path(tempfile.gettempdir()))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.size_mb, args.dir, args.repeat))
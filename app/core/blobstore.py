@@ -0,0 +1,689 @@
+import os
+import struct
+import tempfile
+from abc import ABC, abstractmethod
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    BinaryIO,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import aiofiles
+import aiofiles.os
+from fastapi.concurrency import run_in_threadpool
+
+from core.config import Config
+
+# base directory of relative FILESDIR (repository root, i.e. parent of app)
+BASE_DIR = Path(__file__).resolve().parents[2]
+
+
+class BlobInfo(NamedTuple):
+    key: str
+    size: int  # size of content
+    modified: datetime
+    stored_size: Optional[int] = None  # bytes used in store (if compressed)
+    encoding: Optional[str] = None  # content coding of stored data (e.g. zstd)
+
+
+def blob_key(file_hash: str, file_ext: str) -> str:
+    """Key of a blob as exposed by the API: <sha1>.<ext>"""
+    return f"{file_hash}.{file_ext}"
+
+
+def shard_path(key: str) -> str:
+    """Sharded relative path of a blob: ab/cd/<sha1>.<ext>
+    (keeps directories small with millions of files)"""
+    return f"{key[:2]}/{key[2:4]}/{key}"
+
+
+def is_valid_key(key: str) -> bool:
+    """Keys are file names (no directory traversal, no hidden files)"""
+    return bool(key) and "/" not in key and "\\" not in key and not key.startswith(".")
+
+
+class BlobStore(ABC):
+    """Content addressed storage of uploaded files"""
+
+    # local directory where uploads are written before being put in the store
+    staging_dir: Path
+
+    @abstractmethod
+    async def put_file(self, path: Path, key: str) -> bool:
+        """Store content of local file path as key, path is consumed
+        (moved or removed). Blobs are immutable: an existing key is kept
+
+        Returns:
+            bool: True if blob was created, False if it already existed
+        """
+
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[BlobInfo]:
+        """Size and modification time of blob or None if missing"""
+
+    @abstractmethod
+    def iter_bytes(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = Config.files_chunk_size,
+    ) -> AsyncIterator[bytes]:
+        """Stream blob content from byte start to byte end (included)"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Delete blob
+
+        Returns:
+            bool: True if blob existed
+        """
+
+    @abstractmethod
+    def iter_blobs(self) -> AsyncIterator[BlobInfo]:
+        """Every blob in store (for reports and maintenance)"""
+
+    def iter_stored(self, key: str) -> AsyncIterator[bytes]:
+        """Stream blob as stored (encoded as BlobInfo.encoding)"""
+        return self.iter_bytes(key)
+
+    def open_staging(self, file_ext: str) -> Tuple[str, BinaryIO]:
+        """Create a temporary file in staging_dir where content of a new blob
+        <sha1>.<file_ext> is written before put_file (blocking: to run in a
+        worker thread), data written may be encoded on the fly
+
+        Returns:
+            Tuple[str, BinaryIO]: temporary file path and file object to write to
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.staging_dir, prefix=".upload-", suffix=".part"
+        )
+        return tmp_path, os.fdopen(fd, "wb")
+
+    async def exists(self, key: str) -> bool:
+        return await self.stat(key) is not None
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Path of blob on local file system (None if not stored locally)"""
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs stored on local file system as root/ab/cd/<sha1>.<ext>,
+    blobs saved before sharding (root/<sha1>.<ext>) are still found"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.staging_dir = self.root / ".staging"
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        if not is_valid_key(key):
+            raise ValueError(f"Invalid blob key {key}")
+        return self.root / shard_path(key)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        for path in (self.path(key), self.root / key):
+            if path.is_file():
+                return path
+        return None
+
+    async def put_file(self, path: Path, key: str) -> bool:
+        def move():
+            target = self.path(key)
+            existing = self.local_path(key)
+            # path itself may be a blob saved before sharding (see migrations)
+            if existing is not None and existing != Path(path):
+                os.remove(path)
+                return False
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # atomic on the same file system (staging dir is inside root)
+            os.replace(path, target)
+            return True
+
+        return await run_in_threadpool(move)
+
+    async def stat(self, key: str) -> Optional[BlobInfo]:
+        path = await run_in_threadpool(self.local_path, key)
+        if path is None:
+            return None
+        st = await aiofiles.os.stat(path)
+        return BlobInfo(key, st.st_size, datetime.utcfromtimestamp(st.st_mtime))
+
+    async def iter_bytes(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = Config.files_chunk_size,
+    ) -> AsyncIterator[bytes]:
+        path = await run_in_threadpool(self.local_path, key)
+        if path is None:
+            raise FileNotFoundError(key)
+        async with aiofiles.open(path, "rb") as f:
+            await f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = await f.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def delete(self, key: str) -> bool:
+        path = await run_in_threadpool(self.local_path, key)
+        if path is None:
+            return False
+        await aiofiles.os.remove(path)
+        return True
+
+    async def iter_blobs(self) -> AsyncIterator[BlobInfo]:
+        def scan() -> List[BlobInfo]:
+            blobs = []
+            for dirpath, dirnames, filenames in os.walk(self.root):
+                # skip staging (and any hidden) directory
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+                for name in filenames:
+                    if is_valid_key(name):
+                        st = os.stat(os.path.join(dirpath, name))
+                        modified = datetime.utcfromtimestamp(st.st_mtime)
+                        blobs.append(BlobInfo(name, st.st_size, modified))
+            return blobs
+
+        for info in await run_in_threadpool(scan):
+            yield info
+
+
+class S3BlobStore(BlobStore):
+    """Blobs stored on an S3 compatible object storage (AWS S3, MinIO, Ceph...)
+    as <prefix>ab/cd/<sha1>.<ext> (requires boto3: pip install mi-api[s3])"""
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        region: Optional[str] = None,
+        staging_dir: Optional[Path] = None,
+    ):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError as e:
+            raise RuntimeError("S3 blob store requires boto3 (pip install boto3)") from e
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+        )
+        self.client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+        self.staging_dir = Path(staging_dir or tempfile.gettempdir())
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+
+    def object_key(self, key: str) -> str:
+        if not is_valid_key(key):
+            raise ValueError(f"Invalid blob key {key}")
+        return self.prefix + shard_path(key)
+
+    def is_not_found(self, e: Exception) -> bool:
+        code = getattr(e, "response", {}).get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    async def put_file(self, path: Path, key: str) -> bool:
+        try:
+            if await self.exists(key):
+                return False
+            await run_in_threadpool(
+                self.client.upload_file, str(path), self.bucket, self.object_key(key)
+            )
+            return True
+        finally:
+            await run_in_threadpool(Path(path).unlink, True)
+
+    async def stat(self, key: str) -> Optional[BlobInfo]:
+        try:
+            head = await run_in_threadpool(
+                self.client.head_object, Bucket=self.bucket, Key=self.object_key(key)
+            )
+        except self.client_error as e:
+            if self.is_not_found(e):
+                return None
+            raise
+        return BlobInfo(key, head["ContentLength"], head["LastModified"])
+
+    async def iter_bytes(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = Config.files_chunk_size,
+    ) -> AsyncIterator[bytes]:
+        params = {"Bucket": self.bucket, "Key": self.object_key(key)}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            obj = await run_in_threadpool(self.client.get_object, **params)
+        except self.client_error as e:
+            if self.is_not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+        body = obj["Body"]
+        try:
+            chunks = body.iter_chunks(chunk_size)
+            while chunk := await run_in_threadpool(next, chunks, b""):
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete(self, key: str) -> bool:
+        if not await self.exists(key):
+            return False
+        await run_in_threadpool(
+            self.client.delete_object, Bucket=self.bucket, Key=self.object_key(key)
+        )
+        return True
+
+    async def iter_blobs(self) -> AsyncIterator[BlobInfo]:
+        pages = self.client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=self.prefix
+        )
+        pages = iter(pages)
+        while page := await run_in_threadpool(next, pages, None):
+            for obj in page.get("Contents", []):
+                key = obj["Key"].rsplit("/", 1)[-1]
+                yield BlobInfo(key, obj["Size"], obj["LastModified"])
+
+
+# zstd seekable format: independent frames followed by a skippable frame
+# holding the seek table (compressed and content size of each frame), see
+# https://github.com/facebook/zstd/blob/dev/contrib/seekable_format/zstd_seekable_compression_format.md
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+SEEK_TABLE_FOOTER = struct.Struct("<IBI")  # frames, descriptor, magic
+SEEK_TABLE_ENTRY = struct.Struct("<II")  # compressed size, content size
+
+
+class SeekableZstdWriter:
+    """File object compressing data written to dst as zstd frames of frame_size
+    bytes of content each, the seek table is appended on close (blocking)"""
+
+    def __init__(self, dst: BinaryIO, cctx, frame_size: int):
+        self.dst = dst
+        self.cctx = cctx
+        self.frame_size = frame_size
+        self.buffer = bytearray()
+        self.frames: List[Tuple[int, int]] = []
+
+    def write_frame(self, data: bytes):
+        frame = self.cctx.compress(data)
+        self.dst.write(frame)
+        self.frames.append((len(frame), len(data)))
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.frame_size:
+            self.write_frame(bytes(self.buffer[: self.frame_size]))
+            del self.buffer[: self.frame_size]
+        return len(data)
+
+    def close(self):
+        if self.dst.closed:
+            return
+        try:
+            if self.buffer or not self.frames:
+                self.write_frame(bytes(self.buffer))
+                self.buffer.clear()
+            entries = b"".join(SEEK_TABLE_ENTRY.pack(*f) for f in self.frames)
+            footer = SEEK_TABLE_FOOTER.pack(len(self.frames), 0, SEEKABLE_MAGIC)
+            self.dst.write(
+                struct.pack("<II", SKIPPABLE_MAGIC, len(entries) + len(footer))
+            )
+            self.dst.write(entries + footer)
+        finally:
+            self.dst.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CompressedBlobStore(BlobStore):
+    """Blob store compressing text-like blobs with zstd on ingest: <sha1>.<ext>
+    (SHA-1 of original content) is saved as <sha1>.<ext>.zst in the wrapped store
+    when it saves enough space. Blobs stored before compression was enabled
+    (or not worth compressing) are kept as they are (requires zstandard)
+
+    Uploads are compressed while they are written to the staging directory
+    (see open_staging) in the zstd seekable format, so that byte ranges are
+    read decompressing only the frames they cover. Blobs compressed as a single
+    frame (before the seekable format) are decompressed from the beginning"""
+
+    suffix = ".zst"
+
+    def __init__(
+        self,
+        store: BlobStore,
+        extensions: Iterable[str] = Config.blob_compress_extensions,
+        level: int = Config.blob_compress_level,
+        min_saving: float = Config.blob_compress_min_saving,
+        frame_size: int = Config.blob_compress_frame_size,
+    ):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError(
+                "Blob compression requires zstandard (pip install zstandard)"
+            ) from e
+        self.zstd = zstandard
+        self.store = store
+        self.staging_dir = store.staging_dir
+        self.extensions = {ext.lower() for ext in extensions}
+        self.level = level
+        self.min_saving = min_saving
+        self.frame_size = frame_size
+
+    def is_compressible(self, key: str) -> bool:
+        return key.split(".")[-1].lower() in self.extensions
+
+    def writer(self, dst: BinaryIO) -> SeekableZstdWriter:
+        # content size is written in each frame header
+        cctx = self.zstd.ZstdCompressor(level=self.level, write_content_size=True)
+        return SeekableZstdWriter(dst, cctx, self.frame_size)
+
+    def open_staging(self, file_ext: str) -> Tuple[str, BinaryIO]:
+        if not self.is_compressible(file_ext):
+            return self.store.open_staging(file_ext)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.staging_dir, prefix=".upload-", suffix=".part" + self.suffix
+        )
+        return tmp_path, self.writer(os.fdopen(fd, "wb"))
+
+    def compress(self, path: Path) -> str:
+        """Compress file path to a temporary file (blocking: to run in a worker thread)
+        for files not written with open_staging (e.g. blobs migrated)
+
+        Returns:
+            str: temporary file path
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.staging_dir, suffix=self.suffix)
+        try:
+            with open(path, "rb") as src, self.writer(os.fdopen(fd, "wb")) as dst:
+                while chunk := src.read(Config.files_chunk_size):
+                    dst.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def decompress(self, path: Path) -> str:
+        """Decompress file path to a temporary file (blocking: to run in a worker thread)
+
+        Returns:
+            str: temporary file path
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.staging_dir, suffix=".part")
+        try:
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                reader = self.zstd.ZstdDecompressor().stream_reader(
+                    src, read_across_frames=True
+                )
+                while chunk := reader.read(Config.files_chunk_size):
+                    dst.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    @staticmethod
+    def read_seek_table(path: Path) -> Optional[List[Tuple[int, int]]]:
+        """Seek table of a local compressed file (blocking)"""
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size < SEEK_TABLE_FOOTER.size:
+                return None
+            f.seek(size - SEEK_TABLE_FOOTER.size)
+            n, _, magic = SEEK_TABLE_FOOTER.unpack(f.read(SEEK_TABLE_FOOTER.size))
+            if magic != SEEKABLE_MAGIC:
+                return None
+            f.seek(size - SEEK_TABLE_FOOTER.size - n * SEEK_TABLE_ENTRY.size)
+            table = f.read(n * SEEK_TABLE_ENTRY.size)
+        return list(SEEK_TABLE_ENTRY.iter_unpack(table))
+
+    async def put_file(self, path: Path, key: str) -> bool:
+        path = Path(path)
+        stored = self.store.local_path(key)
+        if await self.store.exists(key + self.suffix) or (
+            # path itself may be a blob saved before sharding (see migrations)
+            await self.store.exists(key) and stored != path
+        ):
+            await run_in_threadpool(path.unlink, True)
+            return False
+        if not self.is_compressible(key):
+            return await self.store.put_file(path, key)
+        if path.name.endswith(self.suffix):
+            # already compressed while written (see open_staging)
+            tmp_path = str(path)
+        else:
+            tmp_path = await run_in_threadpool(self.compress, path)
+            await run_in_threadpool(path.unlink, True)
+        compressed = await run_in_threadpool(os.path.getsize, tmp_path)
+        table = await run_in_threadpool(self.read_seek_table, Path(tmp_path))
+        size = sum(content_size for _, content_size in table)
+        if compressed > size * (1 - self.min_saving):
+            # not worth it (seldom for text-like files): store content as it is
+            raw_path = await run_in_threadpool(self.decompress, Path(tmp_path))
+            await run_in_threadpool(os.remove, tmp_path)
+            return await self.store.put_file(Path(raw_path), key)
+        return await self.store.put_file(Path(tmp_path), key + self.suffix)
+
+    async def read_range(self, key: str, start: int, end: int) -> bytes:
+        data = b""
+        async for chunk in self.store.iter_bytes(key, start, end):
+            data += chunk
+        return data
+
+    async def seek_table(
+        self, key: str, size: Optional[int] = None
+    ) -> Optional[List[Tuple[int, int]]]:
+        """(compressed size, content size) of frames of compressed blob key
+        or None if it was compressed as a single frame (no seek table)"""
+        if size is None:
+            info = await self.store.stat(key)
+            size = info.size
+        if size < SEEK_TABLE_FOOTER.size:
+            return None
+        footer = await self.read_range(key, size - SEEK_TABLE_FOOTER.size, size - 1)
+        n, _, magic = SEEK_TABLE_FOOTER.unpack(footer)
+        if magic != SEEKABLE_MAGIC:
+            return None
+        table_start = size - SEEK_TABLE_FOOTER.size - n * SEEK_TABLE_ENTRY.size
+        table = await self.read_range(key, table_start, size - SEEK_TABLE_FOOTER.size - 1)
+        return list(SEEK_TABLE_ENTRY.iter_unpack(table))
+
+    async def content_size(self, key: str, size: Optional[int] = None) -> int:
+        """Original size read from seek table (or zstd frame header) of compressed blob"""
+        table = await self.seek_table(key, size)
+        if table is not None:
+            return sum(content_size for _, content_size in table)
+        return self.zstd.frame_content_size(await self.read_range(key, 0, 17))
+
+    async def stat(self, key: str) -> Optional[BlobInfo]:
+        info = await self.store.stat(key)
+        if info is not None or not self.is_compressible(key):
+            return info
+        info = await self.store.stat(key + self.suffix)
+        if info is None:
+            return None
+        size = await self.content_size(info.key, info.size)
+        return BlobInfo(key, size, info.modified, info.size, "zstd")
+
+    async def iter_bytes(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = Config.files_chunk_size,
+    ) -> AsyncIterator[bytes]:
+        if not self.is_compressible(key) or await self.store.exists(key):
+            async for chunk in self.store.iter_bytes(key, start, end, chunk_size):
+                yield chunk
+            return
+        table = await self.seek_table(key + self.suffix)
+        if table is None:
+            chunks = self.iter_single_frame(key + self.suffix, start, end, chunk_size)
+        else:
+            chunks = self.iter_frames(key + self.suffix, table, start, end, chunk_size)
+        async for chunk in chunks:
+            yield chunk
+
+    async def iter_frames(
+        self,
+        key: str,
+        table: List[Tuple[int, int]],
+        start: int,
+        end: Optional[int],
+        chunk_size: int,
+    ) -> AsyncIterator[bytes]:
+        """Decompress the frames covering content from start to end (included)"""
+        frames, offset, position = [], 0, 0
+        for compressed_size, content_size in table:
+            last = position + content_size - 1
+            if last >= start and (end is None or position <= end) and content_size:
+                frames.append((offset, compressed_size, position))
+            offset, position = offset + compressed_size, position + content_size
+        if not frames:
+            return
+        dctx = self.zstd.ZstdDecompressor()
+        lo, hi = frames[0][0], frames[-1][0] + frames[-1][1] - 1
+        compressed = self.store.iter_bytes(
+            key, lo, hi, chunk_size=max(chunk_size // 16, 64 * 1024)
+        )
+        buffer = bytearray()
+        for frame_offset, compressed_size, first in frames:
+            while len(buffer) < compressed_size:
+                buffer += await compressed.__anext__()
+            chunk = dctx.decompress(bytes(buffer[:compressed_size]))
+            del buffer[:compressed_size]
+            a = max(start - first, 0)
+            b = len(chunk) if end is None else min(end - first + 1, len(chunk))
+            yield chunk[a:b]
+        await compressed.aclose()
+
+    async def iter_single_frame(
+        self, key: str, start: int, end: Optional[int], chunk_size: int
+    ) -> AsyncIterator[bytes]:
+        """Decompress while streaming, skipping bytes before start
+        (blobs compressed before the seekable format)"""
+        dctx = self.zstd.ZstdDecompressor().decompressobj()
+        position = 0
+        # compressed chunks are smaller, each one expands to several times its size
+        compressed = self.store.iter_bytes(
+            key, chunk_size=max(chunk_size // 16, 64 * 1024)
+        )
+        async for data in compressed:
+            chunk = dctx.decompress(data)
+            first, position = position, position + len(chunk)
+            if position <= start:
+                continue
+            if end is not None and first > end:
+                break
+            lo = max(start - first, 0)
+            hi = len(chunk) if end is None else min(end - first + 1, len(chunk))
+            yield chunk[lo:hi]
+            if end is not None and position > end:
+                break
+
+    async def iter_stored(self, key: str) -> AsyncIterator[bytes]:
+        if not self.is_compressible(key) or await self.store.exists(key):
+            stored_key = key
+        else:
+            stored_key = key + self.suffix
+        async for chunk in self.store.iter_bytes(stored_key):
+            yield chunk
+
+    async def delete(self, key: str) -> bool:
+        deleted = await self.store.delete(key)
+        if self.is_compressible(key):
+            deleted = await self.store.delete(key + self.suffix) or deleted
+        return deleted
+
+    async def iter_blobs(self) -> AsyncIterator[BlobInfo]:
+        async for info in self.store.iter_blobs():
+            if info.key.endswith(self.suffix):
+                key = info.key[: -len(self.suffix)]
+                size = await self.content_size(info.key, info.size)
+                yield BlobInfo(key, size, info.modified, info.size, "zstd")
+            else:
+                yield info
+
+    def local_path(self, key: str) -> Optional[Path]:
+        # compressed blobs are not readable as they are
+        return self.store.local_path(key)
+
+
+async def storage_usage(store: BlobStore) -> dict:
+    """Number of blobs, size of their content and space used in store
+    (compression ratio is content size / stored size), by extension
+
+    Args:
+        store (BlobStore): blob store
+
+    Returns:
+        dict: {"blobs", "size", "stored_size", "compressed", "ratio", "extensions": {ext: {...}}}
+    """
+
+    def usage() -> dict:
+        return {"blobs": 0, "size": 0, "stored_size": 0, "compressed": 0}
+
+    total, extensions = usage(), {}
+    async for info in store.iter_blobs():
+        ext = info.key.split(".")[-1].lower()
+        for u in (total, extensions.setdefault(ext, usage())):
+            u["blobs"] += 1
+            u["size"] += info.size
+            u["stored_size"] += info.size if info.stored_size is None else info.stored_size
+            u["compressed"] += info.encoding is not None
+    for u in (total, *extensions.values()):
+        u["ratio"] = round(u["size"] / u["stored_size"], 3) if u["stored_size"] else None
+    return {**total, "extensions": extensions}
+
+
+@lru_cache(maxsize=None)
+def get_blob_store() -> BlobStore:
+    """Blob store configured by BLOB_STORE (local or s3), shared by every route,
+    compressing text-like blobs if BLOB_COMPRESSION=zstd"""
+    store = get_raw_blob_store()
+    if Config.blob_compression == "zstd":
+        return CompressedBlobStore(store)
+    return store
+
+
+def get_raw_blob_store() -> BlobStore:
+    if Config.blob_store == "s3":
+        return S3BlobStore(
+            bucket=Config.s3_bucket,
+            prefix=Config.s3_prefix,
+            endpoint_url=Config.s3_endpoint_url,
+            access_key=Config.s3_access_key,
+            secret_key=Config.s3_secret_key,
+            region=Config.s3_region,
+        )
+    return LocalBlobStore(BASE_DIR / Config.files_dir)
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class TTLCache:
+    """Small in-process cache whose entries expire after `ttl` seconds
+    (least recently set entries are evicted once `maxsize` is reached)
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get value stored for key or default if missing/expired"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value for key (resetting its time to live)"""
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable = None) -> None:
+        """Remove key from cache (or every key if none is given),
+        values being computed right now will not be cached"""
+        if key is None:
+            self._data.clear()
+            self._inflight.clear()
+        else:
+            self._data.pop(key, None)
+            self._inflight.pop(key, None)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self) is not self
+
+    async def get_or_compute(
+        self, key: Hashable, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Get value for key, computing it if missing or expired.
+        Concurrent callers for the same key share a single computation
+        (single-flight) instead of all hitting the DB at once
+
+        Args:
+            key (Hashable): cache key
+            compute (Callable[[], Awaitable[Any]]): coroutine function computing the value
+
+        Returns:
+            Any: cached or freshly computed value
+        """
+        value = self.get(key, self)
+        if value is not self:
+            return value
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # exception is raised to this caller, avoid "never retrieved" warnings
+                future.exception()
+            else:
+                # cancelled: let waiters fail instead of hanging
+                future.cancel()
+            raise
+        else:
+            # do not cache values computed while entries were invalidated
+            if self._inflight.get(key) is future:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+
+class LRUCache(TTLCache):
+    """In-process cache evicting least recently used entries once `maxsize`
+    is reached (entries never expire unless a `ttl` is given)
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = float("inf")):
+        super().__init__(ttl, maxsize)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = super().get(key, default)
+        if key in self._data:
+            self._data.move_to_end(key)
+        return value
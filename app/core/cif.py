@@ -0,0 +1,107 @@
+import hashlib
+import logging
+from typing import Awaitable, Callable
+from concurrent.futures.process import BrokenProcessPool
+
+from core.blobstore import BlobStore
+from core.cache import LRUCache
+from core.config import Config
+from core.parsing import parse_cif_data
+from core.processpool import run_in_process
+from crud.cif_structures import get_cif_structure, save_cif_structure
+from db.mongodb import AsyncIOMotorClient
+
+logger = logging.getLogger("ai4mat")
+
+# CIF parsing service: pymatgen parsing is CPU bound and runs in the process
+# pool (core.processpool), results are cached by SHA-1 of the file content in
+# memory (LRU) and in MongoDB (crud.cif_structures) so a file is parsed once
+
+# bump when parse_cif_data output changes: cached results are parsed again
+CIF_PARSER_VERSION = 1
+
+cif_cache = LRUCache(maxsize=Config.cif_cache_size)
+
+
+class CifParseError(ValueError):
+    """CIF file cannot be parsed (e.g. invalid or without structures)"""
+
+
+class CifTooLarge(ValueError):
+    """CIF file bigger than Config.cif_parse_max_size"""
+
+
+async def load_and_parse(
+    conn: AsyncIOMotorClient, sha1: str, load: Callable[[], Awaitable[bytes]]
+) -> dict:
+    """Get parsed file sha1 from MongoDB, or load its content and parse it"""
+    result = await get_cif_structure(conn, sha1, CIF_PARSER_VERSION)
+    if result is not None:
+        return result
+    data = await load()
+    try:
+        result = await run_in_process(parse_cif_data, data)
+    except (BrokenProcessPool, MemoryError):
+        # not a property of the file: do not cache
+        raise
+    except Exception as e:
+        # parsing is deterministic: invalid files are not parsed again either
+        result = {"error": f"{type(e).__name__}: {e}"}
+    await save_cif_structure(conn, sha1, CIF_PARSER_VERSION, result)
+    return result
+
+
+async def cached_parse(
+    conn: AsyncIOMotorClient, sha1: str, load: Callable[[], Awaitable[bytes]]
+) -> dict:
+    # concurrent requests for the same file share a single parsing
+    result = await cif_cache.get_or_compute(
+        sha1, lambda: load_and_parse(conn, sha1, load)
+    )
+    if "error" in result:
+        raise CifParseError(f"CIF {sha1}: {result['error']}")
+    return result
+
+
+async def parse_cif(conn: AsyncIOMotorClient, data: bytes) -> dict:
+    """Parse content of a CIF file (cached by its SHA-1)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        data (bytes): content of CIF file
+
+    Raises:
+        CifTooLarge: if file is bigger than Config.cif_parse_max_size
+        CifParseError: if file cannot be parsed
+
+    Returns:
+        dict: {"formula", "elements", "lattice", "cell", "sites", "species"} (see core.parsing.parse_cif_data)
+    """
+    if len(data) > Config.cif_parse_max_size:
+        raise CifTooLarge(f"CIF file larger than {Config.cif_parse_max_size} bytes")
+
+    async def load() -> bytes:
+        return data
+
+    return await cached_parse(conn, hashlib.sha1(data).hexdigest(), load)
+
+
+async def parse_cif_blob(conn: AsyncIOMotorClient, store: BlobStore, key: str) -> dict:
+    """Parse CIF file saved in blob store as key (<sha1>.cif), reading it
+    only if it was never parsed
+
+    Raises:
+        FileNotFoundError: if blob is missing
+        CifTooLarge: if file is bigger than Config.cif_parse_max_size
+        CifParseError: if file cannot be parsed
+    """
+
+    async def load() -> bytes:
+        info = await store.stat(key)
+        if info is None:
+            raise FileNotFoundError(key)
+        if info.size > Config.cif_parse_max_size:
+            raise CifTooLarge(f"CIF file larger than {Config.cif_parse_max_size} bytes")
+        return b"".join([chunk async for chunk in store.iter_bytes(key)])
+
+    return await cached_parse(conn, key.split(".")[0], load)
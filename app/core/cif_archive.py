@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import tarfile
+import time
+import zipfile
+from pathlib import PurePosixPath
+from typing import BinaryIO, Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sentry_sdk import capture_exception
+
+from core.blobstore import BlobStore
+from core.cif import CifParseError, parse_cif
+from core.config import Config
+from core.jobs import enqueue_file_jobs
+from core.uploads import StoredUpload, store_bytes
+from core.utils import get_str_size
+from crud.projects import add_projects
+from crud.quotas import check_storage_quota
+from db.mongodb import AsyncIOMotorClient
+from models.iemap import (
+    CifArchiveMetadata,
+    FileProject,
+    InputMaterial,
+    Lattice,
+    Material,
+    Provenance,
+    newProject,
+)
+
+logger = logging.getLogger("ai4mat")
+
+# bulk import of CIF files: one project per CIF file of a ZIP or tar archive,
+# sharing project/process metadata, material is read from the CIF file.
+# Files are parsed in the process pool (core.cif), saved in the blob store and
+# projects (with their file attached) are written by a single insert_many
+
+IMPORTED, FAILED = "imported", "failed"
+
+
+class InvalidArchive(ValueError):
+    """Archive is not a ZIP/tar file or exceeds import limits"""
+
+
+class ArchiveEntry(NamedTuple):
+    """CIF file read from an archive (data is None if it cannot be imported)"""
+
+    name: str
+    data: Optional[bytes]
+    error: Optional[str]
+
+
+def is_cif(name: str) -> bool:
+    path = PurePosixPath(name)
+    # skip hidden files and macOS metadata (__MACOSX/._name.cif)
+    return (
+        path.suffix.lower() == ".cif"
+        and not path.name.startswith(".")
+        and "__MACOSX" not in path.parts
+    )
+
+
+def read_members(
+    members: Iterable[Tuple[str, int, Callable[[], BinaryIO]]]
+) -> List[ArchiveEntry]:
+    entries, total_size = [], 0
+    for name, size, open_member in members:
+        if not is_cif(name):
+            continue
+        if len(entries) >= Config.cif_archive_max_entries:
+            raise InvalidArchive(
+                f"More than {Config.cif_archive_max_entries} CIF files in archive"
+            )
+        if size > Config.cif_parse_max_size:
+            entries.append(ArchiveEntry(name, None, "CIF file too large"))
+            continue
+        with open_member() as f:
+            # declared size is not trusted (e.g. crafted ZIP files)
+            data = f.read(Config.cif_parse_max_size + 1)
+        if len(data) > Config.cif_parse_max_size:
+            entries.append(ArchiveEntry(name, None, "CIF file too large"))
+            continue
+        total_size += len(data)
+        if total_size > Config.cif_archive_max_size:
+            raise InvalidArchive(
+                f"CIF files in archive larger than {Config.cif_archive_max_size} bytes"
+            )
+        entries.append(ArchiveEntry(name, data, None))
+    return entries
+
+
+def read_cif_archive(file: BinaryIO) -> List[ArchiveEntry]:
+    """Read CIF files of a ZIP or tar (optionally compressed) archive, other
+    files are ignored (blocking: to run in a worker thread)
+
+    Raises:
+        InvalidArchive: if file is not an archive or exceeds import limits
+
+    Returns:
+        List[ArchiveEntry]: CIF files in archive order
+    """
+    file.seek(0)
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            return read_members(
+                (info.filename, info.file_size, lambda info=info: archive.open(info))
+                for info in archive.infolist()
+                if not info.is_dir()
+            )
+    file.seek(0)
+    try:
+        with tarfile.open(fileobj=file, mode="r:*") as archive:
+            return read_members(
+                (member.name, member.size, lambda m=member: archive.extractfile(m))
+                for member in archive
+                if member.isfile()
+            )
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise InvalidArchive("Archive must be a ZIP or tar file") from e
+
+
+def project_document(
+    entry: ArchiveEntry,
+    structure: dict,
+    stored: StoredUpload,
+    metadata: CifArchiveMetadata,
+    provenance: Provenance,
+) -> dict:
+    """Project of a CIF file (identified by the file name) with the file attached"""
+    name = PurePosixPath(entry.name).stem
+    material = Material(
+        formula=structure["formula"].replace(" ", ""),
+        input=InputMaterial(
+            lattice=Lattice(
+                **{k: str(round(v, 6)) for k, v in structure["lattice"].items()}
+            ),
+            sites=structure["sites"],
+            species=structure["species"],
+            cell=structure["cell"],
+        ),
+    )
+    project = newProject(
+        identifier=name,
+        provenance=provenance,
+        project=metadata.project,
+        process=metadata.process,
+        material=material,
+        parameters=metadata.parameters,
+        properties=metadata.properties,
+    )
+    doc = project.dict()
+    doc["files"] = [
+        FileProject(
+            hash=stored.hash,
+            name=name,
+            extention=stored.ext,
+            size=get_str_size(stored.size),
+            size_bytes=stored.size,
+        ).dict()
+    ]
+    return doc
+
+
+async def prepare_entry(
+    conn: AsyncIOMotorClient,
+    store: BlobStore,
+    entry: ArchiveEntry,
+    metadata: CifArchiveMetadata,
+    provenance: Provenance,
+) -> Tuple[dict, Optional[dict]]:
+    """Parse and save a CIF file of the archive
+
+    Returns:
+        Tuple[dict, Optional[dict]]: entry report and project document (None if failed)
+    """
+    report = {"name": entry.name}
+    if entry.error is not None:
+        return {**report, "status": FAILED, "error": entry.error}, None
+    start = time.perf_counter()
+    try:
+        structure = await parse_cif(conn, entry.data)
+    except CifParseError as e:
+        return {**report, "status": FAILED, "error": str(e)}, None
+    finally:
+        report["parse_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    start = time.perf_counter()
+    # held: collected after the grace period if no project is created
+    stored = await store_bytes(entry.data, store, "cif", conn)
+    report["store_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    report.update(file_hash=stored.hash, formula=structure["formula"])
+    try:
+        doc = project_document(entry, structure, stored, metadata, provenance)
+    except ValidationError as e:
+        return {**report, "status": FAILED, "error": str(e)}, None
+    return report, doc
+
+
+async def import_cif_archive(
+    conn: AsyncIOMotorClient,
+    store: BlobStore,
+    file: BinaryIO,
+    metadata: CifArchiveMetadata,
+    provenance: Provenance,
+) -> dict:
+    """Create a project for each CIF file of a ZIP or tar archive
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        store (BlobStore): blob store where CIF files are saved
+        file (BinaryIO): archive
+        metadata (CifArchiveMetadata): project/process metadata shared by projects
+        provenance (Provenance): user importing the archive
+
+    Raises:
+        InvalidArchive: if file is not an archive or exceeds import limits
+        QuotaExceeded: if CIF files would exceed storage quota of user (or affiliation)
+
+    Returns:
+        dict: {"imported", "failed", "entries": [{"name", "status", "inserted_id",
+               "file_hash", "formula", "error", "parse_ms", "store_ms"}],
+               "timings": {"extract_ms", "parse_ms", "insert_ms", "total_ms"}}
+    """
+    start = time.perf_counter()
+    entries = await run_in_threadpool(read_cif_archive, file)
+    # request size (checked before reading it) is the compressed archive size:
+    # storage is accounted on CIF files sizes
+    await check_storage_quota(
+        conn,
+        provenance.email,
+        provenance.affiliation,
+        sum(len(e.data) for e in entries if e.data is not None),
+    )
+    extracted = time.perf_counter()
+    # entries are prepared (cache lookup, parse, store) as many at a time as
+    # processes in the pool, data of an entry is released once prepared
+    semaphore = asyncio.Semaphore(Config.worker_processes)
+
+    async def prepare(i: int) -> Tuple[dict, Optional[dict]]:
+        async with semaphore:
+            entry, entries[i] = entries[i], None
+            try:
+                return await prepare_entry(conn, store, entry, metadata, provenance)
+            except Exception as e:
+                # e.g. blob store failure or broken process pool: a CIF file
+                # already stored is held (collected after the grace period)
+                logger.error(f"Unable to import {entry.name}: {e}")
+                capture_exception(e)
+                return {"name": entry.name, "status": FAILED, "error": str(e)}, None
+
+    prepared = await asyncio.gather(*(prepare(i) for i in range(len(entries))))
+    parsed = time.perf_counter()
+    docs = [doc for _, doc in prepared if doc is not None]
+    errors = iter(await add_projects(conn, docs))
+    keys = set()
+    for report, doc in prepared:
+        if doc is None:
+            continue
+        error = next(errors)
+        if error is None:
+            report.update(status=IMPORTED, inserted_id=str(doc["_id"]))
+            keys.add(f"{report['file_hash']}.cif")
+        else:
+            report.update(status=FAILED, error=error)
+    reports = [report for report, _ in prepared]
+    inserted = time.perf_counter()
+    for key in keys:
+        await enqueue_file_jobs(conn, key)
+    imported = sum(1 for r in reports if r["status"] == IMPORTED)
+    return {
+        "imported": imported,
+        "failed": len(reports) - imported,
+        "entries": reports,
+        "timings": {
+            "extract_ms": round((extracted - start) * 1000, 1),
+            "parse_ms": round((parsed - extracted) * 1000, 1),
+            "insert_ms": round((inserted - parsed) * 1000, 1),
+            "total_ms": round((time.perf_counter() - start) * 1000, 1),
+        },
+    }
@@ -0,0 +1,150 @@
+import re
+from collections import Counter
+from functools import lru_cache
+from math import gcd
+from typing import List, NamedTuple, Optional, Tuple
+
+from core.config import Config
+from core.elements import ELEMENT_BITS
+
+# composition of material formulas ("LiFePO4", "Li0.5CoO2", "Ca3(PO4)2",
+# "CuSO4·5H2O"): reduced formula, atoms of each element and their atomic
+# fractions are saved with projects (material.composition) to query ranges of
+# element fractions. Formulas repeat a lot across projects: parsing is memoized
+
+# atomic fractions are saved rounded
+FRACTION_DIGITS = 6
+
+# element, number, opening bracket, closing bracket, hydrate separator
+TOKEN = re.compile(
+    r"\s*(?:([A-Z][a-z]?)|(\d+(?:\.\d+)?|\.\d+)|([(\[{])|([)\]}])|([·•*]))"
+)
+CLOSING = {"(": ")", "[": "]", "{": "}"}
+
+
+class ParsedFormula(NamedTuple):
+    """Composition of a formula: elements (counts) in order of first
+    appearance, reduced formula in Hill order"""
+
+    reduced_formula: str
+    counts: Tuple[Tuple[str, float], ...]
+    atoms: float
+
+    def fractions(self) -> Tuple[Tuple[str, float], ...]:
+        return tuple(
+            (element, round(count / self.atoms, FRACTION_DIGITS))
+            for element, count in self.counts
+        )
+
+
+def tokenize(formula: str) -> List[Tuple[str, str]]:
+    tokens, pos = [], 0
+    formula = formula.strip()
+    while pos < len(formula):
+        match = TOKEN.match(formula, pos)
+        if match is None:
+            raise ValueError(f"Unexpected {formula[pos]!r} in formula {formula}")
+        kind = ("element", "number", "open", "close", "dot")[match.lastindex - 1]
+        tokens.append((kind, match.group(match.lastindex)))
+        pos = match.end()
+    return tokens
+
+
+def parse_group(tokens: List[Tuple[str, str]], pos: int, closing: Optional[str]):
+    """Atoms of elements and groups up to closing bracket (or end of a hydrate part)"""
+    counts = Counter()
+    while pos < len(tokens):
+        kind, value = tokens[pos]
+        if kind == "element":
+            if value not in ELEMENT_BITS:
+                raise ValueError(f"{value} is not a chemical element")
+            group, pos = Counter({value: 1.0}), pos + 1
+        elif kind == "open":
+            group, pos = parse_group(tokens, pos + 1, CLOSING[value])
+        elif kind == "close" and value == closing:
+            return counts, pos + 1
+        elif kind == "dot" and closing is None:
+            return counts, pos
+        else:
+            raise ValueError(f"Unexpected {value!r} in formula")
+        if pos < len(tokens) and tokens[pos][0] == "number":
+            multiplier = float(tokens[pos][1])
+            group = Counter({k: n * multiplier for k, n in group.items()})
+            pos += 1
+        counts.update(group)
+    if closing is not None:
+        raise ValueError(f"Missing {closing!r} in formula")
+    return counts, pos
+
+
+def hill_order(elements) -> List[str]:
+    """Hill system order: C, then H, then the other elements alphabetically
+    (all elements alphabetically if there is no carbon)"""
+    if "C" not in elements:
+        return sorted(elements)
+    return ["C"] + (["H"] if "H" in elements else []) + sorted(
+        e for e in elements if e not in ("C", "H")
+    )
+
+
+def format_count(count: float) -> str:
+    if count == 1:
+        return ""
+    return str(int(count)) if count.is_integer() else f"{count:.{FRACTION_DIGITS}g}"
+
+
+@lru_cache(maxsize=Config.composition_cache_size)
+def parse_formula(formula: str) -> ParsedFormula:
+    """Composition of a formula (memoized)
+
+    Raises:
+        ValueError: if formula is not a chemical formula (e.g. "GAZ2058")
+
+    Returns:
+        ParsedFormula: reduced formula (Hill order, equivalent formulas have the
+                       same one), atoms of each element and total atoms
+    """
+    tokens, pos, counts = tokenize(formula), 0, Counter()
+    # hydrates "CuSO4·5H2O": parts separated by dots, with optional multiplier
+    while pos < len(tokens):
+        multiplier = 1.0
+        if tokens[pos][0] == "number":
+            multiplier, pos = float(tokens[pos][1]), pos + 1
+        part, pos = parse_group(tokens, pos, None)
+        counts.update({k: n * multiplier for k, n in part.items()})
+        if pos < len(tokens):
+            pos += 1  # dot
+    counts = {k: n for k, n in counts.items() if n > 0}
+    if not counts:
+        raise ValueError(f"No elements in formula {formula}")
+    # counts are reduced by their greatest common divisor when integers
+    divisor = 1
+    if all(n.is_integer() for n in counts.values()):
+        divisor = 0
+        for n in counts.values():
+            divisor = gcd(divisor, int(n))
+    reduced = "".join(
+        f"{k}{format_count(counts[k] / divisor)}" for k in hill_order(counts)
+    )
+    return ParsedFormula(reduced, tuple(counts.items()), sum(counts.values()))
+
+
+def composition_document(formula: Optional[str]) -> Optional[dict]:
+    """Composition of a formula as saved with projects
+    (None if formula is not a chemical formula)"""
+    if not formula:
+        return None
+    try:
+        parsed = parse_formula(formula)
+    except ValueError:
+        return None
+    return {
+        "reduced_formula": parsed.reduced_formula,
+        "atoms": parsed.atoms,
+        "elements": [
+            {"element": element, "count": count, "fraction": fraction}
+            for (element, count), (_, fraction) in zip(
+                parsed.counts, parsed.fractions()
+            )
+        ],
+    }
@@ -59,6 +59,17 @@ class Config(object):
     mongo_uri = config["MONGO_URI"]
     mongo_coll = config["MONGO_COLLECTION"]
     mongo_coll_users = config["MONGO_COLLECTION_USERS"]
+    mongo_coll_stats = config.get("MONGO_COLLECTION_STATS", "stats")
+    mongo_coll_catalog = config.get("MONGO_COLLECTION_CATALOG", "catalog")
+    mongo_coll_blob_refs = config.get("MONGO_COLLECTION_BLOB_REFS", "blob_refs")
+    mongo_coll_upload_sessions = config.get(
+        "MONGO_COLLECTION_UPLOAD_SESSIONS", "upload_sessions"
+    )
+    mongo_coll_jobs = config.get("MONGO_COLLECTION_JOBS", "jobs")
+    mongo_coll_leases = config.get("MONGO_COLLECTION_LEASES", "leases")
+    mongo_coll_cif_structures = config.get(
+        "MONGO_COLLECTION_CIF_STRUCTURES", "cif_structures"
+    )
     max_conn = int(os.getenv("MAX_CONNECTIONS_COUNT", 10))
     min_conn = int(os.getenv("MIN_CONNECTIONS_COUNT", 10))
     jwt_secret_key = config["JWT_SECRET_KEY"]
@@ -68,12 +79,94 @@ class Config(object):
         int(config["JWT_LIFETIME"]) if config.get("JWT_LIFETIME") else 3600 * 24
     )  # 24h
     access_token_expire_minutes = 60 * 24 * 7  # one week
+    # key used to sign pagination cursors (defaults to JWT secret)
+    cursor_secret_key = config.get("CURSOR_SECRET_KEY", config["JWT_SECRET_KEY"])
     app_name = config["APP_NAME"]
     allowed_hosts = CommaSeparatedStrings(config.get("ALLOWED_HOSTS", "*"))
     api_v1_str = config["API_V1_STR"]
     front_end = config["FRONTEND"]
     files_dir = config["FILESDIR"]
+    # where uploaded files are stored: "local" (FILESDIR) or "s3"
+    blob_store = config.get("BLOB_STORE", "local").lower()
+    s3_bucket = config.get("S3_BUCKET")
+    s3_prefix = config.get("S3_PREFIX", "")
+    s3_endpoint_url = config.get("S3_ENDPOINT_URL")  # e.g. MinIO http://minio:9000
+    s3_access_key = config.get("S3_ACCESS_KEY")
+    s3_secret_key = config.get("S3_SECRET_KEY")
+    s3_region = config.get("S3_REGION")
+    # compress text-like blobs on ingest (zstd or none)
+    blob_compression = config.get("BLOB_COMPRESSION", "zstd").lower()
+    blob_compress_extensions = config.get(
+        "BLOB_COMPRESS_EXTENSIONS", "cif,csv,txt,json,md,xml,tsv,xyz,log"
+    ).split(",")
+    blob_compress_level = int(config.get("BLOB_COMPRESS_LEVEL", 10))
+    # bytes of content per independent zstd frame (Range requests decompress
+    # only the frames they cover)
+    blob_compress_frame_size = int(config.get("BLOB_COMPRESS_FRAME_SIZE", 1024 * 1024))
+    # keep compressed blob only if it saves at least this fraction of space
+    blob_compress_min_saving = float(config.get("BLOB_COMPRESS_MIN_SAVING", 0.1))
+    # seconds a file without references is kept before being deleted
+    blob_gc_grace = int(config.get("BLOB_GC_GRACE", 24 * 3600))
+    # seconds between two runs of files garbage collector
+    blob_gc_interval = int(config.get("BLOB_GC_INTERVAL", 3600))
+    # seconds after which a file being deleted by a stopped collector is released
+    blob_gc_claim_ttl = int(config.get("BLOB_GC_CLAIM_TTL", 600))
+    # storage quotas in bytes (0: unlimited), per user and per affiliation,
+    # overridden for a single user/affiliation by PUT /api/v1/admin/storage/quota
+    storage_quota_user = int(config.get("STORAGE_QUOTA_USER", 0))
+    storage_quota_affiliation = int(config.get("STORAGE_QUOTA_AFFILIATION", 0))
+    # background jobs (processing of uploaded files, see core.jobs):
+    # run a worker inside the API process (otherwise start python -m worker)
+    jobs_worker_in_api = config.get("JOBS_WORKER_IN_API", "True") == "True"
+    jobs_concurrency = int(config.get("JOBS_CONCURRENCY", 4))
+    # seconds a job is leased to a worker (renewed by heartbeats while running)
+    jobs_lease = int(config.get("JOBS_LEASE", 60))
+    jobs_poll_interval = float(config.get("JOBS_POLL_INTERVAL", 2))
+    jobs_max_attempts = int(config.get("JOBS_MAX_ATTEMPTS", 5))
+    # seconds before first retry of a failed job (doubled at each attempt)
+    jobs_retry_delay = int(config.get("JOBS_RETRY_DELAY", 30))
+    jobs_retry_max_delay = int(config.get("JOBS_RETRY_MAX_DELAY", 3600))
+    # processes running CPU bound work (e.g. parsing)
+    worker_processes = int(config.get("WORKER_PROCESSES", os.cpu_count() or 1))
+    # parsed CIF structures kept in memory (also cached in MongoDB, see core.cif)
+    cif_cache_size = int(config.get("CIF_CACHE_SIZE", 4096))
+    # max size of a CIF file parsed (bigger files are refused)
+    cif_parse_max_size = int(config.get("CIF_PARSE_MAX_SIZE", 20 * 1024 * 1024))
+    # limits of archives imported by POST /project/import/cif-archive:
+    # number of CIF files and their total (uncompressed) size
+    cif_archive_max_entries = int(config.get("CIF_ARCHIVE_MAX_ENTRIES", 5000))
+    cif_archive_max_size = int(config.get("CIF_ARCHIVE_MAX_SIZE", 512 * 1024 * 1024))
+    # seconds a resumable upload session is kept after its last chunk
+    upload_session_ttl = int(config.get("UPLOAD_SESSION_TTL", 24 * 3600))
+    # max size of a chunk of a resumable upload
+    upload_chunk_max_size = int(config.get("UPLOAD_CHUNK_MAX_SIZE", 64 * 1024 * 1024))
+    # seconds a filtered projects count is cached
+    count_cache_ttl = int(config.get("COUNT_CACHE_TTL", 60))
+    # seconds statistics are cached (they are also dropped on writes)
+    stats_cache_ttl = int(config.get("STATS_CACHE_TTL", 300))
+    # seconds between two full recomputes of statistics counters
+    stats_reconcile_interval = int(config.get("STATS_RECONCILE_INTERVAL", 3600))
+    # seconds after startup before the first full recompute
+    stats_reconcile_delay = int(config.get("STATS_RECONCILE_DELAY", 600))
+    # seconds the in-memory formulas index (autocomplete) is kept before reload
+    catalog_index_ttl = int(config.get("CATALOG_INDEX_TTL", 60))
+    # number of documents per batch when streaming query results
+    query_stream_batch_size = int(config.get("QUERY_STREAM_BATCH_SIZE", 100))
+    # max number of compiled query plans kept in memory
+    query_plan_cache_size = int(config.get("QUERY_PLAN_CACHE_SIZE", 1024))
+    # max number of parsed formulas kept in memory (see core.composition)
+    composition_cache_size = int(config.get("COMPOSITION_CACHE_SIZE", 8192))
     files_chunk_size = int(config.get("FILES_CHUNK_SIZE", 1024 * 1024 * 10))
+    # files added to ZIP archives as they are (already compressed formats)
+    zip_stored_extensions = config.get(
+        "ZIP_STORED_EXTENSIONS",
+        "zip,gz,tgz,bz2,xz,7z,rar,zst,png,jpg,jpeg,gif,tif,tiff,pdf,xlsx,docx,pptx,h5,hdf5,npz",
+    ).split(",")
+    # files are content addressed (never change): cache them for one year,
+    # set "public, max-age=31536000, immutable" to let shared proxies cache them too
+    files_cache_control = config.get(
+        "FILES_CACHE_CONTROL", "private, max-age=31536000, immutable"
+    )
     allowed_mime_types = allowed_mime_types
     enable_onpremise_auth = bool(config["ENABLE_ONPREMISE_AUTH"] == "True")
     secrete_on_premise_auth = config["SECRET_ONPREMISE_AUTH"]
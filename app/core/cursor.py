@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import hmac
+from typing import Any, List, Optional, Tuple
+
+from bson import json_util
+from core.config import Config
+
+# fields that can be used to sort paginated results (each one is backed by a
+# compound (field, _id) index, see db.indexes: sorting on anything else, or on
+# several fields, means an in-memory sort)
+SORTABLE_FIELDS = {
+    "_id",
+    "iemap_id",
+    "project.name",
+    "material.formula",
+    "provenance.createdAt",
+    "provenance.updatedAt",
+}
+
+DEFAULT_SORT = "_id:-1"
+
+SortSpec = List[Tuple[str, int]]
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor is malformed, tampered or issued for another sort"""
+
+
+def parse_sort(sort: Optional[str]) -> SortSpec:
+    """Parse a sort expression as "field:dir,field:dir" (dir is 1 or -1)
+       into a list of (field, direction) always ending with _id as tie-breaker
+
+    Args:
+        sort (str, optional): sort expression, e.g. "provenance.createdAt:-1,project.name:1"
+
+    Raises:
+        ValueError: if a field is not sortable, direction is not 1/-1
+                    or directions are mixed (no index can serve the sort)
+
+    Returns:
+        SortSpec: list of (field, direction)
+    """
+    spec = []
+    for item in (sort or DEFAULT_SORT).split(","):
+        field, _, direction = item.strip().partition(":")
+        if field not in SORTABLE_FIELDS:
+            raise ValueError(f"Field {field} can not be used to sort results")
+        direction = int(direction or 1)
+        if direction not in (1, -1):
+            raise ValueError(f"Invalid sort direction {direction} for field {field}")
+        if field not in [f for f, _ in spec]:
+            spec.append((field, direction))
+    if len({d for _, d in spec}) > 1:
+        raise ValueError("Sort directions can not be mixed")
+    # _id guarantees a total order, so ties on other fields are never skipped
+    if "_id" not in [f for f, _ in spec]:
+        spec.append(("_id", spec[-1][1]))
+    return spec
+
+
+def get_field_value(doc: dict, field: str) -> Any:
+    """Get value from a (nested) document using a dotted path"""
+    value = doc
+    for key in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _sign(payload: bytes) -> str:
+    digest = hmac.new(
+        str(Config.cursor_secret_key).encode(), payload, hashlib.sha256
+    ).digest()[:16]
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def encode_cursor(sort: SortSpec, doc: dict) -> str:
+    """Build an opaque (signed) cursor pointing right after the given document
+
+    Args:
+        sort (SortSpec): sort used to produce the page
+        doc (dict): last document of the page
+
+    Returns:
+        str: url-safe cursor as <payload>.<signature>
+    """
+    data = {
+        "s": [[f, d] for f, d in sort],
+        "v": [get_field_value(doc, f) for f, _ in sort],
+    }
+    payload = json_util.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=") + "." + _sign(payload)
+
+
+def decode_cursor(cursor: str, sort: SortSpec) -> list:
+    """Verify a cursor and return the sort key values it encodes
+
+    Args:
+        cursor (str): cursor as returned by encode_cursor
+        sort (SortSpec): sort requested together with the cursor
+
+    Raises:
+        InvalidCursor: if cursor is malformed, its signature does not match
+                       or it was issued for a different sort
+
+    Returns:
+        list: values of the sort fields of the last document returned
+    """
+    try:
+        b64_payload, signature = cursor.split(".")
+        payload = _b64decode(b64_payload)
+    except Exception:
+        raise InvalidCursor("Malformed cursor")
+    if not hmac.compare_digest(_sign(payload), signature):
+        raise InvalidCursor("Invalid cursor signature")
+    data = json_util.loads(payload)
+    if [tuple(s) for s in data["s"]] != list(sort):
+        raise InvalidCursor("Cursor was issued for a different sort")
+    return data["v"]
+
+
+def _after(direction: int, value: Any) -> Optional[dict]:
+    """Condition on a single field selecting values following the given one
+
+    null and missing values sort before any other value in MongoDB, so they
+    come first ascending and last descending; $gt/$lt never match them.
+
+    Returns:
+        dict: condition on the field or None if no value can follow
+    """
+    if direction == 1:
+        return {"$ne": None} if value is None else {"$gt": value}
+    return None if value is None else {"$not": {"$gte": value}}
+
+
+def keyset_filter(sort: SortSpec, values: list) -> dict:
+    """Build the filter selecting documents following the sort key values
+    i.e. (f1 > v1) OR (f1 == v1 AND f2 > v2) OR ... (operator depends on direction)
+
+    Nullable sort fields are handled following MongoDB null-first ordering
+    (a null value equals null or missing, see _after).
+
+    Args:
+        sort (SortSpec): sort fields and directions
+        values (list): sort key values of the last document already returned
+
+    Returns:
+        dict: MongoDB filter
+    """
+    branches = []
+    for i, (field, direction) in enumerate(sort):
+        condition = _after(direction, values[i])
+        if condition is None:
+            continue
+        branch = {f: v for (f, _), v in zip(sort[:i], values[:i])}
+        branch[field] = condition
+        branches.append(branch)
+    if not branches:
+        # last document had the lowest possible key on every descending field
+        return {"_id": {"$exists": False}}
+    return branches[0] if len(branches) == 1 else {"$or": branches}
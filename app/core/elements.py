@@ -0,0 +1,69 @@
+from typing import Iterable, List, Tuple
+
+# periodic table ordered by atomic number (bit i <-> atomic number i + 1)
+PERIODIC_TABLE = (
+    "H", "He", "Li", "Be", "B", "C", "N", "O", "F", "Ne",
+    "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar", "K", "Ca",
+    "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn",
+    "Ga", "Ge", "As", "Se", "Br", "Kr", "Rb", "Sr", "Y", "Zr",
+    "Nb", "Mo", "Tc", "Ru", "Rh", "Pd", "Ag", "Cd", "In", "Sn",
+    "Sb", "Te", "I", "Xe", "Cs", "Ba", "La", "Ce", "Pr", "Nd",
+    "Pm", "Sm", "Eu", "Gd", "Tb", "Dy", "Ho", "Er", "Tm", "Yb",
+    "Lu", "Hf", "Ta", "W", "Re", "Os", "Ir", "Pt", "Au", "Hg",
+    "Tl", "Pb", "Bi", "Po", "At", "Rn", "Fr", "Ra", "Ac", "Th",
+    "Pa", "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm",
+    "Md", "No", "Lr", "Rf", "Db", "Sg", "Bh", "Hs", "Mt", "Ds",
+    "Rg", "Cn", "Nh", "Fl", "Mc", "Lv", "Ts", "Og",
+)  # fmt: skip
+
+ELEMENT_BITS = {symbol: bit for bit, symbol in enumerate(PERIODIC_TABLE)}
+
+# the 128 bits mask is stored as two (signed) int64 fields
+MASK_FIELDS = ("material.elements_mask_lo", "material.elements_mask_hi")
+WORD_BITS = 64
+
+
+def to_int64(word: int) -> int:
+    """Unsigned 64 bits word as signed int64 (as stored by MongoDB)"""
+    return word - (1 << WORD_BITS) if word >= 1 << (WORD_BITS - 1) else word
+
+
+def elements_mask(elements: Iterable[str]) -> Tuple[int, int]:
+    """Periodic table bitmask (lo, hi) of elements, symbols which are not
+    elements (e.g. from formulas like "GAZ2058") are ignored"""
+    mask = 0
+    for symbol in elements or []:
+        if symbol in ELEMENT_BITS:
+            mask |= 1 << ELEMENT_BITS[symbol]
+    return (
+        to_int64(mask & ((1 << WORD_BITS) - 1)),
+        to_int64(mask >> WORD_BITS),
+    )
+
+
+def element_positions(elements: Iterable[str]) -> Tuple[List[int], List[int]]:
+    """Bit positions (lo, hi) of elements, to use with $bits* operators
+
+    Raises:
+        ValueError: if a symbol is not an element
+    """
+    lo, hi = [], []
+    for symbol in elements:
+        if symbol not in ELEMENT_BITS:
+            raise ValueError(f"{symbol} is not a chemical element")
+        bit = ELEMENT_BITS[symbol]
+        (lo if bit < WORD_BITS else hi).append(bit % WORD_BITS)
+    return sorted(set(lo)), sorted(set(hi))
+
+
+def complement_positions(elements: Iterable[str]) -> Tuple[List[int], List[int]]:
+    """Bit positions (lo, hi) of every element except the given ones"""
+    lo, hi = element_positions(elements)
+    return (
+        [bit for bit in range(WORD_BITS) if bit not in lo],
+        [
+            bit
+            for bit in range(len(PERIODIC_TABLE) - WORD_BITS)
+            if bit not in hi
+        ],
+    )
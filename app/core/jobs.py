@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import socket
+from typing import Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from sentry_sdk import capture_exception
+
+from core.blobstore import BlobStore
+from core.config import Config
+from core.cif import CifParseError, CifTooLarge, parse_cif_blob
+from crud.jobs import claim_job, complete_job, enqueue_job, fail_job, heartbeat_job
+from db.mongodb import AsyncIOMotorClient
+
+logger = logging.getLogger("ai4mat")
+
+# background processing of uploaded files: upload endpoints enqueue jobs
+# (crud.jobs, stored in MongoDB) and return, workers run them with a lease
+# renewed by heartbeats, failed jobs are retried with exponential backoff
+
+Handler = Callable[[AsyncIOMotorClient, BlobStore, dict], Awaitable[Optional[dict]]]
+
+# job type -> coroutine processing the job (its result is saved in the job)
+handlers: Dict[str, Handler] = {}
+# file extension -> job types to run on files with that extension
+extension_jobs: Dict[str, List[str]] = {}
+
+
+def job_handler(job_type: str, extensions: List[str] = ()):
+    """Register a job handler, run on files with the given extensions"""
+
+    def register(handler: Handler) -> Handler:
+        handlers[job_type] = handler
+        for ext in extensions:
+            extension_jobs.setdefault(ext, []).append(job_type)
+        return handler
+
+    return register
+
+
+async def enqueue_file_jobs(conn: AsyncIOMotorClient, key: str) -> List[str]:
+    """Enqueue jobs processing file key (<sha1>.<ext>) according to its extension
+
+    Returns:
+        List[str]: ids of jobs
+    """
+    ext = key.split(".")[-1].lower()
+    return [await enqueue_job(conn, job_type, key) for job_type in extension_jobs.get(ext, [])]
+
+
+@job_handler("parse_cif", extensions=["cif"])
+async def parse_cif_job(conn: AsyncIOMotorClient, store: BlobStore, job: dict) -> dict:
+    # parsed in the process pool, cached by file hash (see core.cif)
+    try:
+        return await parse_cif_blob(conn, store, job["key"])
+    except (CifParseError, CifTooLarge) as e:
+        # invalid files fail again on retry: job is done with the error as result
+        return {"error": str(e)}
+
+
+class Worker:
+    """Run jobs from the queue, concurrency jobs at a time"""
+
+    def __init__(
+        self,
+        conn: AsyncIOMotorClient,
+        store: BlobStore,
+        concurrency: int = Config.jobs_concurrency,
+        job_types: Optional[List[str]] = None,
+    ):
+        self.conn = conn
+        self.store = store
+        self.concurrency = concurrency
+        self.job_types = job_types or list(handlers)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+    async def heartbeat(self, job: dict, task: asyncio.Task):
+        """Renew lease of job while it runs, cancel it if it was lost"""
+        while True:
+            await asyncio.sleep(Config.jobs_lease / 3)
+            if not await heartbeat_job(self.conn, job):
+                logger.warning(f"Job {job['_id']} lost by worker {self.worker_id}")
+                task.cancel()
+                return
+
+    async def run_job(self, job: dict):
+        task = asyncio.create_task(handlers[job["type"]](self.conn, self.store, job))
+        heartbeat = asyncio.create_task(self.heartbeat(job, task))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                # worker is stopping: job is claimed again once its lease expires
+                raise
+            return
+        except Exception as e:
+            status = await fail_job(self.conn, job, f"{type(e).__name__}: {e}")
+            logger.error(f"Job {job['_id']} attempt {job['attempts']} failed ({status}): {e}")
+            capture_exception(e)
+            return
+        finally:
+            heartbeat.cancel()
+        await complete_job(self.conn, job, result)
+        logger.info(f"Job {job['_id']} done")
+
+    async def run_slot(self):
+        while True:
+            try:
+                job = await claim_job(self.conn, self.worker_id, self.job_types)
+                if job is None:
+                    await asyncio.sleep(Config.jobs_poll_interval)
+                    continue
+                await self.run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. MongoDB not reachable
+                logger.error(f"Worker {self.worker_id} error: {e}")
+                capture_exception(e)
+                await asyncio.sleep(Config.jobs_poll_interval)
+
+    async def run(self):
+        logger.info(f"Worker {self.worker_id} started ({self.concurrency} slots)")
+        await asyncio.gather(*(self.run_slot() for _ in range(self.concurrency)))
+
+
+# worker running in the API process (JOBS_WORKER_IN_API=True)
+worker_task: Optional[asyncio.Task] = None
+
+
+def start_worker(conn: AsyncIOMotorClient, store: BlobStore) -> asyncio.Task:
+    global worker_task
+    if worker_task is None or worker_task.done():
+        worker_task = asyncio.create_task(Worker(conn, store).run())
+    return worker_task
+
+
+async def stop_worker():
+    global worker_task
+    if worker_task is not None:
+        worker_task.cancel()
+        await asyncio.gather(worker_task, return_exceptions=True)
+        worker_task = None
@@ -0,0 +1,55 @@
+import re
+from typing import Iterable, Optional
+
+import numpy as np
+
+# lattice parameters are saved as strings (as typed by users or read from CIF
+# files, e.g. "5.6402(3)", "90", "5,64 Å"): their numeric values are saved
+# alongside (material.lattice_values) to query ranges of cells
+
+LATTICE_PARAMS = ("a", "b", "c", "alpha", "beta", "gamma")
+
+# units removed (at the end of values) before conversion
+LATTICE_UNITS = re.compile(
+    r"\s*(Å|Angstroms?|Ang|A|°|degrees?|deg)\s*$", re.IGNORECASE
+)
+
+
+def lattice_floats(values: Iterable[Optional[str]]) -> np.ndarray:
+    """Numeric values of lattice parameters strings (NaN if not a number),
+    distinct strings are converted once (e.g. "90" of many angles)
+
+    Args:
+        values (Iterable[Optional[str]]): lattice parameters as strings (or numbers)
+
+    Returns:
+        np.ndarray: float64 values
+    """
+    strings = np.asarray(["" if v is None else str(v) for v in values], dtype=str)
+    if strings.size == 0:
+        return np.empty(0)
+    distinct, inverse = np.unique(strings, return_inverse=True)
+    # CIF uncertainty "5.6402(3)", decimal comma
+    cleaned = np.char.partition(distinct, "(")[:, 0]
+    cleaned = np.char.replace(cleaned, ",", ".")
+    numbers = np.full(len(distinct), np.nan)
+    for i, value in enumerate(cleaned):
+        try:
+            numbers[i] = float(LATTICE_UNITS.sub("", value))
+        except ValueError:
+            pass
+    numbers[~np.isfinite(numbers)] = np.nan
+    return numbers[inverse]
+
+
+def lattice_values(lattice: Optional[dict]) -> Optional[dict]:
+    """Numeric lattice parameters {"a": float|None, ...} of a lattice of strings
+    (None if no parameter is a number)"""
+    if not lattice:
+        return None
+    numbers = lattice_floats(lattice.get(p) for p in LATTICE_PARAMS)
+    if np.isnan(numbers).all():
+        return None
+    return {
+        p: None if np.isnan(x) else float(x) for p, x in zip(LATTICE_PARAMS, numbers)
+    }
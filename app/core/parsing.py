@@ -1,13 +1,18 @@
-from pymatgen.io.cif import CifParser
-from pymatgen.io.pwscf import PWInput, PWOutput
 import warnings
+from io import StringIO
 
+# pymatgen (with numpy, scipy, spglib...) is slow to import and memory hungry:
+# it is imported on first parsing, i.e. in the worker processes of
+# core.processpool, never by the API process at startup.
+# Do not import it at module level (checked by python -m startup_report --budget)
 warnings.filterwarnings("ignore", category=RuntimeWarning, module="pymatgen")
 # from nglview import show_structure_file
 
 
 def parse_cif(cif_file):
     """Parse a CIF file and return a pymatgen structure object."""
+    from pymatgen.io.cif import CifParser
+
     parser = CifParser(cif_file)
     structure = parser.get_structures()[0]
     # distinct_species = [
@@ -20,6 +25,36 @@ def parse_cif(cif_file):
     return formula, elements, lattice
 
 
+def parse_cif_data(data: bytes) -> dict:
+    """Parse the content of a CIF file returning plain (picklable) data,
+    to run in a worker process (see core.cif)
+
+    Returns:
+        dict: {"formula", "elements", "lattice": {"a", "b", "c", "alpha", "beta", "gamma"},
+               "cell": 3x3 lattice vectors, "sites": fractional coordinates, "species"}
+    """
+    from pymatgen.io.cif import CifParser
+
+    parser = CifParser(StringIO(data.decode("utf-8", errors="replace")))
+    structure = parser.get_structures()[0]
+    lattice = structure.lattice
+    return {
+        "formula": structure.formula,
+        "elements": sorted(structure.symbol_set),
+        "lattice": {
+            "a": lattice.a,
+            "b": lattice.b,
+            "c": lattice.c,
+            "alpha": lattice.alpha,
+            "beta": lattice.beta,
+            "gamma": lattice.gamma,
+        },
+        "cell": lattice.matrix.tolist(),
+        "sites": structure.frac_coords.tolist(),
+        "species": [site.species_string for site in structure],
+    }
+
+
 if __name__ == "__main__":
 
     import os
@@ -41,6 +76,7 @@ if __name__ == "__main__":
 # )
 # with open(fp_in) as f:
 #     contents = f.read()
+# from pymatgen.io.pwscf import PWInput, PWOutput
 # try:
 #     aiida_out = PWOutput(fp_out)
 #     print(aiida_out)
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+
+from sentry_sdk import capture_exception
+
+logger = logging.getLogger("ai4mat")
+
+# running background tasks by name
+tasks: Dict[str, asyncio.Task] = {}
+
+
+async def run_every(
+    name: str, interval: float, job: Callable[[], Awaitable], delay: float = 0
+):
+    """Run job every interval seconds (first run after delay seconds),
+    errors are logged and do not stop the loop"""
+    await asyncio.sleep(delay)
+    while True:
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Periodic task {name} failed: {e}")
+            capture_exception(e)
+        await asyncio.sleep(interval)
+
+
+def start_periodic(
+    name: str, interval: float, job: Callable[[], Awaitable], delay: float = 0
+) -> asyncio.Task:
+    """Start (once) a background task running job every interval seconds
+
+    Args:
+        name (str): task name (a task with the same name is not started twice)
+        interval (float): seconds between two runs
+        job (Callable[[], Awaitable]): coroutine function to run
+        delay (float, optional): seconds before first run. Defaults to 0.
+
+    Returns:
+        asyncio.Task: running task
+    """
+    if name not in tasks or tasks[name].done():
+        tasks[name] = asyncio.create_task(run_every(name, interval, job, delay))
+        logger.info(f"Periodic task {name} started (every {interval}s)")
+    return tasks[name]
+
+
+async def stop_periodic_tasks():
+    """Cancel every running background task"""
+    for task in tasks.values():
+        task.cancel()
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    tasks.clear()
@@ -0,0 +1,40 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from core.config import Config
+
+# pool of worker processes running CPU bound work (e.g. parsing) off the event loop,
+# started on first use. Processes are spawned (not forked): forking a process
+# running Motor threads and an event loop is unsafe
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=Config.worker_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+async def run_in_process(func: Callable, *args) -> Any:
+    """Run func(*args) in the process pool (func and args must be picklable)"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_process_pool(), func, *args)
+    except BrokenProcessPool:
+        # a process died (e.g. killed by OOM): start a new pool on next call
+        shutdown_process_pool()
+        raise
+
+
+def shutdown_process_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
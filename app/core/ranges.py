@@ -0,0 +1,151 @@
+from datetime import datetime, timezone
+from email.utils import formatdate
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+from uuid import uuid4
+
+# HTTP conditional and range requests (RFC 9110) for content addressed files:
+# a blob <sha1>.<ext> never changes, so its SHA-1 is a strong ETag
+
+# more ranges than this in a request are ignored (whole file is sent)
+MAX_RANGES = 32
+
+ByteRange = Tuple[int, int]  # first and last byte (included)
+
+
+class RangeNotSatisfiable(ValueError):
+    """None of the requested ranges overlaps the file"""
+
+
+def strong_etag(key: str, encoding: Optional[str] = None) -> str:
+    """ETag of blob <sha1>.<ext>: its SHA-1 (with the content coding
+    of the representation sent, e.g. "<sha1>-zstd", if any)"""
+    tag = key.split(".")[0]
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def http_date(dt: datetime) -> str:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return formatdate(dt.timestamp(), usegmt=True)
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = True) -> bool:
+    """Check if etag is listed in an If-None-Match (weak comparison)
+    or If-Range (strong comparison) header"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def accepts_encoding(header: Optional[str], coding: str) -> bool:
+    """Check if an Accept-Encoding header allows content coding (q > 0)"""
+    for item in (header or "").split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() not in (coding, "*"):
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[List[ByteRange]]:
+    """Parse a Range header (bytes=0-99,200-,-50) for a file of size bytes,
+    overlapping or adjacent ranges are merged
+
+    Raises:
+        RangeNotSatisfiable: if no range overlaps the file
+
+    Returns:
+        List[ByteRange]: ranges sorted or None if header is missing,
+        invalid or must be ignored (whole file is sent)
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    ranges = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else None
+            else:
+                # suffix range: last N bytes
+                start, end = max(size - int(last), 0), None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        end = size - 1 if end is None else end
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable(f"bytes */{size}")
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def content_range(start: int, end: int, size: int) -> str:
+    return f"bytes {start}-{end}/{size}"
+
+
+class MultipartRanges:
+    """Body of a multipart/byteranges response (several ranges of a file)"""
+
+    def __init__(self, ranges: List[ByteRange], size: int, media_type: str):
+        self.ranges = ranges
+        self.boundary = uuid4().hex
+        self.media_type = f"multipart/byteranges; boundary={self.boundary}"
+        self.headers = [
+            (
+                f"--{self.boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Range: {content_range(start, end, size)}\r\n\r\n"
+            ).encode()
+            for start, end in ranges
+        ]
+        self.closing = f"\r\n--{self.boundary}--\r\n".encode()
+
+    @property
+    def content_length(self) -> int:
+        length = sum(len(h) for h in self.headers) + len(self.closing)
+        # parts are separated by CRLF
+        length += 2 * (len(self.ranges) - 1)
+        return length + sum(end - start + 1 for start, end in self.ranges)
+
+    async def iter_bytes(
+        self, read: Callable[[int, int], AsyncIterator[bytes]]
+    ) -> AsyncIterator[bytes]:
+        """Stream parts, read(start, end) streaming a range of the file"""
+        for i, ((start, end), header) in enumerate(zip(self.ranges, self.headers)):
+            yield (b"\r\n" if i else b"") + header
+            async for chunk in read(start, end):
+                yield chunk
+        yield self.closing
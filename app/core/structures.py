@@ -0,0 +1,206 @@
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from bson.binary import Binary
+
+# structures (sites, cell, species of materials) are stored packed:
+#   sites/cell: {"shape": [n, 3], "dtype": "<f8", "data": BinData(float64 little endian)}
+#   species:    {"symbols": ["Li", "O"], "index": BinData(uint16 index of each site's symbol)}
+# Lists sent by clients are validated and packed at once with NumPy, packed
+# data read from MongoDB are decoded to lists only when encoded to JSON
+# (see models.iemap.ProjectQueryResult). Documents saved as lists are still read
+
+FLOAT_DTYPE = "<f8"
+INDEX_DTYPE = "<u2"
+
+
+class PackedArray:
+    """2D float64 array stored as BSON binary data, with `columns` columns
+    (and `rows` rows if not None)"""
+
+    rows: Optional[int] = None
+    columns: int = 3
+
+    __slots__ = ("shape", "data")
+
+    def __init__(self, shape: Tuple[int, int], data: bytes):
+        self.shape = shape
+        self.data = data
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict):
+        field_schema.update(
+            type="array", items={"type": "array", "items": {"type": "number"}}
+        )
+
+    @classmethod
+    def validate(cls, v: Any) -> "PackedArray":
+        if isinstance(v, PackedArray):
+            cls.check_shape(v.shape)
+            return v if isinstance(v, cls) else cls(v.shape, v.data)
+        if isinstance(v, dict):
+            # packed in MongoDB: kept encoded
+            try:
+                shape, data = tuple(v["shape"]), bytes(v["data"])
+            except (KeyError, TypeError):
+                raise ValueError("packed array requires shape and data")
+            if v.get("dtype", FLOAT_DTYPE) != FLOAT_DTYPE:
+                raise ValueError(f"unsupported dtype {v.get('dtype')}")
+            cls.check_shape(shape)
+            if len(data) != shape[0] * shape[1] * 8:
+                raise ValueError("packed array data do not match its shape")
+            return cls(shape, data)
+        try:
+            array = np.asarray(v, dtype=FLOAT_DTYPE)
+        except (TypeError, ValueError):
+            raise ValueError("value must be a list of lists of numbers")
+        if array.ndim != 2 and array.size == 0:
+            array = array.reshape(0, cls.columns)
+        if array.ndim != 2:
+            raise ValueError("value must be a list of lists of numbers")
+        cls.check_shape(array.shape)
+        if not np.isfinite(array).all():
+            raise ValueError("values must be finite numbers")
+        return cls(array.shape, array.tobytes())
+
+    @classmethod
+    def check_shape(cls, shape: Tuple[int, ...]):
+        if len(shape) != 2 or shape[1] != cls.columns:
+            raise ValueError(f"each row must have {cls.columns} values")
+        if cls.rows is not None and shape[0] != cls.rows:
+            raise ValueError(f"value must have {cls.rows} rows")
+
+    def to_numpy(self) -> np.ndarray:
+        return np.frombuffer(self.data, dtype=FLOAT_DTYPE).reshape(self.shape)
+
+    def tolist(self) -> List[List[float]]:
+        return self.to_numpy().tolist()
+
+    def to_bson(self) -> dict:
+        return {
+            "shape": list(self.shape),
+            "dtype": FLOAT_DTYPE,
+            "data": Binary(self.data),
+        }
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __eq__(self, other: Any) -> bool:
+        return (
+            isinstance(other, PackedArray)
+            and self.shape == other.shape
+            and self.data == other.data
+        )
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(shape={self.shape})"
+
+
+class SitesArray(PackedArray):
+    """Coordinates of sites: n rows [x, y, z]"""
+
+
+class CellArray(PackedArray):
+    """Lattice vectors: 3 rows [x, y, z]"""
+
+    rows = 3
+
+
+class PackedSpecies:
+    """Species of sites stored as distinct symbols and the index of each site's symbol"""
+
+    __slots__ = ("symbols", "index")
+
+    def __init__(self, symbols: List[str], index: bytes):
+        self.symbols = symbols
+        self.index = index
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict):
+        field_schema.update(type="array", items={"type": "string"})
+
+    @classmethod
+    def validate(cls, v: Any) -> "PackedSpecies":
+        if isinstance(v, cls):
+            return v
+        if isinstance(v, dict):
+            try:
+                symbols, index = list(v["symbols"]), bytes(v["index"])
+            except (KeyError, TypeError):
+                raise ValueError("packed species require symbols and index")
+            if len(index) % 2 or (
+                index and np.frombuffer(index, INDEX_DTYPE).max() >= len(symbols)
+            ):
+                raise ValueError("packed species index does not match symbols")
+            return cls(symbols, index)
+        if isinstance(v, str) or not all(isinstance(s, str) for s in v):
+            raise ValueError("value must be a list of strings")
+        symbols, index = np.unique(np.asarray(v, dtype=str), return_inverse=True)
+        if len(symbols) > np.iinfo(INDEX_DTYPE).max:
+            raise ValueError("too many distinct species")
+        return cls(symbols.tolist(), index.astype(INDEX_DTYPE).tobytes())
+
+    def tolist(self) -> List[str]:
+        symbols = np.asarray(self.symbols, dtype=object)
+        return symbols[np.frombuffer(self.index, dtype=INDEX_DTYPE)].tolist()
+
+    def to_bson(self) -> dict:
+        return {"symbols": self.symbols, "index": Binary(self.index)}
+
+    def __len__(self) -> int:
+        return len(self.index) // 2
+
+    def __eq__(self, other: Any) -> bool:
+        return (
+            isinstance(other, PackedSpecies)
+            and self.symbols == other.symbols
+            and self.index == other.index
+        )
+
+    def __repr__(self) -> str:
+        return f"PackedSpecies(symbols={self.symbols}, sites={len(self)})"
+
+
+# JSON encoders of packed values (Config.json_encoders of models returned to clients)
+STRUCTURE_JSON_ENCODERS = {
+    PackedArray: PackedArray.tolist,
+    PackedSpecies: PackedSpecies.tolist,
+}
+
+
+def encode_structures(doc: dict) -> dict:
+    """Replace packed values of material input/output of a project document
+    (as returned by .dict() of models) with their BSON form, in place"""
+    material = doc.get("material") or {}
+    for structure in (material.get("input"), material.get("output")):
+        if not structure:
+            continue
+        for field in ("sites", "cell", "species"):
+            if isinstance(structure.get(field), (PackedArray, PackedSpecies)):
+                structure[field] = structure[field].to_bson()
+    return doc
+
+
+def decode_structures(doc: dict) -> dict:
+    """Replace packed values of material input/output of a project document
+    read from MongoDB with lists (documents sent to clients as they are), in place"""
+    material = doc.get("material") or {}
+    for structure in (material.get("input"), material.get("output")):
+        if not structure:
+            continue
+        for field in ("sites", "cell"):
+            if isinstance(structure.get(field), dict):
+                structure[field] = PackedArray.validate(structure[field]).tolist()
+        if isinstance(structure.get("species"), dict):
+            species = PackedSpecies.validate(structure["species"])
+            structure["species"] = species.tolist()
+    return doc
@@ -0,0 +1,216 @@
+import hashlib
+import io
+import os
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, List, NamedTuple, Optional, Tuple
+
+import aiofiles
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from core.blobstore import BlobStore, blob_key
+from core.config import Config
+from crud.blob_refs import hold_blob
+from db.mongodb import AsyncIOMotorClient
+
+
+class StoredUpload(NamedTuple):
+    """File uploaded and saved in blob store as <hash>.<ext>"""
+
+    key: str
+    hash: str
+    size: int
+    ext: str
+    created: bool  # False if a file with the same content was already saved
+
+
+def copy_and_hash(
+    src: BinaryIO, dst: BinaryIO, chunk_size: int = Config.files_chunk_size
+) -> Tuple[str, int]:
+    """Copy src to dst in chunks computing SHA-1 of data on the fly
+    (blocking: to run in a worker thread)
+
+    Returns:
+        Tuple[str, int]: SHA-1 hex digest and number of bytes copied
+    """
+    h, size = hashlib.sha1(), 0
+    while chunk := src.read(chunk_size):
+        h.update(chunk)
+        dst.write(chunk)
+        size += len(chunk)
+    return h.hexdigest(), size
+
+
+def write_temp_and_hash(
+    src: BinaryIO, store: BlobStore, file_ext: str
+) -> Tuple[str, str, int]:
+    """Write src to a new (uniquely named) temporary file of the store staging
+    directory (compressed on the fly if the store does, see BlobStore.open_staging)
+
+    Returns:
+        Tuple[str, str, int]: temporary file path, SHA-1 hex digest and size
+    """
+    tmp_path, dst = store.open_staging(file_ext)
+    try:
+        with dst:
+            file_hash, size = copy_and_hash(src, dst)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, file_hash, size
+
+
+async def put_blob(
+    store: BlobStore,
+    tmp_path: str,
+    file_hash: str,
+    file_ext: str,
+    conn: Optional[AsyncIOMotorClient] = None,
+) -> bool:
+    """Move temporary file into the store as <sha1>.<ext>, holding the blob
+    first if conn is given (see crud.blob_refs.hold_blob)
+
+    Raises:
+        BlobBeingDeleted: if the garbage collector is deleting the blob
+
+    Returns:
+        bool: True if blob was created, False if it already existed
+    """
+    if conn is not None:
+        try:
+            await hold_blob(conn, file_hash, file_ext)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return await store.put_file(Path(tmp_path), blob_key(file_hash, file_ext))
+
+
+async def store_upload(
+    file: UploadFile, store: BlobStore, conn: Optional[AsyncIOMotorClient] = None
+) -> StoredUpload:
+    """Save uploaded file as <sha1>.<ext> in blob store reading its content once:
+    data are hashed while being written to a temporary file (in a worker thread)
+    which is then moved into the store, so that concurrent uploads of files having
+    the same name cannot overwrite each other
+
+    Args:
+        file (UploadFile): uploaded file
+        store (BlobStore): blob store where files are saved
+        conn (AsyncIOMotorClient, optional): if given, blob is held until attached (see put_blob)
+
+    Returns:
+        StoredUpload: blob key, hash, size (bytes), extension and if it was created
+    """
+    file_ext = file.filename.split(".")[-1]
+    try:
+        await file.seek(0)
+        tmp_path, file_hash, size = await run_in_threadpool(
+            write_temp_and_hash, file.file, store, file_ext
+        )
+    finally:
+        await file.close()
+    created = await put_blob(store, tmp_path, file_hash, file_ext, conn)
+    return StoredUpload(blob_key(file_hash, file_ext), file_hash, size, file_ext, created)
+
+
+async def store_bytes(
+    data: bytes,
+    store: BlobStore,
+    file_ext: str,
+    conn: Optional[AsyncIOMotorClient] = None,
+) -> StoredUpload:
+    """Save data (e.g. a file extracted from an archive) as <sha1>.<ext> in blob store
+    (held until attached if conn is given, see put_blob)
+
+    Returns:
+        StoredUpload: blob key, hash, size (bytes), extension and if it was created
+    """
+    tmp_path, file_hash, size = await run_in_threadpool(
+        write_temp_and_hash, io.BytesIO(data), store, file_ext
+    )
+    created = await put_blob(store, tmp_path, file_hash, file_ext, conn)
+    return StoredUpload(blob_key(file_hash, file_ext), file_hash, size, file_ext, created)
+
+
+class ChunkTooLarge(ValueError):
+    """Streamed data exceed the allowed size"""
+
+
+async def store_stream(
+    chunks: AsyncIterator[bytes], store: BlobStore, key: str, max_size: int
+) -> int:
+    """Save a stream of bytes (e.g. a raw request body, not spooled by
+    python-multipart) as blob key, replacing a previous blob with the same key
+
+    Args:
+        chunks (AsyncIterator[bytes]): data to save
+        store (BlobStore): blob store
+        key (str): blob key
+        max_size (int): max number of bytes accepted
+
+    Raises:
+        ChunkTooLarge: if data exceed max_size bytes
+
+    Returns:
+        int: number of bytes saved
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=store.staging_dir, prefix=".upload-", suffix=".part"
+    )
+    size = 0
+    try:
+        async with aiofiles.open(fd, "wb") as dst:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise ChunkTooLarge(f"More than {max_size} bytes")
+                await dst.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    await store.delete(key)
+    await store.put_file(Path(tmp_path), key)
+    return size
+
+
+async def assemble_blobs(
+    store: BlobStore,
+    part_keys: List[str],
+    file_ext: str,
+    conn: Optional[AsyncIOMotorClient] = None,
+) -> StoredUpload:
+    """Concatenate blobs (parts of a file uploaded in chunks) into a new blob
+    <sha1>.<ext>, the hash being computed while parts are copied (parts are kept)
+
+    Args:
+        store (BlobStore): blob store containing parts
+        part_keys (List[str]): keys of parts, in order
+        file_ext (str): extension of the assembled file
+        conn (AsyncIOMotorClient, optional): if given, blob is held until attached (see put_blob)
+
+    Returns:
+        StoredUpload: blob key, hash, size (bytes), extension and if it was created
+    """
+    tmp_path, dst = await run_in_threadpool(store.open_staging, file_ext)
+    h, size = hashlib.sha1(), 0
+
+    def write(dst: BinaryIO, chunk: bytes):
+        # hashlib releases the GIL on large buffers
+        h.update(chunk)
+        dst.write(chunk)
+
+    try:
+        try:
+            for part_key in part_keys:
+                async for chunk in store.iter_bytes(part_key):
+                    await run_in_threadpool(write, dst, chunk)
+                    size += len(chunk)
+        finally:
+            await run_in_threadpool(dst.close)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    file_hash = h.hexdigest()
+    created = await put_blob(store, tmp_path, file_hash, file_ext, conn)
+    return StoredUpload(blob_key(file_hash, file_ext), file_hash, size, file_ext, created)
@@ -2,25 +2,34 @@ import enum
 import hashlib
 import json
 import logging
+import mimetypes
 from os import path
-from typing import Union
+from typing import AsyncIterator, Optional
 
 from sentry_sdk import capture_exception
 
 logger = logging.getLogger("ai4mat")
-# from aiofiles.os import rename, remove
-import aiofiles
-from os import rename, remove
-
-from pathlib import Path, PosixPath
 from math import modf, trunc
 from bson.objectid import ObjectId
 from fastapi.encoders import jsonable_encoder
-from fastapi import HTTPException, UploadFile, status
+from fastapi import HTTPException, Request, UploadFile, status
 from pydantic import BaseModel
-from starlette.responses import JSONResponse
-from core.parsing import parse_cif
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from core.config import Config
+from core.blobstore import BlobStore
+from core.ranges import (
+    MultipartRanges,
+    RangeNotSatisfiable,
+    accepts_encoding,
+    content_range,
+    etag_matches,
+    http_date,
+    parse_range,
+    strong_etag,
+)
+from core.uploads import store_upload
+from crud.blob_refs import BlobBeingDeleted
+from db.mongodb import AsyncIOMotorClient
 
 
 def create_aliased_response(model: BaseModel) -> JSONResponse:
@@ -107,7 +116,19 @@ def get_str_file_size(file_name: str, size_type: SIZE_UNIT = None) -> str:
     Returns:
         str: file size in KB, MB or GB
     """
-    size = path.getsize(file_name)
+    return get_str_size(path.getsize(file_name), size_type)
+
+
+def get_str_size(size: int, size_type: SIZE_UNIT = None) -> str:
+    """Get size in bytes in given unit like KB, MB or GB
+
+    Args:
+        size (int): size in bytes
+        size_type (SIZE_UNIT, optional): preferred size format (default to None).
+
+    Returns:
+        str: size in KB, MB or GB
+    """
     if size_type:
         size_converted = convert_unit(size, size_type)
         return str(truncate(size_converted, 3)) + " " + size_type.name
@@ -120,15 +141,19 @@ def get_str_file_size(file_name: str, size_type: SIZE_UNIT = None) -> str:
             return str(size_truncated) + " " + size_type.name
 
 
-async def save_file(file: UploadFile, upload_dir: str):
-    """Save file to upload directory
+async def save_file(
+    file: UploadFile, store: BlobStore, conn: Optional[AsyncIOMotorClient] = None
+):
+    """Save file to blob store
 
     Args:
         file (UploadFile): file to save
-        upload_dir (str): base dir where to save file
+        store (BlobStore): blob store where to save file
+        conn (AsyncIOMotorClient, optional): if given, file is held until attached (see core.uploads.put_blob)
 
     Raises:
         HTTPException: HTTP Error 400 if file is not valid
+        HTTPException: HTTP Error 409 if a file with the same content is being deleted
         HTTPException: HTTP Error 500 if file cannot be saved
 
     Returns:
@@ -140,36 +165,15 @@ async def save_file(file: UploadFile, upload_dir: str):
     """
     if file.content_type not in Config.allowed_mime_types:
         raise HTTPException(400, detail="Invalid document type")
-    # retrieve file extension
-    file_ext = file.filename.split(".")[-1]
-
-    # get directory path for uploaded_dir (abs path)
-    base_dir = Path(path.dirname(path.realpath(__file__))).parent.parent / upload_dir
-
-    # path for file to write on file system
-    file_to_write = path.join(base_dir, file.filename)
-
-    # print(f"{upload_dir}/{file.filename}")
-    # print(file_to_write)
-
-    # write file to disk in chunks
-    file_hash, str_file_size = None, None
     try:
-        with open(file_to_write, "wb+") as file_object:
-            # SLOWER VERSION BUT DOES NOT LOAD ENTIRE FILE IN MEMORY
-            async with aiofiles.open(file_to_write, "wb") as out_file:
-                while content := await file.read(
-                    Config.files_chunk_size
-                ):  # async read chunk
-                    await out_file.write(content)  # async write chunk
-            file_hash = hash_file(file_to_write)
-            # full path of new file name
-            new_file_name = path.join(base_dir, f"{file_hash}.{file_ext}")
-            rename(file_to_write, new_file_name)
-        str_file_size = get_str_file_size(new_file_name)
+        # hash while writing, then rename to <hash>.<ext> (see core.uploads)
+        stored = await store_upload(file, store, conn)
+        str_file_size = get_str_size(stored.size)
+    except BlobBeingDeleted as e:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=str(e))
     except Exception as e:
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
-    return file_hash, str_file_size, file_ext
+    return stored.hash, str_file_size, stored.ext
 
 
 class JSONEncoder(json.JSONEncoder):
@@ -179,77 +183,137 @@ class JSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
 
-def get_dir_uploaded(upload_dir: str) -> Path:
-    """Get full path of upload directory
+async def delete_file_with_hash(file_key: str, store: BlobStore) -> bool:
+    """Delete file from blob store having the provided hash
 
     Args:
-        upload_dir (str): directory name where to save file
-
+        file_key (str): HASH and extension of file to delete (<hash>.<ext>)
+        store (BlobStore): blob store containing all uploaded files
     Returns:
-        str: full path of upload directory
-    """
-    return (
-        Path.cwd().parent / upload_dir
-        if "app" in str(Path.cwd()).split("/")
-        else Path.cwd() / upload_dir
-    )
-
-
-async def rename_file_with_its_hash(
-    file_to_write: PosixPath, file_ext: str, upload_dir: str
-) -> Union[str, None]:
-    """Rename file with its hash if it already DOES NOT exists
-       otherwise delete file (not yet renamed with its hash)
+        bool: True if file successfully deleted
 
-    Args:
-        file_to_write (PosixPath): full path file to write
-        file_ext (str): file extention to
-        upload_dir (str): name folder where save data
-    Returns:
-        str|None: new file name (hash+original extention) or None if file yet existing (no overwrite allowed)
-        bool: True if a new file was saved on File System and False if file already on File System
     """
-    # compute file hashing (data saved in chunk)
-    # hash computed after saving file with its original name
+
     try:
-        hash = hash_file(file_to_write)
-        # get new file name = HASH+extention
-        new_file_name = get_dir_uploaded(upload_dir) / f"{hash}.{file_ext}"
-        if not new_file_name.exists():
-            # await rename(file_to_write, new_file_name)
-            rename(file_to_write, new_file_name)
-            return new_file_name, True
-        else:
-            # delete original file before returning None, i.e. no file uploaded
-            # await remove(file_to_write)
-            remove(file_to_write)
-            return new_file_name, False
+        return await store.delete(file_key)
     except Exception as e:
         logger.error(e)
         capture_exception(e)
 
 
-async def delete_file_with_hash(file_hash: str, upload_dir: str) -> bool:
-    """Delete file from FS having the provided hash
+async def blob_response(
+    store: BlobStore, key: str, request: Optional[Request] = None
+) -> Response:
+    """Response with content of a blob (local files are sent by FileResponse,
+    others are streamed from the store). Blobs never change, so the SHA-1 is sent
+    as strong ETag with an immutable Cache-Control, conditional (If-None-Match)
+    and range (Range, If-Range) requests are handled. Compressed blobs are sent
+    as stored (Content-Encoding) to clients accepting their coding
 
     Args:
-        file_hash (str): HASH file to delete
-        upload_dir (str): path folder containing all uploadd files
-    Returns:
-        bool: True if file successfully deleted
+        store (BlobStore): blob store containing all uploaded files
+        key (str): file name expressed as <hash>.<extension>
+        request (Request, optional): request to read conditional/range headers from
 
-    """
+    Raises:
+        HTTPException: HTTP_404_NOT_FOUND if file was not found
 
+    Returns:
+        Response: binary stream of file (200), some ranges of it (206),
+        Not Modified (304) or Range Not Satisfiable (416)
+    """
     try:
-        path_file_to_delete = get_dir_uploaded(upload_dir) / file_hash
-        if path_file_to_delete.exists():
-            await aiofiles.os.remove(path_file_to_delete)
-            return True
-        else:
-            return False
-    except Exception as e:
-        logger.error(e)
-        capture_exception(e)
+        info = await store.stat(key)
+    except ValueError:
+        info = None
+    if info is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="File not found!!")
+    etag = strong_etag(key)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(info.modified),
+        "Cache-Control": Config.files_cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    request_headers = request.headers if request is not None else {}
+    if info.encoding is not None:
+        # same URL sends compressed or decompressed content
+        headers["Vary"] = "Accept-Encoding"
+        encoded_etag = strong_etag(key, info.encoding)
+        if accepts_encoding(request_headers.get("accept-encoding"), info.encoding):
+            headers["ETag"] = encoded_etag
+        if etag_matches(request_headers.get("if-none-match"), encoded_etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if etag_matches(request_headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    if_range = request_headers.get("if-range")
+    ranges = None
+    if if_range is None or etag_matches(if_range, etag, weak=False):
+        try:
+            ranges = parse_range(request_headers.get("range"), info.size)
+        except RangeNotSatisfiable as e:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": str(e)},
+            )
+    if ranges is None and headers["ETag"] != etag:
+        # compressed blob sent as it is stored, decompressed by client
+        return StreamingResponse(
+            store.iter_stored(key),
+            media_type=media_type,
+            headers={
+                **headers,
+                "Content-Encoding": info.encoding,
+                "Content-Length": str(info.stored_size),
+            },
+        )
+    # ranges (and 200 to clients not accepting the coding) refer to decompressed content
+    headers["ETag"] = etag
+    if ranges is None:
+        local_path = store.local_path(key)
+        if local_path is not None:
+            return FileResponse(local_path, media_type=media_type, headers=headers)
+        return StreamingResponse(
+            store.iter_bytes(key),
+            media_type=media_type,
+            headers={**headers, "Content-Length": str(info.size)},
+        )
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return StreamingResponse(
+            store.iter_bytes(key, start, end),
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            media_type=media_type,
+            headers={
+                **headers,
+                "Content-Range": content_range(start, end, info.size),
+                "Content-Length": str(end - start + 1),
+            },
+        )
+    body = MultipartRanges(ranges, info.size, media_type)
+    return StreamingResponse(
+        body.iter_bytes(lambda start, end: store.iter_bytes(key, start, end)),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=body.media_type,
+        headers={**headers, "Content-Length": str(body.content_length)},
+    )
+
+
+async def ndjson_lines(rows: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Stream JSON documents as newline delimited JSON (one document per line)"""
+    async for row in rows:
+        yield row + "\n"
+
+
+async def json_array_chunks(rows: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Stream JSON documents as a single JSON array (one chunk per document)"""
+    separator = "["
+    async for row in rows:
+        yield separator + row
+        separator = ","
+    yield "[]" if separator == "[" else "]"
 
 
 def get_value_float_or_str(x):
@@ -0,0 +1,93 @@
+import logging
+import re
+import zipfile
+from typing import AsyncIterator, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from core.blobstore import BlobStore
+from core.config import Config
+
+logger = logging.getLogger("ai4mat")
+
+
+class ZipSink:
+    """Write-only file collecting data written by ZipFile until drained
+    (not seekable: ZipFile writes sizes and CRC in data descriptors)"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def entry_name(name: str, ext: str, used: Set[str], folder: str = "") -> str:
+    """Name of a ZIP entry as <folder>/<name>.<ext> (unique in archive,
+    no directory traversal)"""
+    name = re.sub(r"[\\/\x00]", "_", name).strip(". ") or "file"
+    ext = re.sub(r"[^A-Za-z0-9]", "", ext)
+    base = f"{folder}/{name}" if folder else name
+    arcname, n = f"{base}.{ext}", 1
+    while arcname.lower() in used:
+        n += 1
+        arcname = f"{base} ({n}).{ext}"
+    used.add(arcname.lower())
+    return arcname
+
+
+async def zip_blobs(
+    store: BlobStore, entries: AsyncIterator[Tuple[str, str]]
+) -> AsyncIterator[bytes]:
+    """Stream a ZIP archive (ZIP64 when needed) of blobs, read from store while
+    archive is sent (no temporary files, memory bounded by files chunk size).
+    Already compressed formats (Config.zip_stored_extensions) are stored, others deflated.
+    Missing blobs are skipped
+
+    Args:
+        store (BlobStore): blob store containing files
+        entries (AsyncIterator[Tuple[str, str]]): name of entry in archive and blob key
+
+    Yields:
+        bytes: ZIP archive data
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        async for arcname, key in entries:
+            info = await store.stat(key)
+            if info is None:
+                logger.warning(f"File {key} ({arcname}) not found, not added to ZIP")
+                continue
+            # ZIP dates start from 1980
+            date_time = max(info.modified.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+            zinfo = zipfile.ZipInfo(arcname, date_time)
+            stored = key.split(".")[-1].lower() in Config.zip_stored_extensions
+            zinfo.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            # size is known in advance: ZipFile switches to ZIP64 if needed
+            zinfo.file_size = info.size
+            with zf.open(zinfo, "w") as dst:
+                async for chunk in store.iter_bytes(key):
+                    if stored:
+                        dst.write(chunk)
+                    else:
+                        await run_in_threadpool(dst.write, chunk)
+                    if data := sink.drain():
+                        yield data
+            # data descriptor
+            yield sink.drain()
+    # central directory
+    yield sink.drain()
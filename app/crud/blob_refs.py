@@ -0,0 +1,297 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from core.blobstore import BlobStore, blob_key
+from core.config import Config
+from crud.pipelines import get_blob_ref_counts
+from db.mongodb import AsyncIOMotorClient
+
+logger = logging.getLogger("ai4mat")
+
+database_name, ai4mat_collection_name = (Config.mongo_db, Config.mongo_coll)
+blob_refs_collection_name = Config.mongo_coll_blob_refs
+
+# a blob reference document is
+# {"_id": "<sha1>.<ext>", "hash": "<sha1>", "ext": "<ext>", "refs": int,
+#  "zeroSince": datetime | None, "deleting": bool, "deletingSince": datetime,
+#  "refsAt": datetime}
+# refs is the number of projects' files and properties entries pointing to the
+# blob, zeroSince is set when refs drops to 0 (blob is deleted after a grace
+# period), deleting is set by the garbage collector while it deletes the blob
+# (blobs are held before being stored or attached, which is refused meanwhile,
+# see hold_blob), refsAt is the last time refs was counted or incremented
+
+
+class BlobBeingDeleted(Exception):
+    """Raised when a blob is held while the garbage collector deletes it"""
+
+
+def project_blobs(doc: dict) -> List[Tuple[str, str]]:
+    """(hash, ext) of blobs referenced by a project: files, files of properties
+    ("<sha1>.<ext>", see crud.projects.add_property_file) and files of process
+    properties ({"hash", "extention"}, see crud.projects.add_property)"""
+    blobs = [
+        (f["hash"], f["extention"])
+        for f in doc.get("files") or []
+        if f.get("hash") and f.get("extention")
+    ]
+    for prop in doc.get("properties") or []:
+        key = prop.get("file") if isinstance(prop, dict) else None
+        if isinstance(key, str) and "." in key:
+            file_hash, _, file_ext = key.partition(".")
+            blobs.append((file_hash, file_ext))
+    for prop in (doc.get("process") or {}).get("properties") or []:
+        file = prop.get("file") if isinstance(prop, dict) else None
+        if isinstance(file, dict) and file.get("hash") and file.get("extention"):
+            blobs.append((file["hash"], file["extention"]))
+    return blobs
+
+
+# fields of projects holding blob references (see project_blobs)
+BLOB_FIELDS = {
+    "files.hash": 1,
+    "files.extention": 1,
+    "properties.file": 1,
+    "process.properties.file": 1,
+}
+
+
+def blob_references_filter(file_hash: str, file_ext: str) -> dict:
+    """Filter of projects referencing a blob (files or properties files)"""
+    return {
+        "$or": [
+            {"files": {"$elemMatch": {"hash": file_hash, "extention": file_ext}}},
+            {"properties.file": blob_key(file_hash, file_ext)},
+            {
+                "process.properties": {
+                    "$elemMatch": {"file.hash": file_hash, "file.extention": file_ext}
+                }
+            },
+        ]
+    }
+
+
+async def add_blob_ref(
+    conn: AsyncIOMotorClient, file_hash: str, file_ext: str, n: int = 1
+):
+    """Increment references to a blob (a file was attached to a project),
+    the blob must have been held first (see hold_blob)"""
+    await conn[database_name][blob_refs_collection_name].update_one(
+        {"_id": blob_key(file_hash, file_ext)},
+        {
+            "$inc": {"refs": n},
+            "$set": {
+                "hash": file_hash,
+                "ext": file_ext,
+                "zeroSince": None,
+                "deleting": False,
+                "refsAt": datetime.utcnow(),
+            },
+        },
+        upsert=True,
+    )
+
+
+async def hold_blob(conn: AsyncIOMotorClient, file_hash: str, file_ext: str):
+    """Keep a blob from being deleted for the grace period, to call before the
+    blob is stored (or attached by hash) so that it is not deleted before it is
+    attached, unreferenced blobs held are collected after the grace period
+
+    Raises:
+        BlobBeingDeleted: if the garbage collector is deleting the blob
+                          (retry once it is deleted, the blob is then stored again)
+    """
+    coll = conn[database_name][blob_refs_collection_name]
+    key = blob_key(file_hash, file_ext)
+    not_deleting = {"_id": key, "deleting": {"$ne": True}}
+    # restart the grace period (garbage collector claims only expired ones)
+    await coll.update_one(
+        {**not_deleting, "refs": {"$lte": 0}}, {"$set": {"zeroSince": datetime.utcnow()}}
+    )
+    try:
+        # then make sure the blob was not claimed before
+        await coll.update_one(
+            not_deleting,
+            {
+                "$setOnInsert": {
+                    "hash": file_hash,
+                    "ext": file_ext,
+                    "refs": 0,
+                    "zeroSince": datetime.utcnow(),
+                    "deleting": False,
+                }
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        raise BlobBeingDeleted(f"File {key} is being deleted, retry later")
+
+
+async def release_blob_ref(
+    conn: AsyncIOMotorClient, file_hash: str, file_ext: str, n: int = 1
+) -> int:
+    """Decrement references to a blob (a file was removed from a project)
+
+    Returns:
+        int: number of references left (the blob is garbage once it is 0)
+    """
+    coll = conn[database_name][blob_refs_collection_name]
+    key = blob_key(file_hash, file_ext)
+    after = await coll.find_one_and_update(
+        {"_id": key},
+        {"$inc": {"refs": -n}, "$setOnInsert": {"hash": file_hash, "ext": file_ext}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if after["refs"] <= 0:
+        # blobs attached before references were counted go negative
+        # (the sweeper checks projects again before deleting anything)
+        await coll.update_one({"_id": key, "refs": {"$lt": 0}}, {"$set": {"refs": 0}})
+        # start grace period unless references were added in the meantime
+        await coll.update_one(
+            {"_id": key, "refs": {"$lte": 0}, "zeroSince": None},
+            {"$set": {"zeroSince": datetime.utcnow()}},
+        )
+    return max(after["refs"], 0)
+
+
+async def count_blob_references(
+    conn: AsyncIOMotorClient, file_hash: str, file_ext: str
+) -> int:
+    """Number of references to a blob counted on projects
+    (counters of blob_refs could have drifted), each branch of
+    blob_references_filter is served by an index (see db.indexes)"""
+    key = blob_key(file_hash, file_ext)
+    n = 0
+    async for doc in conn[database_name][ai4mat_collection_name].find(
+        blob_references_filter(file_hash, file_ext), BLOB_FIELDS
+    ):
+        n += sum(1 for blob in project_blobs(doc) if blob_key(*blob) == key)
+    return n
+
+
+async def sweep_blobs(
+    conn: AsyncIOMotorClient, store: BlobStore, grace: float = Config.blob_gc_grace
+) -> int:
+    """Delete blobs without references since more than grace seconds
+
+    The reference document is claimed (marked as deleting) before the blob is
+    deleted: holding the blob (upload of the same content, attach by hash) is
+    refused until the reference document is removed, blobs are never deleted
+    while held since holding restarts the grace period (see hold_blob)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        store (BlobStore): blob store containing files
+        grace (float, optional): seconds to wait before deleting. Defaults to Config.blob_gc_grace.
+
+    Returns:
+        int: number of blobs deleted
+    """
+    coll = conn[database_name][blob_refs_collection_name]
+    now = datetime.utcnow()
+    # release claims of collectors stopped while deleting (deleted next time)
+    await coll.update_many(
+        {
+            "deleting": True,
+            "deletingSince": {
+                "$lte": now - timedelta(seconds=Config.blob_gc_claim_ttl)
+            },
+        },
+        {"$set": {"deleting": False}},
+    )
+    garbage = {
+        "refs": {"$lte": 0},
+        "zeroSince": {"$ne": None, "$lte": now - timedelta(seconds=grace)},
+        "deleting": {"$ne": True},
+    }
+    deleted = 0
+    async for ref in coll.find(garbage):
+        claimed = await coll.update_one(
+            {"_id": ref["_id"], **garbage},
+            {"$set": {"deleting": True, "deletingSince": datetime.utcnow()}},
+        )
+        if claimed.modified_count == 0:
+            continue
+        # double check on projects (counters could have drifted)
+        n = await count_blob_references(conn, ref["hash"], ref["ext"])
+        if n > 0:
+            logger.warning(f"Blob {ref['_id']} still referenced {n} times, kept")
+            await add_blob_ref(conn, ref["hash"], ref["ext"], n)
+            continue
+        existed = await store.delete(ref["_id"])
+        released = await coll.delete_one({"_id": ref["_id"], "deleting": True})
+        if released.deleted_count == 0:
+            # only attaching without holding the blob clears the claim
+            logger.error(f"Blob {ref['_id']} attached while deleted")
+        elif existed:
+            deleted += 1
+    if deleted:
+        logger.info(f"Blob garbage collection deleted {deleted} files")
+    return deleted
+
+
+async def reconcile_blob_refs(conn: AsyncIOMotorClient, batch_size: int = 1000) -> int:
+    """Recompute references of blobs from projects' files and properties files
+    (blobs no longer referenced start their grace period)
+
+    References are counted by the DB (get_blob_ref_counts), documents counted
+    are stamped with the time of the run so that the ones not stamped (and not
+    incremented meanwhile) are known to be no longer referenced
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        batch_size (int, optional): reference documents written at once. Defaults to 1000.
+
+    Returns:
+        int: number of blobs referenced
+    """
+    coll = conn[database_name][ai4mat_collection_name]
+    refs_coll = conn[database_name][blob_refs_collection_name]
+    started = datetime.utcnow()
+    referenced, batch = 0, []
+    async for row in coll.aggregate(get_blob_ref_counts(), allowDiskUse=True):
+        file_hash, _, file_ext = row["_id"].partition(".")
+        if not file_ext:
+            continue
+        batch.append(
+            UpdateOne(
+                {"_id": row["_id"]},
+                {
+                    "$set": {
+                        "hash": file_hash,
+                        "ext": file_ext,
+                        "refs": row["refs"],
+                        "zeroSince": None,
+                        "refsAt": started,
+                    },
+                    "$setOnInsert": {"deleting": False},
+                },
+                upsert=True,
+            )
+        )
+        referenced += 1
+        if len(batch) == batch_size:
+            await refs_coll.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await refs_coll.bulk_write(batch, ordered=False)
+    await refs_coll.update_many(
+        {
+            "$or": [{"refsAt": {"$lt": started}}, {"refsAt": {"$exists": False}}],
+            "zeroSince": None,
+            "deleting": {"$ne": True},
+        },
+        {"$set": {"refs": 0, "zeroSince": datetime.utcnow()}},
+    )
+    return referenced
+
+
+async def get_blob_refs(conn: AsyncIOMotorClient, key: str) -> Optional[int]:
+    """Number of references to blob key (None if never referenced)"""
+    ref = await conn[database_name][blob_refs_collection_name].find_one({"_id": key})
+    return None if ref is None else max(ref["refs"], 0)
@@ -0,0 +1,202 @@
+from collections import Counter
+from datetime import datetime
+from bisect import bisect_left
+from heapq import nlargest
+from typing import List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from core.cache import TTLCache
+from core.config import Config
+from db.mongodb import AsyncIOMotorClient
+from crud.pipelines import get_catalog_counts
+
+database_name, ai4mat_collection_name = (Config.mongo_db, Config.mongo_coll)
+catalog_collection_name = Config.mongo_coll_catalog
+
+# values read from the catalog (/stats_iemap), dropped every time catalog is written
+catalog_cache = TTLCache(ttl=Config.stats_cache_ttl, maxsize=16)
+
+
+def invalidate_catalog() -> None:
+    """Mark values read from the catalog as stale, to call once catalog
+    has been written (so that no request caches the previous catalog)"""
+    catalog_cache.invalidate()
+    formula_index.mark_stale()
+
+
+def catalog_entries(material: Optional[dict]) -> List[tuple]:
+    """Catalog entries (kind, value) of a project's material:
+    its formula and its distinct elements"""
+    if not material or not material.get("formula"):
+        return []
+    entries = [("formula", material["formula"])]
+    entries.extend(("element", e) for e in sorted(set(material.get("elements") or [])))
+    return entries
+
+
+async def update_catalog(
+    conn: AsyncIOMotorClient, material: Optional[dict], increment: int = 1
+):
+    """Update occurrences of formula and elements of a material,
+    to call when a project is inserted (increment=1) or deleted (increment=-1)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        material (dict): material of the project written
+        increment (int, optional): 1 for inserted, -1 for deleted. Defaults to 1.
+    """
+    await update_catalog_many(conn, [material], increment)
+
+
+async def update_catalog_many(
+    conn: AsyncIOMotorClient, materials: List[Optional[dict]], increment: int = 1
+):
+    """Update occurrences of formulas and elements of many materials at once
+    (projects inserted or deleted in bulk), see update_catalog"""
+    entries = Counter(e for material in materials for e in catalog_entries(material))
+    if not entries:
+        return
+    coll = conn[database_name][catalog_collection_name]
+    now = datetime.utcnow()
+    await coll.bulk_write(
+        [
+            UpdateOne(
+                {"_id": f"{kind}:{value}"},
+                {
+                    "$inc": {"count": increment * n},
+                    "$set": {"kind": kind, "value": value, "updatedAt": now},
+                },
+                upsert=True,
+            )
+            for (kind, value), n in entries.items()
+        ],
+        ordered=False,
+    )
+    if increment < 0:
+        await coll.delete_many(
+            {"_id": {"$in": [f"{k}:{v}" for k, v in entries]}, "count": {"$lte": 0}}
+        )
+    invalidate_catalog()
+
+
+async def reconcile_catalog(conn: AsyncIOMotorClient, batch_size: int = 1000) -> int:
+    """Recompute whole catalog from projects collection
+    (fixes drift caused e.g. by failed writes or documents edited by hand)
+
+    Entries counted are stamped with the time of the run (reconciledAt),
+    entries incremented meanwhile (updatedAt, see update_catalog_many) are left
+    as they are, entries neither stamped nor incremented have no projects
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        batch_size (int, optional): catalog entries written at once. Defaults to 1000.
+
+    Returns:
+        int: number of catalog entries
+    """
+    coll = conn[database_name][ai4mat_collection_name]
+    catalog = conn[database_name][catalog_collection_name]
+    started = datetime.utcnow()
+    not_updated = {
+        "$or": [{"updatedAt": {"$lt": started}}, {"updatedAt": {"$exists": False}}]
+    }
+
+    async def write(batch: List[UpdateOne]):
+        try:
+            await catalog.bulk_write(batch, ordered=False)
+        except BulkWriteError as e:
+            # upserts of entries incremented since the run started
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+
+    entries, batch = 0, []
+    for kind in ("formula", "element"):
+        async for row in coll.aggregate(get_catalog_counts(kind), allowDiskUse=True):
+            batch.append(
+                UpdateOne(
+                    {"_id": f"{kind}:{row['_id']}", **not_updated},
+                    {
+                        "$set": {
+                            "kind": kind,
+                            "value": row["_id"],
+                            "count": row["count"],
+                            "reconciledAt": started,
+                        }
+                    },
+                    upsert=True,
+                )
+            )
+            entries += 1
+            if len(batch) == batch_size:
+                await write(batch)
+                batch = []
+    if batch:
+        await write(batch)
+    await catalog.delete_many({"reconciledAt": {"$ne": started}, **not_updated})
+    invalidate_catalog()
+    return entries
+
+
+async def get_catalog(conn: AsyncIOMotorClient) -> dict:
+    """Get distinct formulas and elements with their number of projects
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+
+    Returns:
+        dict: {"formulas": {formula: count}, "elements": {element: count}}
+    """
+    coll = conn[database_name][catalog_collection_name]
+    catalog = {"formula": {}, "element": {}}
+    async for entry in coll.find({"count": {"$gt": 0}}).sort("value", 1):
+        catalog[entry["kind"]][entry["value"]] = entry["count"]
+    return {"formulas": catalog["formula"], "elements": catalog["element"]}
+
+
+class FormulaIndex:
+    """Sorted in-memory index of catalog formulas for prefix search
+    (reloaded from catalog when stale or older than ttl seconds,
+    so that writes made by other API replicas are eventually seen)
+    """
+
+    def __init__(self, ttl: float):
+        # single entry: (keys, items), concurrent reloads share a single query
+        self.cache = TTLCache(ttl=ttl, maxsize=1)
+
+    def mark_stale(self):
+        self.cache.invalidate()
+
+    async def load(self, conn: AsyncIOMotorClient) -> Tuple[List[str], List[tuple]]:
+        coll = conn[database_name][catalog_collection_name]
+        formulas = await coll.find(
+            {"kind": "formula", "count": {"$gt": 0}}, {"_id": 0, "value": 1, "count": 1}
+        ).to_list(None)
+        items = sorted((f["value"].casefold(), f["value"], f["count"]) for f in formulas)
+        return [i[0] for i in items], items
+
+    async def search(
+        self, conn: AsyncIOMotorClient, prefix: str, limit: int = 10
+    ) -> List[dict]:
+        """Get formulas starting with prefix (case insensitive), most used first
+
+        Args:
+            conn (AsyncIOMotorClient): Motor MongoDB client connection
+            prefix (str): beginning of formula
+            limit (int, optional): max number of results. Defaults to 10.
+
+        Returns:
+            List[dict]: [{"formula": str, "count": int}]
+        """
+        keys, items = await self.cache.get_or_compute(
+            "formulas", lambda: self.load(conn)
+        )
+        prefix = prefix.casefold()
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + "￿", lo=start)
+        best = nlargest(limit, items[start:end], key=lambda i: i[2])
+        return [{"formula": formula, "count": count} for _, formula, count in best]
+
+
+formula_index = FormulaIndex(ttl=Config.catalog_index_ttl)
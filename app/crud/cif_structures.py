@@ -0,0 +1,50 @@
+import logging
+from datetime import datetime
+from typing import Iterable, Optional
+
+from pymongo.errors import DocumentTooLarge, DuplicateKeyError
+
+from core.config import Config
+from db.mongodb import AsyncIOMotorClient
+
+logger = logging.getLogger("ai4mat")
+
+database_name = Config.mongo_db
+cif_structures_collection_name = Config.mongo_coll_cif_structures
+
+# parsed CIF files, keyed by SHA-1 of their content:
+# {"_id": sha1, "version": int, "formula", "elements", "lattice", "cell", "sites",
+#  "species", "createdAt"} or {"_id": sha1, "version": int, "error": str, "createdAt"}
+# for files pymatgen cannot parse. Entries of an older parser version are ignored
+
+
+async def get_cif_structure(
+    conn: AsyncIOMotorClient, sha1: str, version: int
+) -> Optional[dict]:
+    return await conn[database_name][cif_structures_collection_name].find_one(
+        {"_id": sha1, "version": version}, {"_id": 0, "version": 0, "createdAt": 0}
+    )
+
+
+async def save_cif_structure(
+    conn: AsyncIOMotorClient, sha1: str, version: int, data: dict
+):
+    """Cache parsed data of CIF file sha1 (replacing entries of older versions)"""
+    try:
+        await conn[database_name][cif_structures_collection_name].replace_one(
+            {"_id": sha1},
+            {**data, "version": version, "createdAt": datetime.utcnow()},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # same file parsed concurrently by another process
+        pass
+    except DocumentTooLarge:
+        logger.warning(f"Parsed CIF {sha1} too large to be cached")
+
+
+async def delete_cif_structures(conn: AsyncIOMotorClient, sha1s: Iterable[str]) -> int:
+    result = await conn[database_name][cif_structures_collection_name].delete_many(
+        {"_id": {"$in": list(sha1s)}}
+    )
+    return result.deleted_count
@@ -0,0 +1,55 @@
+from bson import json_util
+from core.cache import TTLCache
+from core.config import Config
+from db.mongodb import AsyncIOMotorClient
+
+database_name, ai4mat_collection_name = (Config.mongo_db, Config.mongo_coll)
+
+# cached number of documents matching a filter (keyed by canonical filter)
+filtered_counts = TTLCache(ttl=Config.count_cache_ttl, maxsize=1024)
+
+
+def count_key(query: dict) -> str:
+    """Canonical representation of a filter (independent of keys order)"""
+    return json_util.dumps(query, sort_keys=True)
+
+
+async def count_all(conn: AsyncIOMotorClient) -> int:
+    """Get total number of projects from collection metadata
+    (no collection scan, the value is an estimate)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+
+    Returns:
+        int: estimated number of documents in collection
+    """
+    coll = conn[database_name][ai4mat_collection_name]
+    return await coll.estimated_document_count()
+
+
+async def count_filtered(conn: AsyncIOMotorClient, query: dict) -> int:
+    """Get number of projects matching query, the result is cached
+    for Config.count_cache_ttl seconds (or until next write)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        query (dict): MongoDB filter
+
+    Returns:
+        int: number of documents matching query
+    """
+    if len(query) == 0:
+        return await count_all(conn)
+    key = count_key(query)
+    n_docs = filtered_counts.get(key)
+    if n_docs is None:
+        coll = conn[database_name][ai4mat_collection_name]
+        n_docs = await coll.count_documents(query)
+        filtered_counts.set(key, n_docs)
+    return n_docs
+
+
+def invalidate_counts() -> None:
+    """Drop cached counts, to call every time projects are written"""
+    filtered_counts.invalidate()
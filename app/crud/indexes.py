@@ -0,0 +1,88 @@
+import logging
+from pymongo.errors import OperationFailure
+
+from core.config import Config
+from db.indexes import INDEXES
+from db.mongodb import AsyncIOMotorClient
+
+logger = logging.getLogger("ai4mat")
+
+database_name = Config.mongo_db
+
+
+async def index_usage(conn: AsyncIOMotorClient) -> dict:
+    """Get usage of indexes ($indexStats) for every collection in registry
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+
+    Returns:
+        dict: {collection: [{"name", "key", "ops", "since", "declared", "unused"}]}
+    """
+    result = {}
+    for collection_name, indexes in INDEXES.items():
+        declared_names = {index.document["name"] for index in indexes}
+        coll = conn[database_name][collection_name]
+        stats = await coll.aggregate([{"$indexStats": {}}]).to_list(None)
+        result[collection_name] = sorted(
+            [
+                {
+                    "name": s["name"],
+                    "key": s["key"],
+                    "ops": s["accesses"]["ops"],
+                    "since": s["accesses"]["since"],
+                    "declared": s["name"] in declared_names,
+                    "unused": s["accesses"]["ops"] == 0,
+                }
+                for s in stats
+            ],
+            key=lambda x: x["ops"],
+        )
+    return result
+
+
+async def collection_scans(conn: AsyncIOMotorClient, limit: int = 20) -> dict:
+    """Get collection scans executed by server and (if profiler is enabled)
+    the latest profiled operations on registry collections using a COLLSCAN plan
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        limit (int, optional): max number of profiled operations. Defaults to 20.
+
+    Returns:
+        dict: {"total": int|None, "nonTailable": int|None, "profiled": list}
+    """
+    db = conn[database_name]
+    result = {"total": None, "nonTailable": None, "profiled": []}
+    try:
+        # requires serverStatus privilege (clusterMonitor role)
+        status = await db.command("serverStatus")
+        scans = status["metrics"]["queryExecutor"].get("collectionScans", {})
+        result["total"] = scans.get("total")
+        result["nonTailable"] = scans.get("nonTailable")
+    except (OperationFailure, KeyError) as e:
+        logger.warning(f"Unable to read collection scans from serverStatus: {e}")
+    namespaces = [f"{database_name}.{c}" for c in INDEXES]
+    profiled = (
+        db["system.profile"]
+        .find(
+            {"ns": {"$in": namespaces}, "planSummary": "COLLSCAN"},
+            {"ns": 1, "op": 1, "command": 1, "millis": 1, "docsExamined": 1, "ts": 1},
+        )
+        .sort("ts", -1)
+        .limit(limit)
+    )
+    async for op in profiled:
+        command = op.get("command", {})
+        result["profiled"].append(
+            {
+                "ns": op["ns"],
+                "op": op.get("op"),
+                # only filter keys (values could contain personal data)
+                "filter": sorted(command.get("filter", {}).keys()),
+                "millis": op.get("millis"),
+                "docsExamined": op.get("docsExamined"),
+                "ts": op.get("ts"),
+            }
+        )
+    return result
@@ -0,0 +1,198 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.config import Config
+from db.mongodb import AsyncIOMotorClient
+
+logger = logging.getLogger("ai4mat")
+
+database_name = Config.mongo_db
+jobs_collection_name = Config.mongo_coll_jobs
+
+# a job is
+# {"_id": "<type>:<blob key>", "type", "key": "<sha1>.<ext>", "payload": dict,
+#  "status": "pending" | "running" | "done" | "failed", "attempts": int,
+#  "runAt", "leaseUntil", "workerId", "result", "error", "createdAt", "updatedAt"}
+# jobs are keyed by file: a file uploaded several times is processed once.
+# A running job whose lease expired (worker died) is claimed again, until
+# max attempts are reached
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+def job_id(job_type: str, key: str) -> str:
+    return f"{job_type}:{key}"
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff: seconds to wait before next attempt"""
+    return min(Config.jobs_retry_delay * 2 ** (attempts - 1), Config.jobs_retry_max_delay)
+
+
+async def enqueue_job(
+    conn: AsyncIOMotorClient, job_type: str, key: str, payload: Optional[dict] = None
+) -> str:
+    """Add a job for file key (nothing is done if the job already exists)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        job_type (str): type of job (see core.jobs.handlers)
+        key (str): blob key of file to process
+        payload (dict, optional): job arguments. Defaults to None.
+
+    Returns:
+        str: job id
+    """
+    now = datetime.utcnow()
+    _id = job_id(job_type, key)
+    try:
+        await conn[database_name][jobs_collection_name].update_one(
+            {"_id": _id},
+            {
+                "$setOnInsert": {
+                    "type": job_type,
+                    "key": key,
+                    "payload": payload or {},
+                    "status": PENDING,
+                    "attempts": 0,
+                    "runAt": now,
+                    "createdAt": now,
+                    "updatedAt": now,
+                }
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # concurrent upsert of the same job
+        pass
+    return _id
+
+
+async def claim_job(
+    conn: AsyncIOMotorClient, worker_id: str, job_types: List[str]
+) -> Optional[dict]:
+    """Take the next job due (pending or with an expired lease) for worker_id
+
+    Returns:
+        dict: job claimed (status running, lease set) or None if none is due
+    """
+    now = datetime.utcnow()
+    coll = conn[database_name][jobs_collection_name]
+    # a job whose lease expired at its last attempt killed its worker (crash,
+    # out of memory) every time: it is not retried (fail_job was never called)
+    await coll.update_many(
+        {
+            "type": {"$in": job_types},
+            "status": RUNNING,
+            "leaseUntil": {"$lt": now},
+            "attempts": {"$gte": Config.jobs_max_attempts},
+        },
+        {
+            "$set": {
+                "status": FAILED,
+                "error": "Lease expired (worker stopped while running job)",
+                "updatedAt": now,
+            },
+            "$unset": {"leaseUntil": ""},
+        },
+    )
+    return await coll.find_one_and_update(
+        {
+            "type": {"$in": job_types},
+            "$or": [
+                {"status": PENDING, "runAt": {"$lte": now}},
+                {
+                    "status": RUNNING,
+                    "leaseUntil": {"$lt": now},
+                    "attempts": {"$lt": Config.jobs_max_attempts},
+                },
+            ],
+        },
+        {
+            "$set": {
+                "status": RUNNING,
+                "workerId": worker_id,
+                "leaseUntil": now + timedelta(seconds=Config.jobs_lease),
+                "updatedAt": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("runAt", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def heartbeat_job(conn: AsyncIOMotorClient, job: dict) -> bool:
+    """Extend lease of a running job
+
+    Returns:
+        bool: False if job was lost (lease expired and job claimed by another worker)
+    """
+    now = datetime.utcnow()
+    result = await conn[database_name][jobs_collection_name].update_one(
+        {"_id": job["_id"], "status": RUNNING, "workerId": job["workerId"]},
+        {
+            "$set": {
+                "leaseUntil": now + timedelta(seconds=Config.jobs_lease),
+                "updatedAt": now,
+            }
+        },
+    )
+    return result.matched_count == 1
+
+
+async def complete_job(conn: AsyncIOMotorClient, job: dict, result: Optional[dict]):
+    """Mark job as done saving its result"""
+    await conn[database_name][jobs_collection_name].update_one(
+        {"_id": job["_id"], "workerId": job["workerId"]},
+        {
+            "$set": {
+                "status": DONE,
+                "result": result,
+                "error": None,
+                "updatedAt": datetime.utcnow(),
+            },
+            "$unset": {"leaseUntil": ""},
+        },
+    )
+
+
+async def fail_job(conn: AsyncIOMotorClient, job: dict, error: str) -> str:
+    """Retry job later (with exponential backoff) or mark it as failed
+    once max attempts are reached
+
+    Returns:
+        str: new job status (pending or failed)
+    """
+    now = datetime.utcnow()
+    if job["attempts"] < Config.jobs_max_attempts:
+        status = PENDING
+        fields = {"runAt": now + timedelta(seconds=retry_delay(job["attempts"]))}
+    else:
+        status = FAILED
+        fields = {}
+    await conn[database_name][jobs_collection_name].update_one(
+        {"_id": job["_id"], "workerId": job["workerId"]},
+        {
+            "$set": {"status": status, "error": error, "updatedAt": now, **fields},
+            "$unset": {"leaseUntil": ""},
+        },
+    )
+    return status
+
+
+async def get_job(conn: AsyncIOMotorClient, _id: str) -> Optional[dict]:
+    return await conn[database_name][jobs_collection_name].find_one({"_id": _id})
+
+
+async def count_jobs(conn: AsyncIOMotorClient) -> dict:
+    """Number of jobs by status"""
+    counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+    async for row in conn[database_name][jobs_collection_name].aggregate(
+        [{"$group": {"_id": "$status", "n": {"$sum": 1}}}]
+    ):
+        counts[row["_id"]] = row["n"]
+    return counts
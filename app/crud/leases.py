@@ -0,0 +1,60 @@
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from uuid import uuid4
+
+from pymongo.errors import DuplicateKeyError
+
+from core.config import Config
+from db.mongodb import AsyncIOMotorClient
+
+logger = logging.getLogger("ai4mat")
+
+database_name = Config.mongo_db
+leases_collection_name = Config.mongo_coll_leases
+
+# a lease is {"_id": "<task name>", "owner": str, "until": datetime}:
+# the process owning it runs the task, other processes (uvicorn workers,
+# replicas) skip it until the lease expires
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+async def acquire_lease(conn: AsyncIOMotorClient, name: str, ttl: float) -> bool:
+    """Take (or renew) the lease name for ttl seconds
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        name (str): lease name
+        ttl (float): seconds the lease is held
+
+    Returns:
+        bool: True if this process owns the lease
+    """
+    now = datetime.utcnow()
+    try:
+        await conn[database_name][leases_collection_name].update_one(
+            {"_id": name, "$or": [{"owner": OWNER}, {"until": {"$lte": now}}]},
+            {"$set": {"owner": OWNER, "until": now + timedelta(seconds=ttl)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # held by another process
+        return False
+    return True
+
+
+def with_lease(
+    conn: AsyncIOMotorClient, name: str, ttl: float, job: Callable[[], Awaitable]
+) -> Callable[[], Awaitable]:
+    """Wrap a periodic job so that a single process runs it every ttl seconds
+    (see core.periodic.start_periodic)"""
+
+    async def run():
+        if not await acquire_lease(conn, name, ttl):
+            logger.info(f"Lease {name} held by another process, skipped")
+            return None
+        return await job()
+
+    return run
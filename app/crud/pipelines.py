@@ -131,7 +131,7 @@ def get_proj_stats_by_user(email: str) -> dict:
                     {
                         "$match": {
                             "$and": [
-                                {"provenance.email": "sergio.ferlito@enea.it"},
+                                {"provenance.email": email},
                                 {"files": {"$exists": True}},
                             ]
                         }
@@ -142,7 +142,7 @@ def get_proj_stats_by_user(email: str) -> dict:
                     {
                         "$match": {
                             "$and": [
-                                {"provenance.email": "sergio.ferlito@enea.it"},
+                                {"provenance.email": email},
                                 {"files": {"$exists": True}},
                             ]
                         }
@@ -165,46 +165,122 @@ def get_proj_stats_by_user(email: str) -> dict:
     return pipeline
 
 
-def get_iemap_formulas_and_elements() -> dict:
+def get_stats_counters() -> dict:
+    # projects, projects having files, files count and size by user (and affiliation)
     pipeline = [
         {
-            "$group": {
-                "_id": 0,
-                "formulas": {"$addToSet": "$material.formula"},
-                "elements": {"$addToSet": "$material.elements"},
+            "$project": {
+                "email": "$provenance.email",
+                "affiliation": "$provenance.affiliation",
+                "numfiles": {"$size": {"$ifNull": ["$files", []]}},
+                "storageBytes": {"$sum": "$files.size_bytes"},
             }
         },
         {
-            "$project": {
-                "formulas": 1,
-                "all_elements": {
-                    "$reduce": {
-                        "input": "$elements",
-                        "initialValue": [],
-                        "in": {
-                            "$concatArrays": [
-                                "$$value",
-                                {
-                                    "$cond": [
-                                        {"$isArray": "$$this"},
-                                        "$$this",
-                                        ["$$this"],
-                                    ]
-                                },
-                            ]
-                        },
-                    }
+            "$group": {
+                "_id": {"email": "$email", "affiliation": "$affiliation"},
+                "projects": {"$sum": 1},
+                "projectsWithFiles": {
+                    "$sum": {"$cond": [{"$gt": ["$numfiles", 0]}, 1, 0]}
                 },
+                "files": {"$sum": "$numfiles"},
+                "storageBytes": {"$sum": "$storageBytes"},
+            }
+        },
+    ]
+    return pipeline
+
+
+def get_catalog_counts(kind: str) -> dict:
+    # number of projects by formula or by element (counted once per project)
+    pipeline = [{"$match": {"material.formula": {"$nin": [None, ""]}}}]
+    if kind == "formula":
+        pipeline.append({"$group": {"_id": "$material.formula", "count": {"$sum": 1}}})
+    else:
+        pipeline += [
+            {
+                "$project": {
+                    "elements": {
+                        "$setUnion": [{"$ifNull": ["$material.elements", []]}, []]
+                    }
+                }
+            },
+            {"$unwind": "$elements"},
+            {"$group": {"_id": "$elements", "count": {"$sum": 1}}},
+        ]
+    return pipeline
+
+
+def get_blob_ref_counts() -> dict:
+    # references by blob "<hash>.<ext>": files, properties files ("<hash>.<ext>")
+    # and process properties files ({hash, extention}), see crud.blob_refs
+    pipeline = [
+        {
+            "$match": {
+                "$or": [
+                    {"files.hash": {"$exists": True}},
+                    {"properties.file": {"$type": "string"}},
+                    {"process.properties.file.hash": {"$exists": True}},
+                ]
             }
         },
         {
             "$project": {
                 "_id": 0,
-                "formulas": 1,
-                "unique_elements": {
-                    "$setIntersection": ["$all_elements", "$all_elements"]
+                "blobs": {
+                    "$concatArrays": [
+                        {
+                            "$map": {
+                                "input": {
+                                    "$filter": {
+                                        "input": {"$ifNull": ["$files", []]},
+                                        "as": "f",
+                                        "cond": {"$and": ["$$f.hash", "$$f.extention"]},
+                                    }
+                                },
+                                "as": "f",
+                                "in": {"$concat": ["$$f.hash", ".", "$$f.extention"]},
+                            }
+                        },
+                        {
+                            "$map": {
+                                "input": {
+                                    "$filter": {
+                                        "input": {"$ifNull": ["$properties", []]},
+                                        "as": "p",
+                                        "cond": {
+                                            "$eq": [{"$type": "$$p.file"}, "string"]
+                                        },
+                                    }
+                                },
+                                "as": "p",
+                                "in": "$$p.file",
+                            }
+                        },
+                        {
+                            "$map": {
+                                "input": {
+                                    "$filter": {
+                                        "input": {
+                                            "$ifNull": ["$process.properties", []]
+                                        },
+                                        "as": "p",
+                                        "cond": {
+                                            "$and": ["$$p.file.hash", "$$p.file.extention"]
+                                        },
+                                    }
+                                },
+                                "as": "p",
+                                "in": {
+                                    "$concat": ["$$p.file.hash", ".", "$$p.file.extention"]
+                                },
+                            }
+                        },
+                    ]
                 },
             }
         },
+        {"$unwind": "$blobs"},
+        {"$group": {"_id": "$blobs", "refs": {"$sum": 1}}},
     ]
     return pipeline
@@ -1,48 +1,123 @@
-from typing import List
+from collections import Counter
+from typing import AsyncIterator, List, Optional
 
-from core.utils import get_value_float_or_str
 from models.iemap import FileProject, Property, queryModel
 
 from db.mongodb import AsyncIOMotorClient
 from bson.objectid import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 from core.config import Config
+from core.blobstore import blob_key
+from core.structures import encode_structures
+from core.cursor import (
+    SortSpec,
+    decode_cursor,
+    encode_cursor,
+    keyset_filter,
+    parse_sort,
+)
 
 from models.iemap import Project as IEMAPModel
 from models.iemap import ProjectQueryResult
+from crud.counts import count_filtered, invalidate_counts
+from crud.stats import update_counters
+from crud.catalog import update_catalog, update_catalog_many
+from crud.blob_refs import add_blob_ref, project_blobs, release_blob_ref
+from crud.query_plans import QueryPlan, compile_query
 from crud.pipelines import (
     get_proj_having_file_with_given_hash,
     get_properties_files,
     get_user_projects_base_info,
 )
 
-from dateutil.parser import parse
-
 database_name, ai4mat_collection_name = (Config.mongo_db, Config.mongo_coll)
 
 
 async def add_project(conn: AsyncIOMotorClient, project: IEMAPModel):
     # result is of type InsertOneResult
-    result = await conn[database_name][ai4mat_collection_name].insert_one(
-        project.dict()
-    )
+    doc = encode_structures(project.dict())
+    result = await conn[database_name][ai4mat_collection_name].insert_one(doc)
+    invalidate_counts()
+    await update_counters(conn, doc.get("provenance"), projects=1)
+    await update_catalog(conn, doc.get("material"), 1)
     return result.inserted_id
 
 
-async def list_projects(conn: AsyncIOMotorClient, limit, skip):
+async def add_projects(conn: AsyncIOMotorClient, docs: List[dict]) -> List[Optional[str]]:
+    """Insert many projects (with their files) at once: documents are written
+    unordered (a failing document does not stop the others), then statistics
+    counters, catalog and blob references are updated once for all of them
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        docs (List[dict]): projects to insert (their "_id" is set once inserted)
+
+    Returns:
+        List[Optional[str]]: error of each document (None if it was inserted)
+    """
+    if not docs:
+        return []
+    errors: List[Optional[str]] = [None] * len(docs)
+    for doc in docs:
+        encode_structures(doc)
+    try:
+        await conn[database_name][ai4mat_collection_name].insert_many(
+            docs, ordered=False
+        )
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            errors[error["index"]] = error.get("errmsg", "Write error")
+    inserted = [doc for doc, error in zip(docs, errors) if error is None]
+    if not inserted:
+        return errors
+    invalidate_counts()
+    # counters of each user (and affiliation) having inserted projects
+    counters = {}
+    for doc in inserted:
+        provenance = doc.get("provenance") or {}
+        key = (provenance.get("email"), provenance.get("affiliation"))
+        files = doc.get("files") or []
+        counter = counters.setdefault(key, [provenance, 0, 0, 0, 0])
+        counter[1] += 1
+        counter[2] += 1 if files else 0
+        counter[3] += len(files)
+        counter[4] += sum(f.get("size_bytes") or 0 for f in files)
+    for provenance, projects, with_files, files, storage_bytes in counters.values():
+        await update_counters(
+            conn,
+            provenance,
+            projects=projects,
+            projects_with_files=with_files,
+            files=files,
+            storage_bytes=storage_bytes,
+        )
+    await update_catalog_many(conn, [doc.get("material") for doc in inserted])
+    blobs = Counter(blob for doc in inserted for blob in project_blobs(doc))
+    for (file_hash, file_ext), n in blobs.items():
+        await add_blob_ref(conn, file_hash, file_ext, n)
+    return errors
+
+
+async def list_projects(
+    conn: AsyncIOMotorClient, limit, skip, sort: SortSpec = [("_id", -1)]
+):
     """Function to list all projects in DB
 
     Args:
         conn (AsyncIOMotorClient): Motor MongoDB client connection
         limit (int): number of documents to return
         skip (int): number of documents to skip
+        sort (SortSpec, optional): sort fields. Defaults to [("_id", -1)].
 
     Returns:
         List[Any]: list of documents as result of the query (find({}))
     """
 
     coll = conn[database_name][ai4mat_collection_name]
-    list_projects = await coll.find({}, {"_id": 0}, limit=limit, skip=skip).to_list(
-        None
+    list_projects = (
+        await coll.find({}, limit=limit, skip=skip).sort(sort).to_list(None)
     )
     # async for row in projects_docs:
     #     list_projects.append(row)
@@ -76,12 +151,13 @@ async def add_property_file(
     """
     # get collection
     coll = conn[database_name][ai4mat_collection_name]
+    key = blob_key(fp.hash, fp.extention)
     # update property adding a file field with the hash.extention of file associated
-    rup = await coll.update_one(
+    before = await coll.find_one_and_update(
         {"_id": ObjectId(id)},
         {
             "$set": {
-                "properties.$[elem].file": fp.hash + "." + fp.extention,
+                "properties.$[elem].file": key,
             }
         },
         # When upsert = True
@@ -90,24 +166,30 @@ async def add_property_file(
         # Defaults to false, which does not insert a new document when no match is found.
         upsert=False,
         array_filters=[{"$and": [{"elem.name": elementName}]}],
+        projection={"properties.name": 1, "properties.file": 1},
+        return_document=ReturnDocument.BEFORE,
     )
-    #  modified_count ==1 means a new property file was inserted
-    #  matched_count ==1 means an existing property file was found
+    # properties files are blob references too (see crud.blob_refs.project_blobs)
+    if before is not None:
+        replaced = [
+            p.get("file")
+            for p in before.get("properties") or []
+            if p.get("name") == elementName and p.get("file") != key
+        ]
+        if replaced:
+            await add_blob_ref(conn, fp.hash, fp.extention, len(replaced))
+        for previous in replaced:
+            if isinstance(previous, str) and "." in previous:
+                file_hash, _, file_ext = previous.partition(".")
+                await release_blob_ref(conn, file_hash, file_ext)
 
     newProjFileAdded = False
     newPropFileUpdateOrInserted = False
-    if rup.modified_count == 1 or rup.matched_count == 1:
-        # first check if a corresponding item in files field exists
-        result = await coll.find(
-            {"_id": ObjectId(id), "files.hash": {"$in": [fp.hash]}}, {"files.hash": 1}
-        ).to_list(None)
-        alreadyExists = True if result != None else False
-        if not alreadyExists:
-            result_update_files = await coll.update_one(
-                {"_id": ObjectId(id)}, {"$push": {"files": fp.dict()}}
-            )
-            newProjFileAdded = result_update_files.modified_count == 1
-    newPropFileUpdateOrInserted = rup.modified_count == 1 or rup.matched_count == 1
+    if before is not None:
+        # add file to files field only if a corresponding item does not exist
+        newProjFileAdded = await push_file(conn, id, fp)
+    newPropFileUpdateOrInserted = before is not None
+    invalidate_counts()
     return newPropFileUpdateOrInserted, newProjFileAdded
 
 
@@ -125,6 +207,7 @@ async def add_project_file(conn: AsyncIOMotorClient, id: str, fp: FileProject):
     Returns:
     --------
         modified_count, matched_cound: (int,int) - number of modified documents, number of matched documents
+        (0, 1) if file is already attached to project, (0, 0) if project does not exist
 
     """
     #  {"_id":ObjectId("62752dd88856514dab27dd8e")},
@@ -154,24 +237,51 @@ async def add_project_file(conn: AsyncIOMotorClient, id: str, fp: FileProject):
     # if a document already exists, number_matched_documents will be 1
 
     # if not filesExists:
-    result = await coll.find_one(
-        {"_id": ObjectId(id), "files.hash": {"$in": [fp.hash]}}, {"files.hash": 1}
-    )
-    yetExists = True if result != None else False
-    num_docs_updated, number_doc_matched = 0, 0
-    if not yetExists:
-        result_update = await coll.update_one(
-            {"_id": ObjectId(id)},
-            {"$push": {"files": fp.dict()}}
-            # add to arry if not yet present
-            # {"$addToSet": {"files": fp.dict()}},
-        )
+    # add to array only if not yet present (checked atomically by push_file)
+    isAdded = await push_file(conn, id, fp)
+    if isAdded:
+        invalidate_counts()
+        return 1, 1
+    # file already attached (matched) or project not found
+    return 0, await count_project(conn, id)
 
-        num_docs_updated, number_doc_matched = (
-            result_update.modified_count,
-            result_update.matched_count,
-        )
-    return num_docs_updated, number_doc_matched
+
+async def count_project(conn: AsyncIOMotorClient, id: str) -> int:
+    """1 if project with MongoDB id exists, else 0"""
+    coll = conn[database_name][ai4mat_collection_name]
+    return 0 if await coll.find_one({"_id": ObjectId(id)}, {"_id": 1}) is None else 1
+
+
+async def push_file(conn: AsyncIOMotorClient, id: str, fp: FileProject) -> bool:
+    """Atomically add file to project files (if no file with the same hash exists)
+    and update statistics counters and blob references accordingly
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        id (str): MongoDB document's id (ObjectId) to update
+        fp (FileProject): file to add
+
+    Returns:
+        bool: True if file was added to project
+    """
+    coll = conn[database_name][ai4mat_collection_name]
+    before = await coll.find_one_and_update(
+        {"_id": ObjectId(id), "files.hash": {"$ne": fp.hash}},
+        {"$push": {"files": fp.dict()}},
+        projection={"provenance": 1, "files.hash": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        return False
+    await update_counters(
+        conn,
+        before.get("provenance"),
+        projects_with_files=0 if before.get("files") else 1,
+        files=1,
+        storage_bytes=fp.size_bytes or 0,
+    )
+    await add_blob_ref(conn, fp.hash, fp.extention)
+    return True
 
 
 async def find_project_file_by_hash(conn: AsyncIOMotorClient, file_hash: str, id: str):
@@ -192,10 +302,18 @@ async def find_project_file_by_hash(conn: AsyncIOMotorClient, file_hash: str, id
     return result
 
 
-async def count_projects(conn: AsyncIOMotorClient) -> int:
-    coll = conn[database_name][ai4mat_collection_name]
-    result = await coll.count_documents({})
-    return result
+async def count_projects(conn: AsyncIOMotorClient, query: dict = {}) -> int:
+    """Get number of projects (estimated from collection metadata
+    if no filter is given, cached for filtered queries)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        query (dict, optional): MongoDB filter. Defaults to {}.
+
+    Returns:
+        int: number of projects
+    """
+    return await count_filtered(conn, query)
 
 
 async def add_project_file_and_data(
@@ -207,37 +325,12 @@ async def add_project_file_and_data(
     #  {"_id":ObjectId("62752dd88856514dab27dd8e")},
     # {$set:{"process.properties.$[elem].hash":"hash-2"}},{arrayFilters:[{$and:[{"elem.name":"H2o"},{"elem.type":"2D"}]}]}
 
-    coll = conn[database_name][ai4mat_collection_name]
-    try:
-        result_update = await coll.update_one(
-            {"_id": ObjectId(id)},
-            {
-                "$addToSet": {
-                    "files": file_data.dict(),
-                }
-            },
-        )
-    # result_update = await coll.update_one(
-    #     {"_id": ObjectId(id)},
-    #     {
-    #         "$set": {
-    #             "files.$[elem]": file_data.dict(),
-    #         }
-    #     },
-    #     upsert=True,
-    #     array_filters=[{"$and": [{"elem.hash": file_data.hash}]}],
-    # )
-    except Exception as WriteError:
-        result_update = await coll.update_one(
-            {"_id": ObjectId(id)},
-            {
-                "$addToSet": {
-                    "files": file_data.dict(),
-                }
-            },
-        )
-
-    return result_update.modified_count, result_update.matched_count
+    # same as add_project_file (keeps statistics counters updated)
+    isAdded = await push_file(conn, id, file_data)
+    if isAdded:
+        invalidate_counts()
+        return 1, 1
+    return 0, await count_project(conn, id)
 
 
 async def add_property(conn: AsyncIOMotorClient, id: str, property: Property):
@@ -266,154 +359,225 @@ async def add_property(conn: AsyncIOMotorClient, id: str, property: Property):
         #     {"$and": [{"elem.name": property.name}, {"elem.type": property.type}]}
         # ],
     )
-
+    if result_update.modified_count:
+        # file of property is a blob reference (see crud.blob_refs.project_blobs)
+        for file_hash, file_ext in project_blobs(
+            {"process": {"properties": [property.dict()]}}
+        ):
+            await add_blob_ref(conn, file_hash, file_ext)
+
+    invalidate_counts()
     return result_update.modified_count, result_update.upserted_id
 
 
-def generate_pagination_query(query, sort=None, next_key=None):
-    sort_field = None if sort is None else sort[0]
+def generate_pagination_query(
+    query: dict, sort: SortSpec, next_key: Optional[str] = None
+) -> dict:
+    """Add keyset condition to query so that only documents following
+    the one encoded in next_key (according to sort) are returned
+
+    Args:
+        query (dict): MongoDB filter
+        sort (SortSpec): list of (field, direction) ending with _id
+        next_key (str, optional): cursor returned with the previous page
 
-    def next_key_fn(items):
-        if len(items) == 0:
-            return None
-        item = items[-1]
-        if sort_field is None:
-            return {"_id": item["_id"]}
-        else:
-            return {"_id": item["_id"], sort_field: item[sort_field]}
+    Raises:
+        InvalidCursor: if next_key is not valid for the given sort
 
+    Returns:
+        dict: paginated MongoDB filter
+    """
     if next_key is None:
-        return query, next_key_fn
+        return query
+    pagination_query = keyset_filter(sort, decode_cursor(next_key, sort))
+    if len(query) == 0:
+        return pagination_query
+    return {"$and": [query, pagination_query]}
 
-    paginated_query = query.copy()
 
-    if sort is None:
-        paginated_query["_id"] = {"$gt": next_key["_id"]}
-        return paginated_query, next_key_fn
+async def find_all_project_paginated(
+    conn: AsyncIOMotorClient,
+    query: dict = {},
+    limit: int = 10,
+    sort: SortSpec = [("_id", -1)],
+    next_key: Optional[str] = None,
+    projection: Optional[dict] = None,
+):
+    """Get a page of documents using keyset pagination (no skip)
 
-    sort_operator = "$gt" if sort[1] == 1 else "$lt"
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        query (dict, optional): MongoDB filter. Defaults to {}.
+        limit (int, optional): page size. Defaults to 10.
+        sort (SortSpec, optional): sort fields. Defaults to [("_id", -1)].
+        next_key (str, optional): cursor returned with the previous page.
+        projection (dict, optional): fields to return.
 
-    pagination_query = [
-        {sort_field: {sort_operator: next_key[sort_field]}},
-        {
-            "$and": [
-                {sort_field: next_key[sort_field]},
-                {"_id": {sort_operator: next_key["_id"]}},
-            ]
-        },
-    ]
+    Returns:
+        Tuple[List[dict], str|None]: documents and cursor for next page
+                                     (None if this is the last page)
+    """
+    coll = conn[database_name][ai4mat_collection_name]
+    paginated_query = generate_pagination_query(query, sort, next_key)
+    # fetch one document more to know if another page exists
+    result = (
+        await coll.find(paginated_query, projection)
+        .sort(sort)
+        .limit(limit + 1)
+        .to_list(None)
+    )
+    next_key = None
+    if len(result) > limit:
+        result = result[:limit]
+        next_key = encode_cursor(sort, result[-1])
+    return result, next_key
 
-    if "$or" not in paginated_query:
-        paginated_query["$or"] = pagination_query
-    else:
-        paginated_query = {"$and": [query, {"$or": pagination_query}]}
 
-    return paginated_query, next_key_fn
+def compile_stream_query(qp: queryModel) -> QueryPlan:
+    """Compile query parameters of streamed results, before the response starts
+    (invalid parameters would otherwise be found after sending headers).
+    With a cursor only documents following it are returned
 
+    Args:
+        qp (queryModel): query parameters
 
-async def find_all_project_paginated(
-    conn: AsyncIOMotorClient, query={}, limit=10, sort=["_id", -1], next_key=None
-):
+    Raises:
+        ValueError: if a parameter or the cursor is not valid
+
+    Returns:
+        QueryPlan: compiled plan
+    """
+    plan = compile_query(qp)
+    if not qp.cursor:
+        return plan
+    # keyset pagination needs a sort (same default as exec_query)
+    sort = plan.sort or parse_sort(None)
+    return plan._replace(
+        filter=generate_pagination_query(plan.filter, sort, qp.cursor),
+        sort=sort,
+        hint=None,
+    )
+
+
+async def iter_query(
+    conn: AsyncIOMotorClient,
+    plan: QueryPlan,
+    limit: Optional[int] = None,
+    batch_size: int = Config.query_stream_batch_size,
+) -> AsyncIterator[str]:
+    """Iterate over query results without loading them all in memory,
+    documents are fetched from MongoDB in batches of batch_size
+    and serialized one at a time
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        plan (QueryPlan): compiled query (see compile_stream_query)
+        limit (int, optional): max number of documents. Defaults to None.
+        batch_size (int, optional): number of documents fetched per round trip.
+
+    Yields:
+        str: JSON serialized ProjectQueryResult (none values excluded)
+    """
     coll = conn[database_name][ai4mat_collection_name]
-    paginated_query, next_key_fn = generate_pagination_query(query, sort, next_key)
-    result = await coll.find(paginated_query).limit(limit).sort([sort]).to_list(None)
-    next_key = next_key_fn(result)
-    return result, next_key
+    cursor = coll.find(plan.filter, plan.projection, hint=plan.hint)
+    cursor = cursor.batch_size(batch_size)
+    if plan.sort:
+        cursor = cursor.sort(plan.sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    try:
+        async for doc in cursor:
+            yield ProjectQueryResult(**doc).json(exclude_none=True)
+    finally:
+        # release server side cursor if client went away
+        await cursor.close()
 
 
-async def exec_query(conn: AsyncIOMotorClient, qp: queryModel):
+async def iter_query_files(
+    conn: AsyncIOMotorClient,
+    plan: QueryPlan,
+    limit: Optional[int] = None,
+    batch_size: int = Config.query_stream_batch_size,
+) -> AsyncIterator[dict]:
+    """Iterate over projects matching query with their files only
+    (used to build ZIP archives of query results)
+
+    Yields:
+        dict: {"_id", "iemap_id", "files": [FileProject as dict]}
+    """
+    coll = conn[database_name][ai4mat_collection_name]
+    cursor = coll.find(
+        {"$and": [plan.filter, {"files.hash": {"$exists": True}}]},
+        {"iemap_id": 1, "files.hash": 1, "files.name": 1, "files.extention": 1},
+    ).batch_size(batch_size)
+    if plan.sort:
+        cursor = cursor.sort(plan.sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    try:
+        async for doc in cursor:
+            yield doc
+    finally:
+        await cursor.close()
 
-    get_affiliation = lambda x: x.affiliation.split(",") if x.affiliation else None
-    get_dates = (
-        lambda x: {"$gte": parse(x[0]), "$lte": parse(x[1])}
-        if len(x) > 1
-        else {"$gte": parse(x[0])}
+
+async def get_project_files(conn: AsyncIOMotorClient, id: ObjectId) -> Optional[dict]:
+    """Get files of project (None if project does not exist)
+
+    Returns:
+        dict: {"_id", "iemap_id", "files": [FileProject as dict]}
+    """
+    return await conn[database_name][ai4mat_collection_name].find_one(
+        {"_id": id},
+        {"iemap_id": 1, "files.hash": 1, "files.name": 1, "files.extention": 1},
     )
 
-    get_list_elements = lambda x: list(x.split(",")) if x else None
-
-    query = {
-        "_id" if qp.id else None: ObjectId(qp.id),
-        "provenance.affiliation"
-        if qp.affiliation
-        else None: {"$in": get_affiliation(qp)},
-        "project.name" if qp.project_name else None: qp.project_name,
-        "provenance.email" if qp.provenance_email else None: qp.provenance_email,
-        "material.formula" if qp.material_formula else None: qp.material_formula,
-        "iemap_id" if qp.iemap_id else None: qp.iemap_id,
-        "process.isExperiment" if qp.isExperiment != None else None: qp.isExperiment,
-        # simulationCode translate into the 2 following fields ~~~~~~~~~~~~~~~~~~~
-        "process.isExperiment" if qp.simulationCode else None: False,
-        "process.agent.name" if qp.simulationCode else None: qp.simulationCode,
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # experimentInstrument translate into the 2 following fields ~~~~~~~~~~~~~~~~~~~
-        "process.isExperiment" if qp.experimentInstrument else None: True,
-        "process.agent.name"
-        if qp.experimentInstrument
-        else None: qp.experimentInstrument,
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # simulationMethod translate into the 2 following fields ~~~~~~~~~~~~~~~~~~~
-        "process.isExperiment" if qp.simulationMethod else None: False,
-        "process.method" if qp.simulationMethod else None: qp.simulationMethod,
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # simulationMethod translate into the 2 following fields ~~~~~~~~~~~~~~~~~~~
-        "process.isExperiment" if qp.experimentMethod else None: True,
-        "process.method" if qp.experimentMethod else None: qp.experimentMethod,
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        "parameters"
-        if qp.parameterName and not qp.parameterValue
-        else None: {"$elemMatch": {"name": qp.parameterName}},
-        "parameters"
-        if qp.parameterValue and qp.parameterValue
-        else None: {
-            "$elemMatch": {
-                "name": qp.parameterName,
-                "value": get_value_float_or_str(qp.parameterValue),
-            }
-        },
-        "properties"
-        if qp.propertyName and not qp.propertyValue
-        else None: {"$elemMatch": {"name": qp.propertyName}},
-        "properties"
-        if qp.propertyName and qp.propertyValue
-        else None: {
-            "$elemMatch": {
-                "name": qp.propertyName,
-                "value": get_value_float_or_str(qp.propertyValue),
-            }
-        },
-        "provenance.createdAt"
-        if qp.publication_dates
-        else None: get_dates(qp.publication_dates)
-        if qp.publication_dates
-        else None,
-        "material.elements"
-        if qp.material_all_elements
-        else None: {"$all": get_list_elements(qp.material_all_elements)},
-        "material.elements"
-        if qp.material_any_element
-        else None: get_list_elements(qp.material_any_element),
-    }
-    del query[None]  # removes single None:None introduced from above dict definition
-    # print(query)
 
-    projection = {}
-    if qp.fields:
-        projection = {i: 1 for i in qp.fields.split(",")}
-    # print(projection)
+async def exec_query(conn: AsyncIOMotorClient, qp: queryModel):
+    """Execute query built from query parameters
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        qp (queryModel): query parameters (if limit or cursor are provided
+                         results are paginated using keyset pagination)
+
+    Returns:
+        Tuple[List[dict], str|None]: documents found and cursor for next page
+                                     (always None if results are not paginated)
+    """
+
+    # filter, projection and sort are compiled once per distinct parameters
+    plan = compile_query(qp)
     coll = conn[database_name][ai4mat_collection_name]
-    if len(projection) > 0:
-        result_query = await coll.find(query, projection).to_list(None)
+    next_key = None
+    if qp.limit or qp.cursor:
+        # keyset pagination, sort fields are needed to build the next cursor
+        sort = plan.sort or parse_sort(None)
+        projection = plan.projection
+        if projection:
+            projection = {**projection, **{field: 1 for field, _ in sort}}
+        result_query, next_key = await find_all_project_paginated(
+            conn,
+            query=plan.filter,
+            limit=qp.limit or 10,
+            sort=sort,
+            next_key=qp.cursor,
+            projection=projection,
+        )
     else:
-        result_query = await coll.find(query).to_list(None)
+        cursor = coll.find(plan.filter, plan.projection, hint=plan.hint)
+        if plan.sort:
+            cursor = cursor.sort(plan.sort)
+        result_query = await cursor.to_list(None)
     response = []
     # {"_id": ObjectId("6333075e1fd43266d2a6196a")}
     for doc in result_query:
         # convert to dict and exclude none
-        response.append(ProjectQueryResult(**doc).dict(exclude_none=True))
+        # JSON ready (packed structures decoded, see core.structures)
+        response.append(jsonable_encoder(ProjectQueryResult(**doc), exclude_none=True))
         # if "_id" in doc.keys():
         #     doc.pop("_id")
-    return response
+    return response, next_key
 
 
 async def get_user_projects(
@@ -461,8 +625,8 @@ async def pull_files_from_documents(
     """
     coll = conn[database_name][ai4mat_collection_name]
     # pull document from files array and if array field is empty then unset it
-    result = await coll.update_one(
-        {"_id": id_doc},
+    before = await coll.find_one_and_update(
+        {"_id": id_doc, "files.hash": hash_file},
         # {"$pull": {"files": {"hash": hash_file}}}
         [
             {
@@ -481,23 +645,32 @@ async def pull_files_from_documents(
                 }
             },
         ],
+        projection={
+            "provenance": 1,
+            "files.hash": 1,
+            "files.extention": 1,
+            "files.size_bytes": 1,
+        },
+        return_document=ReturnDocument.BEFORE,
     )
     # all credits to
     # https://stackoverflow.com/questions/68984050/unset-array-field-if-it-is-empty-after-pull-in-mongodb
-    return result.modified_count, result.matched_count
-
-
-async def find_proj_having_file_with_hash(
-    conn: AsyncIOMotorClient, hash_file: str
-) -> int:
-    coll = conn[database_name][ai4mat_collection_name]
-
-    result = await coll.find(
-        {"files": {"$elemMatch": {"hash": hash_file}}}, "_id"
-    ).to_list(None)
-
-    num_proj = len(result) if result != None else 0
-    return num_proj
+    if before is None:
+        return 0, 0
+    files_before = before.get("files", [])
+    removed = [f for f in files_before if f.get("hash") == hash_file]
+    invalidate_counts()
+    await update_counters(
+        conn,
+        before.get("provenance"),
+        projects_with_files=-1 if len(removed) == len(files_before) else 0,
+        files=-len(removed),
+        storage_bytes=-sum(f.get("size_bytes") or 0 for f in removed),
+    )
+    # blob is deleted by the garbage collector once it has no references
+    for f in removed:
+        await release_blob_ref(conn, hash_file, f.get("extention"))
+    return 1, 1
 
 
 # https://medium.com/@madhuri.pednekar/handling-mongodb-objectid-in-python-fastapi-4dd1c7ad67cd
@@ -0,0 +1,320 @@
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+
+from bson.objectid import ObjectId
+from dateutil.parser import parse
+
+from core.composition import FRACTION_DIGITS
+from core.config import Config
+from core.cursor import SortSpec, parse_sort
+from core.elements import (
+    ELEMENT_BITS,
+    MASK_FIELDS,
+    complement_positions,
+    element_positions,
+)
+from core.lattice import LATTICE_PARAMS
+from core.utils import get_value_float_or_str
+from models.iemap import queryModel
+
+# parameters that do not change the plan (used to move between pages)
+PAGINATION_PARAMS = {"cursor", "limit"}
+
+# indexes the planner may hint, in order of preference, with the
+# query parameters they serve (only hinted once they exist on DB)
+HINTABLE_INDEXES = [
+    ("iemap_id_1", ("iemap_id",)),
+    ("provenance.email_1_provenance.affiliation_1", ("provenance_email",)),
+    ("material.formula_1__id_1", ("material_formula",)),
+    (
+        "material.elements_1",
+        ("material_all_elements", "material_any_element", "material_only_elements"),
+    ),
+    ("material.composition.reduced_formula_1", ("material_reduced_formula",)),
+    (
+        "material.composition.elements.element_1_material.composition.elements.fraction_1",
+        ("composition",),
+    ),
+    ("project.name_1__id_1", ("project_name",)),
+    # lattice parameter ranges
+    *(
+        (f"material.lattice_values.{p}_1", (f"lattice_{p}_min", f"lattice_{p}_max"))
+        for p in LATTICE_PARAMS
+    ),
+]
+
+# operators of element fractions (two characters operators first)
+FRACTION_OPERATORS = ((">=", "$gte"), ("<=", "$lte"), (">", "$gt"), ("<", "$lt"))
+
+# range of element fractions "min-max" (numbers can be written as 1e-3)
+NUMBER = r"\s*(\d*\.?\d+(?:[eE][-+]?\d+)?)\s*"
+FRACTION_RANGE = re.compile(f"{NUMBER}-{NUMBER}")
+
+# names of indexes existing on projects collection, set when indexes are reconciled
+available_indexes = set()
+
+
+class QueryPlan(NamedTuple):
+    """Compiled query, plans are cached and shared: do not mutate them"""
+
+    filter: dict
+    projection: Optional[dict]
+    sort: Optional[SortSpec]
+    hint: Optional[str]
+
+
+def split_list(value: str) -> List[str]:
+    return [x.strip() for x in value.split(",") if x.strip()]
+
+
+def get_dates(value: str) -> dict:
+    """Dates range from "start[,end]" """
+    dates = split_list(value)
+    if len(dates) > 1:
+        return {"$gte": parse(dates[0]), "$lte": parse(dates[1])}
+    return {"$gte": parse(dates[0])}
+
+
+def elem_match(name: Optional[str], value) -> dict:
+    """Condition on a name/value array item (parameters and properties)"""
+    match = {}
+    if name:
+        match["name"] = name
+    if value is not None:
+        match["value"] = get_value_float_or_str(value)
+    return {"$elemMatch": match}
+
+
+def range_condition(minimum: Optional[float], maximum: Optional[float]) -> dict:
+    """Condition of a closed numeric range (either bound can be missing)"""
+    if minimum is not None and maximum is not None and minimum > maximum:
+        raise ValueError(f"Range minimum {minimum} is greater than maximum {maximum}")
+    condition = {}
+    if minimum is not None:
+        condition["$gte"] = minimum
+    if maximum is not None:
+        condition["$lte"] = maximum
+    return condition
+
+
+def fraction_condition(value: str) -> dict:
+    """Condition on an atomic fraction: "0.1-0.3", ">0.5", ">=0.5", "<0.2",
+    "<=0.2" or "0.5" (exact, fractions are saved rounded)"""
+    for operator, condition in FRACTION_OPERATORS:
+        if value.startswith(operator):
+            return {condition: fraction_value(value[len(operator) :])}
+    match = FRACTION_RANGE.fullmatch(value)
+    if match:
+        return range_condition(
+            fraction_value(match.group(1)), fraction_value(match.group(2))
+        )
+    return {"$eq": fraction_value(value)}
+
+
+def fraction_value(value: str) -> float:
+    try:
+        fraction = float(value)
+    except ValueError:
+        raise ValueError(f"{value!r} is not an atomic fraction")
+    if not 0 <= fraction <= 1:
+        raise ValueError(f"Atomic fraction {fraction} is not between 0 and 1")
+    return round(fraction, FRACTION_DIGITS)
+
+
+def composition_clauses(value: str) -> List[Tuple[str, object]]:
+    """Conditions on element fractions from "Li:0.1-0.3,O:>0.5"
+    (an element without fraction must only be present), served by the
+    compound index on material.composition.elements element/fraction"""
+    clauses = []
+    for item in split_list(value):
+        element, _, fraction = (x.strip() for x in item.partition(":"))
+        if element not in ELEMENT_BITS:
+            raise ValueError(f"{element} is not a chemical element")
+        match = {"element": element}
+        if fraction:
+            match["fraction"] = fraction_condition(fraction)
+        clauses.append(("material.composition.elements", {"$elemMatch": match}))
+    return clauses
+
+
+def bits_clauses(operator: str, positions: Tuple[List[int], List[int]]) -> list:
+    """Conditions on elements bitmask fields (words without positions are skipped)"""
+    return [
+        (field, {operator: bits})
+        for field, bits in zip(MASK_FIELDS, positions)
+        if bits
+    ]
+
+
+def bits_or_unmigrated(
+    alternatives: List[dict], unmigrated: Optional[dict] = None
+) -> Tuple[str, list]:
+    """Bitmask conditions, or documents whose bitmask was not computed yet
+    (see migrations.elements_bitmask) tested on material.elements only"""
+    return ("$or", [*alternatives, {MASK_FIELDS[0]: None, **(unmigrated or {})}])
+
+
+def get_clauses(params: dict) -> List[Tuple[str, object]]:
+    """Translate query parameters to a list of (field, condition),
+    the same field can appear more than once"""
+    p = params.get
+    clauses = []
+    if p("id"):
+        if not ObjectId.is_valid(p("id")):
+            raise ValueError(f"{p('id')} is not a valid ObjectId")
+        clauses.append(("_id", ObjectId(p("id"))))
+    if p("affiliation"):
+        clauses.append(
+            ("provenance.affiliation", {"$in": split_list(p("affiliation"))})
+        )
+    if p("project_name"):
+        clauses.append(("project.name", p("project_name")))
+    if p("provenance_email"):
+        clauses.append(("provenance.email", p("provenance_email")))
+    if p("material_formula"):
+        clauses.append(("material.formula", p("material_formula")))
+    if p("material_reduced_formula"):
+        clauses.append(
+            ("material.composition.reduced_formula", p("material_reduced_formula"))
+        )
+    if p("composition"):
+        clauses.extend(composition_clauses(p("composition")))
+    if p("iemap_id"):
+        clauses.append(("iemap_id", p("iemap_id")))
+    if p("isExperiment") is not None:
+        clauses.append(("process.isExperiment", p("isExperiment")))
+    # simulation/experiment code, instrument and method also define the kind of process
+    for param, is_experiment, field in [
+        ("simulationCode", False, "process.agent.name"),
+        ("experimentInstrument", True, "process.agent.name"),
+        ("simulationMethod", False, "process.method"),
+        ("experimentMethod", True, "process.method"),
+    ]:
+        if p(param):
+            clauses.append(("process.isExperiment", is_experiment))
+            clauses.append((field, p(param)))
+    if p("parameterName") or p("parameterValue") is not None:
+        clauses.append(
+            ("parameters", elem_match(p("parameterName"), p("parameterValue")))
+        )
+    if p("propertyName") or p("propertyValue") is not None:
+        clauses.append(
+            ("properties", elem_match(p("propertyName"), p("propertyValue")))
+        )
+    if p("publication_dates"):
+        clauses.append(("provenance.createdAt", get_dates(p("publication_dates"))))
+    # numeric lattice parameters (see core.lattice)
+    for param in LATTICE_PARAMS:
+        minimum, maximum = p(f"lattice_{param}_min"), p(f"lattice_{param}_max")
+        if minimum is not None or maximum is not None:
+            clauses.append(
+                (f"material.lattice_values.{param}", range_condition(minimum, maximum))
+            )
+    # element sets are selected on the multikey material.elements index
+    # ($bits* operators cannot use indexes), then tested on the periodic
+    # table bitmask (see core.elements), documents without bitmask are
+    # tested on material.elements
+    if p("material_all_elements"):
+        elements = split_list(p("material_all_elements"))
+        positions = element_positions(elements)
+        clauses.append(("material.elements", {"$all": elements}))
+        all_set = bits_clauses("$bitsAllSet", positions)
+        if all_set:
+            clauses.append(bits_or_unmigrated([dict(all_set)]))
+    if p("material_any_element"):
+        elements = split_list(p("material_any_element"))
+        positions = element_positions(elements)
+        clauses.append(("material.elements", {"$in": elements}))
+        any_set = bits_clauses("$bitsAnySet", positions)
+        if any_set:
+            clauses.append(bits_or_unmigrated([dict([c]) for c in any_set]))
+    if p("material_only_elements"):
+        elements = split_list(p("material_only_elements"))
+        positions = complement_positions(elements)
+        # materials having only these elements have at least one of them
+        clauses.append(("material.elements", {"$in": elements}))
+        all_clear = bits_clauses("$bitsAllClear", positions)
+        if all_clear:
+            no_other = {"$not": {"$elemMatch": {"$nin": elements}}}
+            clauses.append(
+                bits_or_unmigrated([dict(all_clear)], {"material.elements": no_other})
+            )
+    return clauses
+
+
+def merge_clauses(clauses: List[Tuple[str, object]]) -> dict:
+    """Build filter from clauses, conditions on the same field are
+    combined with $and (instead of overwriting each other)"""
+    by_field = {}
+    for field, condition in clauses:
+        conditions = by_field.setdefault(field, [])
+        if condition not in conditions:
+            conditions.append(condition)
+    query, combined = {}, []
+    for field, conditions in by_field.items():
+        if len(conditions) == 1:
+            query[field] = conditions[0]
+        else:
+            combined.extend({field: c} for c in conditions)
+    if combined:
+        query["$and"] = combined
+    return query
+
+
+def choose_hint(params: dict, sort: Optional[SortSpec]) -> Optional[str]:
+    """Pick an index for selective filters (not when sorting:
+    the planner can then use the index matching the sort)"""
+    if sort or params.get("id"):
+        return None
+    for index_name, index_params in HINTABLE_INDEXES:
+        if index_name in available_indexes and any(params.get(x) for x in index_params):
+            return index_name
+    return None
+
+
+def get_signature(qp: queryModel) -> tuple:
+    """Normalized (hashable) representation of query parameters"""
+    return tuple(
+        sorted(
+            (k, v)
+            for k, v in qp.dict().items()
+            if v is not None and k not in PAGINATION_PARAMS
+        )
+    )
+
+
+@lru_cache(maxsize=Config.query_plan_cache_size)
+def compile_signature(signature: tuple) -> QueryPlan:
+    params = dict(signature)
+    sort = parse_sort(params["sort"]) if params.get("sort") else None
+    projection = None
+    if params.get("fields"):
+        projection = {field: 1 for field in split_list(params["fields"])}
+    return QueryPlan(
+        filter=merge_clauses(get_clauses(params)),
+        projection=projection,
+        sort=sort,
+        hint=choose_hint(params, sort),
+    )
+
+
+def compile_query(qp: queryModel) -> QueryPlan:
+    """Compile query parameters into filter, projection, sort and index hint
+    (plans are cached by normalized parameters)
+
+    Args:
+        qp (queryModel): query parameters
+
+    Raises:
+        ValueError: if sort or any other parameter is not valid
+
+    Returns:
+        QueryPlan: compiled plan
+    """
+    return compile_signature(get_signature(qp))
+
+
+def clear_plans() -> None:
+    """Drop cached plans (e.g. when available indexes change)"""
+    compile_signature.cache_clear()
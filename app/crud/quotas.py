@@ -0,0 +1,109 @@
+from typing import List, Optional
+
+from pymongo import DESCENDING
+
+from core.config import Config
+from crud.stats import invalidate_stats
+from db.mongodb import AsyncIOMotorClient
+
+database_name = Config.mongo_db
+stats_collection_name = Config.mongo_coll_stats
+
+# storage used by users and affiliations is the storageBytes counter of their
+# statistics documents (see crud.stats.update_counters), a quotaBytes field set
+# on the same documents overrides the default quota (0 means unlimited)
+DEFAULT_QUOTAS = {
+    "user": Config.storage_quota_user,
+    "affiliation": Config.storage_quota_affiliation,
+}
+
+
+class QuotaExceeded(ValueError):
+    """Storing a file would exceed a storage quota"""
+
+
+def quota_of(doc: dict, kind: str) -> int:
+    return doc.get("quotaBytes", DEFAULT_QUOTAS[kind])
+
+
+async def check_storage_quota(
+    conn: AsyncIOMotorClient, email: str, affiliation: Optional[str], size: int
+):
+    """Check that user and affiliation can store size more bytes
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        email (str): user email
+        affiliation (str): user affiliation
+        size (int): bytes to store
+
+    Raises:
+        QuotaExceeded: if user or affiliation quota would be exceeded
+    """
+    coll = conn[database_name][stats_collection_name]
+    ids = {f"user:{email}": "user", f"affiliation:{affiliation}": "affiliation"}
+    docs = {doc["_id"]: doc async for doc in coll.find({"_id": {"$in": list(ids)}})}
+    for _id, kind in ids.items():
+        doc = docs.get(_id, {})
+        quota = quota_of(doc, kind)
+        used = doc.get("storageBytes", 0)
+        if quota and used + size > quota:
+            raise QuotaExceeded(
+                f"Storage quota of {kind} exceeded ({used} of {quota} bytes used)"
+            )
+
+
+async def set_storage_quota(
+    conn: AsyncIOMotorClient, kind: str, key: str, quota: Optional[int]
+) -> dict:
+    """Set quota of a user or affiliation (None restores the default one)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        kind (str): "user" or "affiliation"
+        key (str): user email or affiliation
+        quota (int, optional): quota in bytes (0 means unlimited)
+
+    Returns:
+        dict: {"kind", "key", "storageBytes", "quotaBytes"}
+    """
+    coll = conn[database_name][stats_collection_name]
+    update = {"$unset": {"quotaBytes": ""}} if quota is None else {"$set": {"quotaBytes": quota}}
+    await coll.update_one(
+        {"_id": f"{kind}:{key}"},
+        {**update, "$setOnInsert": {"kind": kind, "key": key}},
+        upsert=True,
+    )
+    invalidate_stats()
+    doc = await coll.find_one({"_id": f"{kind}:{key}"})
+    return {
+        "kind": kind,
+        "key": key,
+        "storageBytes": doc.get("storageBytes", 0),
+        "quotaBytes": quota_of(doc, kind),
+    }
+
+
+async def top_storage_usage(
+    conn: AsyncIOMotorClient, kind: str, limit: int = 20
+) -> List[dict]:
+    """Users or affiliations using most storage (storageBytes index)
+
+    Returns:
+        List[dict]: [{"key", "files", "storageBytes", "quotaBytes"}]
+    """
+    cursor = (
+        conn[database_name][stats_collection_name]
+        .find({"kind": kind})
+        .sort("storageBytes", DESCENDING)
+        .limit(limit)
+    )
+    return [
+        {
+            "key": doc["key"],
+            "files": doc.get("files", 0),
+            "storageBytes": doc.get("storageBytes", 0),
+            "quotaBytes": quota_of(doc, kind),
+        }
+        async for doc in cursor
+    ]
@@ -1,61 +1,205 @@
-from typing import List
-
-from core.utils import get_value_float_or_str
-from models.iemap import FileProject, Property, queryModel
+from typing import List, Optional, Tuple
+from pymongo import UpdateOne
 
 from db.mongodb import AsyncIOMotorClient
-from bson.objectid import ObjectId
+from core.cache import TTLCache
 from core.config import Config
 
-from models.iemap import Project as IEMAPModel
-from models.iemap import ProjectQueryResult
-from crud.pipelines import (
-    get_iemap_formulas_and_elements,
-    get_proj_stats,
-    get_proj_stats_by_user,
-)
-
-from dateutil.parser import parse
+from crud.catalog import catalog_cache, get_catalog
+from crud.pipelines import get_stats_counters
 
 # retrieve DB name and collection name from config
 database_name, ai4mat_collection_name = (Config.mongo_db, Config.mongo_coll)
+stats_collection_name = Config.mongo_coll_stats
+
+# cached statistics, dropped every time projects or files are written
+stats_cache = TTLCache(ttl=Config.stats_cache_ttl, maxsize=1024)
+
+
+def invalidate_stats() -> None:
+    """Mark cached statistics as stale (next request recomputes them)"""
+    stats_cache.invalidate()
+
 
 # get statitics about all projects
 async def project_stat(conn: AsyncIOMotorClient) -> dict:
-    # get Motor Client
-    coll = conn[database_name][ai4mat_collection_name]
-    # execute aggregation pipeline
-    pipeline = get_proj_stats()
-    # result[0] to return a dictionary
-    result = await coll.aggregate(pipeline).to_list(length=None)
-    return result[0]
+    return await stats_cache.get_or_compute(
+        "project_stat", lambda: compute_project_stat(conn)
+    )
+
+
+async def compute_project_stat(conn: AsyncIOMotorClient) -> dict:
+    # read counters maintained incrementally (see update_counters)
+    coll = conn[database_name][stats_collection_name]
+    total = await coll.find_one({"_id": "global"}) or {}
+    affiliations = await coll.find({"kind": "affiliation"}).to_list(None)
+    n_users = await coll.count_documents({"kind": "user", "projects": {"$gt": 0}})
+    return {
+        "totalProj": total.get("projects", 0),
+        "totalUsers": n_users,
+        "countProj": [
+            {"affiliation": a["key"], "n": a["projects"]}
+            for a in affiliations
+            if a["projects"] > 0
+        ],
+        "countFiles": [
+            {"affiliation": a["key"], "n": a["files"]}
+            for a in affiliations
+            if a["projectsWithFiles"] > 0
+        ],
+    }
 
 
 # get statitics about a SPECIFIC user's projects
 async def project_stat_user(conn: AsyncIOMotorClient, email: str) -> dict:
-    # get Motor Client
+    return await stats_cache.get_or_compute(
+        ("project_stat_user", email), lambda: compute_project_stat_user(conn, email)
+    )
+
+
+async def compute_project_stat_user(conn: AsyncIOMotorClient, email: str) -> dict:
+    # read counters maintained incrementally (see update_counters)
+    coll = conn[database_name][stats_collection_name]
+    total = await coll.find_one({"_id": "global"}) or {}
+    user = await coll.find_one({"_id": f"user:{email}"}) or {}
+    return {
+        "total": total.get("projects", 0),
+        "totalByUser": user.get("projects", 0),
+        "totalByUserWithFile": user.get("projectsWithFiles", 0),
+        "totalByUserCountFiles": user.get("files", 0),
+        "totalByUserStorageBytes": user.get("storageBytes", 0),
+    }
+
+
+def counter_ids(provenance: Optional[dict]) -> List[Tuple[str, dict]]:
+    """Counter documents (_id, static fields) affected by a project"""
+    provenance = provenance or {}
+    email, affiliation = provenance.get("email"), provenance.get("affiliation")
+    return [
+        ("global", {"kind": "global", "key": None}),
+        (f"affiliation:{affiliation}", {"kind": "affiliation", "key": affiliation}),
+        (f"user:{email}", {"kind": "user", "key": email, "affiliation": affiliation}),
+    ]
+
+
+async def update_counters(
+    conn: AsyncIOMotorClient,
+    provenance: Optional[dict],
+    projects: int = 0,
+    projects_with_files: int = 0,
+    files: int = 0,
+    storage_bytes: int = 0,
+):
+    """Increment (or decrement) statistics counters of global, affiliation
+    and user documents, to call from every code path writing projects or files
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        provenance (dict): provenance of the project written (email, affiliation)
+        projects (int, optional): projects added. Defaults to 0.
+        projects_with_files (int, optional): projects having now (-1: no more) files. Defaults to 0.
+        files (int, optional): files added (negative if removed). Defaults to 0.
+        storage_bytes (int, optional): size of files added (negative if removed). Defaults to 0.
+    """
+    invalidate_stats()
+    if not any((projects, projects_with_files, files, storage_bytes)):
+        return
+    increments = {
+        "projects": projects,
+        "projectsWithFiles": projects_with_files,
+        "files": files,
+        "storageBytes": storage_bytes,
+    }
+    await conn[database_name][stats_collection_name].bulk_write(
+        [
+            UpdateOne(
+                {"_id": _id},
+                {"$inc": increments, "$set": fields},
+                upsert=True,
+            )
+            for _id, fields in counter_ids(provenance)
+        ],
+        ordered=False,
+    )
+
+
+async def reconcile_stats(conn: AsyncIOMotorClient) -> int:
+    """Recompute every statistics counter from projects collection
+    (fixes drift caused e.g. by failed writes or documents edited by hand)
+
+    Counters are read before projects are aggregated and corrected with $inc
+    of the difference, so that increments made while the aggregation runs
+    (see update_counters) are kept
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+
+    Returns:
+        int: number of counter documents corrected
+    """
     coll = conn[database_name][ai4mat_collection_name]
-    # execute aggregation pipeline
-    pipeline = get_proj_stats_by_user(email=email)
-    # result[0] to return a dictionary
-    result = await coll.aggregate(pipeline).to_list(length=None)
-    return result[0]
+    stats_coll = conn[database_name][stats_collection_name]
+    counter_keys = ("projects", "projectsWithFiles", "files", "storageBytes")
+    kinds = {"kind": {"$in": ["global", "affiliation", "user"]}}
+    before = {
+        doc["_id"]: doc
+        async for doc in stats_coll.find(kinds, {key: 1 for key in counter_keys})
+    }
+    counters = {}
+    async for row in coll.aggregate(get_stats_counters()):
+        for _id, fields in counter_ids(row["_id"]):
+            counter = counters.setdefault(
+                _id, {**fields, **{key: 0 for key in counter_keys}}
+            )
+            for key in counter_keys:
+                counter[key] += row.get(key) or 0
+    counters.setdefault(
+        "global",
+        {"kind": "global", "key": None, **{key: 0 for key in counter_keys}},
+    )
+    updates = []
+    for _id in counters.keys() | before.keys():
+        counter, previous = counters.get(_id, {}), before.get(_id, {})
+        delta = {
+            key: (counter.get(key) or 0) - (previous.get(key) or 0)
+            for key in counter_keys
+        }
+        if not any(delta.values()) and _id in before:
+            continue
+        # $set keeps quotas (quotaBytes) set on affiliation and user documents
+        fields = {k: v for k, v in counter.items() if k not in counter_keys}
+        update = {"$inc": delta, "$set": fields} if fields else {"$inc": delta}
+        updates.append(UpdateOne({"_id": _id}, update, upsert=True))
+    if updates:
+        await stats_coll.bulk_write(updates, ordered=False)
+    # counters of users (and affiliations) without projects nor quota
+    await stats_coll.delete_many(
+        {
+            "kind": {"$in": ["affiliation", "user"]},
+            "quotaBytes": {"$exists": False},
+            **{key: {"$lte": 0} for key in counter_keys},
+        }
+    )
+    invalidate_stats()
+    return len(updates)
 
 
 # get distinct formulas and elements (with their count)
 async def iemap_formulas_elements(conn: AsyncIOMotorClient) -> dict:
-    # get Motor Client
-    coll = conn[database_name][ai4mat_collection_name]
-    # execute aggregation pipeline
-    pipeline = get_iemap_formulas_and_elements()
-    # result[0] to return a dictionary
-    result_arr = await coll.aggregate(pipeline).to_list(length=None)
-    number_of_formulas = len(result_arr[0]["formulas"])
-    number_of_elements = len(result_arr[0]["unique_elements"])
-    result: dict = result_arr[0]
-    data = {
-        **result,
-        "n_formulas": number_of_formulas,
-        "n_elements": number_of_elements,
+    # cached apart from stats_cache: dropped once the catalog has been written
+    return await catalog_cache.get_or_compute(
+        "iemap_formulas_elements", lambda: compute_iemap_formulas_elements(conn)
+    )
+
+
+async def compute_iemap_formulas_elements(conn: AsyncIOMotorClient) -> dict:
+    # read catalog maintained incrementally (see crud.catalog.update_catalog)
+    catalog = await get_catalog(conn)
+    return {
+        "formulas": list(catalog["formulas"]),
+        "unique_elements": list(catalog["elements"]),
+        "formulas_count": catalog["formulas"],
+        "elements_count": catalog["elements"],
+        "n_formulas": len(catalog["formulas"]),
+        "n_elements": len(catalog["elements"]),
     }
-    return data
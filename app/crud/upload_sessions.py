@@ -0,0 +1,165 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+from uuid import uuid4
+
+from pymongo import ReturnDocument
+
+from core.blobstore import BlobStore
+from core.config import Config
+from db.mongodb import AsyncIOMotorClient
+
+logger = logging.getLogger("ai4mat")
+
+database_name = Config.mongo_db
+sessions_collection_name = Config.mongo_coll_upload_sessions
+
+# an upload session is
+# {"_id": "<uuid hex>", "email", "project_id", "filename", "ext", "length": int,
+#  "parts": {"<offset>": <size>}, "createdAt", "expiresAt"}
+# every part is saved in blob store as <session id>.<offset>.part
+
+
+def part_key(session_id: str, offset: int) -> str:
+    return f"{session_id}.{offset}.part"
+
+
+def expires_at() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=Config.upload_session_ttl)
+
+
+def received_offset(session: dict) -> int:
+    """Number of contiguous bytes received from the beginning of the file
+    (where a client resumes the upload)"""
+    offset = 0
+    for start, size in sorted((int(k), v) for k, v in session["parts"].items()):
+        if start > offset:
+            break
+        offset = max(offset, start + size)
+    return offset
+
+
+def ordered_parts(session: dict) -> Optional[List[str]]:
+    """Keys of parts covering the whole file exactly once, in order
+    (None if parts are missing or overlap)"""
+    offset, keys = 0, []
+    for start, size in sorted((int(k), v) for k, v in session["parts"].items()):
+        if start != offset:
+            return None
+        keys.append(part_key(session["_id"], start))
+        offset += size
+    return keys if offset == session["length"] else None
+
+
+async def create_session(
+    conn: AsyncIOMotorClient,
+    email: str,
+    filename: str,
+    length: int,
+    project_id: Optional[str] = None,
+) -> dict:
+    """Create a new resumable upload session
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        email (str): user uploading the file
+        filename (str): name of file (with extension)
+        length (int): file size in bytes
+        project_id (str, optional): project to add the file to when upload is complete
+
+    Returns:
+        dict: session
+    """
+    session = {
+        "_id": uuid4().hex,
+        "email": email,
+        "project_id": project_id,
+        "filename": filename,
+        "ext": filename.split(".")[-1],
+        "length": length,
+        "parts": {},
+        "createdAt": datetime.utcnow(),
+        "expiresAt": expires_at(),
+    }
+    await conn[database_name][sessions_collection_name].insert_one(session)
+    return session
+
+
+async def get_session(
+    conn: AsyncIOMotorClient, session_id: str, email: str
+) -> Optional[dict]:
+    """Get a not expired session of user"""
+    return await conn[database_name][sessions_collection_name].find_one(
+        {"_id": session_id, "email": email, "expiresAt": {"$gt": datetime.utcnow()}}
+    )
+
+
+async def add_part(
+    conn: AsyncIOMotorClient, session_id: str, offset: int, size: int
+) -> Optional[dict]:
+    """Record a part saved in blob store (and extend session expiration)
+
+    Returns:
+        dict: updated session or None if session expired meanwhile
+    """
+    return await conn[database_name][sessions_collection_name].find_one_and_update(
+        {"_id": session_id, "expiresAt": {"$gt": datetime.utcnow()}},
+        {"$set": {f"parts.{offset}": size, "expiresAt": expires_at()}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def claim_session(
+    conn: AsyncIOMotorClient, session_id: str, email: str
+) -> Optional[dict]:
+    """Mark session as being finalized (only one request can finalize it)
+
+    Returns:
+        dict: session or None if not found, expired or already being finalized
+    """
+    return await conn[database_name][sessions_collection_name].find_one_and_update(
+        {
+            "_id": session_id,
+            "email": email,
+            "expiresAt": {"$gt": datetime.utcnow()},
+            "finalizing": {"$ne": True},
+        },
+        {"$set": {"finalizing": True}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def release_session(conn: AsyncIOMotorClient, session_id: str):
+    """Allow finalizing session again (e.g. after a failure)"""
+    await conn[database_name][sessions_collection_name].update_one(
+        {"_id": session_id}, {"$unset": {"finalizing": ""}}
+    )
+
+
+async def delete_session(conn: AsyncIOMotorClient, store: BlobStore, session: dict):
+    """Delete session and its parts"""
+    for offset in session["parts"]:
+        await store.delete(part_key(session["_id"], int(offset)))
+    await conn[database_name][sessions_collection_name].delete_one(
+        {"_id": session["_id"]}
+    )
+
+
+async def delete_expired_sessions(conn: AsyncIOMotorClient, store: BlobStore) -> int:
+    """Delete expired sessions and their parts (uploads never completed)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        store (BlobStore): blob store containing parts
+
+    Returns:
+        int: number of sessions deleted
+    """
+    coll = conn[database_name][sessions_collection_name]
+    deleted = 0
+    async for session in coll.find({"expiresAt": {"$lte": datetime.utcnow()}}):
+        await delete_session(conn, store, session)
+        deleted += 1
+    if deleted:
+        logger.info(f"Deleted {deleted} expired upload sessions")
+    return deleted
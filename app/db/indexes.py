@@ -0,0 +1,232 @@
+import logging
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from core.config import Config
+from core.lattice import LATTICE_PARAMS
+from crud import query_plans
+from db.mongodb import AsyncIOMotorClient
+
+logger = logging.getLogger("ai4mat")
+
+database_name = Config.mongo_db
+
+# DECLARATIVE INDEX REGISTRY: collection name -> indexes it must have
+# index names are explicit so that they can be used as hints (see crud.query_plans)
+INDEXES: Dict[str, List[IndexModel]] = {
+    Config.mongo_coll: [
+        IndexModel([("iemap_id", ASCENDING)], name="iemap_id_1", unique=True),
+        IndexModel(
+            [("provenance.email", ASCENDING), ("provenance.affiliation", ASCENDING)],
+            name="provenance.email_1_provenance.affiliation_1",
+        ),
+        IndexModel(
+            [("provenance.affiliation", ASCENDING)], name="provenance.affiliation_1"
+        ),
+        # multikey indexes (array fields)
+        IndexModel([("files.hash", ASCENDING)], name="files.hash_1"),
+        # files of properties, blob references (see crud.blob_refs.count_blob_references)
+        IndexModel([("properties.file", ASCENDING)], name="properties.file_1"),
+        IndexModel(
+            [("process.properties.file.hash", ASCENDING)],
+            name="process.properties.file.hash_1",
+        ),
+        IndexModel([("material.elements", ASCENDING)], name="material.elements_1"),
+        IndexModel(
+            [("parameters.name", ASCENDING), ("parameters.value", ASCENDING)],
+            name="parameters.name_1_parameters.value_1",
+        ),
+        IndexModel(
+            [("properties.name", ASCENDING), ("properties.value", ASCENDING)],
+            name="properties.name_1_properties.value_1",
+        ),
+        # parsed formulas (see core.composition), element fractions are a
+        # multikey index matched by $elemMatch on element and fraction range
+        IndexModel(
+            [("material.composition.reduced_formula", ASCENDING)],
+            name="material.composition.reduced_formula_1",
+        ),
+        IndexModel(
+            [
+                ("material.composition.elements.element", ASCENDING),
+                ("material.composition.elements.fraction", ASCENDING),
+            ],
+            name="material.composition.elements.element_1_material.composition.elements.fraction_1",
+        ),
+        # numeric lattice ranges (see crud.query_plans, lattice_*_min/max):
+        # one index per parameter, each can be queried alone
+        *(
+            IndexModel(
+                [(f"material.lattice_values.{p}", ASCENDING)],
+                name=f"material.lattice_values.{p}_1",
+            )
+            for p in LATTICE_PARAMS
+        ),
+        IndexModel(
+            [("process.isExperiment", ASCENDING), ("process.agent.name", ASCENDING)],
+            name="process.isExperiment_1_process.agent.name_1",
+        ),
+        IndexModel(
+            [("process.isExperiment", ASCENDING), ("process.method", ASCENDING)],
+            name="process.isExperiment_1_process.method_1",
+        ),
+        # sort fields used by keyset pagination (_id is the tie-breaker, see
+        # core.cursor.SORTABLE_FIELDS), each index is scanned in both directions
+        # and also serves filters on its first field
+        IndexModel(
+            [("iemap_id", ASCENDING), ("_id", ASCENDING)], name="iemap_id_1__id_1"
+        ),
+        IndexModel(
+            [("material.formula", ASCENDING), ("_id", ASCENDING)],
+            name="material.formula_1__id_1",
+        ),
+        IndexModel(
+            [("project.name", ASCENDING), ("_id", ASCENDING)],
+            name="project.name_1__id_1",
+        ),
+        IndexModel(
+            [("provenance.createdAt", DESCENDING), ("_id", DESCENDING)],
+            name="provenance.createdAt_-1__id_-1",
+        ),
+        IndexModel(
+            [("provenance.updatedAt", DESCENDING), ("_id", DESCENDING)],
+            name="provenance.updatedAt_-1__id_-1",
+        ),
+    ],
+    Config.mongo_coll_stats: [
+        IndexModel([("kind", ASCENDING), ("key", ASCENDING)], name="kind_1_key_1"),
+        # heaviest users/affiliations (see crud.quotas.top_storage_usage)
+        IndexModel(
+            [("kind", ASCENDING), ("storageBytes", DESCENDING)],
+            name="kind_1_storageBytes_-1",
+        ),
+    ],
+    Config.mongo_coll_blob_refs: [
+        # garbage blobs (see crud.blob_refs.sweep_blobs)
+        IndexModel(
+            [("refs", ASCENDING), ("zeroSince", ASCENDING)], name="refs_1_zeroSince_1"
+        ),
+    ],
+    Config.mongo_coll_jobs: [
+        # jobs due and jobs with expired lease (see crud.jobs.claim_job)
+        IndexModel(
+            [("status", ASCENDING), ("runAt", ASCENDING)], name="status_1_runAt_1"
+        ),
+        IndexModel(
+            [("status", ASCENDING), ("leaseUntil", ASCENDING)],
+            name="status_1_leaseUntil_1",
+        ),
+    ],
+    Config.mongo_coll_upload_sessions: [
+        # expired sessions (see crud.upload_sessions.delete_expired_sessions)
+        IndexModel([("expiresAt", ASCENDING)], name="expiresAt_1"),
+    ],
+    Config.mongo_coll_catalog: [
+        IndexModel([("kind", ASCENDING), ("value", ASCENDING)], name="kind_1_value_1"),
+    ],
+}
+
+# indexes replaced by the ones above, dropped if they still exist
+DROPPED_INDEXES: Dict[str, List[str]] = {
+    # superseded by the (field, _id) indexes used to sort
+    Config.mongo_coll: ["material.formula_1", "project.name_1"],
+}
+
+# index options compared to decide if an existing index must be rebuilt
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def is_same_index(existing: dict, declared: dict) -> bool:
+    """Check if an existing index (from index_information) matches a declared one"""
+    if list(existing["key"]) != list(declared["key"].items()):
+        return False
+    return all(existing.get(opt) == declared.get(opt) for opt in COMPARED_OPTIONS)
+
+
+def existing_index_model(name: str, existing: dict) -> IndexModel:
+    """IndexModel recreating an existing index (from index_information)"""
+    options = {k: existing[k] for k in COMPARED_OPTIONS if k in existing}
+    return IndexModel(list(existing["key"]), name=name, **options)
+
+
+async def rebuild_index(coll, existing: dict, index: IndexModel):
+    """Replace an index with the same name (MongoDB refuses two indexes on the
+    same keys): if the new one cannot be built (e.g. duplicated values of a
+    unique index) the existing one is restored
+
+    Raises:
+        OperationFailure: if the new index cannot be built
+    """
+    name = index.document["name"]
+    await coll.drop_index(name)
+    try:
+        await coll.create_indexes([index])
+    except OperationFailure:
+        await coll.create_indexes([existing_index_model(name, existing)])
+        raise
+
+
+async def ensure_indexes(conn: AsyncIOMotorClient) -> dict:
+    """Reconcile indexes on DB with the registry: missing indexes are created,
+    indexes whose definition changed are rebuilt, indexes replaced are dropped
+    (DROPPED_INDEXES), other indexes not declared are only reported (they
+    could have been created by hand on purpose)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+
+    Returns:
+        dict: {collection: {"created": [...], "rebuilt": [...], "dropped": [...], "unmanaged": [...], "failed": [...]}}
+    """
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        coll = conn[database_name][collection_name]
+        existing = await coll.index_information()
+        result = {
+            "created": [],
+            "rebuilt": [],
+            "dropped": [],
+            "unmanaged": [],
+            "failed": [],
+        }
+        for index in indexes:
+            declared = index.document
+            name = declared["name"]
+            try:
+                if name in existing:
+                    if is_same_index(existing[name], declared):
+                        continue
+                    await rebuild_index(coll, existing[name], index)
+                    result["rebuilt"].append(name)
+                else:
+                    await coll.create_indexes([index])
+                    result["created"].append(name)
+            except OperationFailure as e:
+                # e.g. duplicated values preventing a unique index
+                logger.error(f"Unable to build index {name} on {collection_name}: {e}")
+                result["failed"].append(name)
+        for name in DROPPED_INDEXES.get(collection_name, []):
+            if name in existing:
+                await coll.drop_index(name)
+                result["dropped"].append(name)
+        declared_names = {index.document["name"] for index in indexes}
+        result["unmanaged"] = [
+            n
+            for n in existing
+            if n not in declared_names | set(result["dropped"]) | {"_id_"}
+        ]
+        if result["unmanaged"]:
+            logger.warning(
+                f"Indexes not declared on {collection_name}: {result['unmanaged']}"
+            )
+        report[collection_name] = result
+
+    # let the query planner hint indexes that actually exist
+    names = await conn[database_name][Config.mongo_coll].index_information()
+    query_plans.available_indexes.clear()
+    query_plans.available_indexes.update(names)
+    query_plans.clear_plans()
+    logger.info(f"Indexes reconciled: {report}")
+    return report
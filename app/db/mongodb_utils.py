@@ -11,6 +11,7 @@ logger = logging.getLogger("ai4mat")
 from motor.motor_asyncio import AsyncIOMotorClient
 from core.config import Config
 from db.mongodb import db
+from db.indexes import ensure_indexes
 from typing import Optional, Annotated
 from pydantic import Field
 
@@ -36,6 +37,8 @@ async def connect_to_mongo():
     logger.info(
         f"Connection succesfully established at {datetime.now().strftime('%Y-%B-%d %H:%M:%S')}."
     )
+    # create missing indexes declared in db.indexes
+    await ensure_indexes(db.client)
     if Config.enable_onpremise_auth:
         db_users = db.client[Config.mongo_db]
         await init_beanie(
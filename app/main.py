@@ -1,6 +1,8 @@
 import mimetypes
 import sentry_sdk
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
+from sentry_sdk.integrations.fastapi import FastApiIntegration
+from sentry_sdk.integrations.starlette import StarletteIntegration
 from datetime import datetime
 from os import getcwd, path
 from logging.config import dictConfig
@@ -13,7 +15,8 @@ from fastapi.middleware.cors import CORSMiddleware
 # from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from core.utils import get_dir_uploaded
+from core.blobstore import get_blob_store
+from core.utils import blob_response
 
 # from starlette.exceptions import HTTPException
 # from starlette.middleware.cors import CORSMiddleware
@@ -28,6 +31,10 @@ sentry_sdk.init(
     # of transactions for performance monitoring.
     # We recommend adjusting this value in production.
     traces_sample_rate=1.0,
+    # auto enabled integrations import every supported framework installed
+    # (flask, boto3...) at startup: enable only the ones used
+    auto_enabling_integrations=False,
+    integrations=[StarletteIntegration(), FastApiIntegration()],
 )
 # import routes from a specific version
 from api.api_v1.api import router as api_router
@@ -40,6 +47,17 @@ from core.config import Config
 # from core.errors import http_422_error_handler, http_error_handler
 from db.mongodb_utils import close_mongo_connection, connect_to_mongo
 
+# background tasks (periodic maintenance jobs)
+from db.mongodb import db
+from core.periodic import start_periodic, stop_periodic_tasks
+from crud.leases import with_lease
+from crud.stats import reconcile_stats
+from crud.catalog import reconcile_catalog
+from crud.blob_refs import reconcile_blob_refs, sweep_blobs
+from crud.upload_sessions import delete_expired_sessions
+from core.jobs import start_worker, stop_worker
+from core.processpool import shutdown_process_pool
+
 # loads logging configuration
 from core.log_config import logging_config
 
@@ -100,16 +118,84 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=Config.allowed_hosts,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PATCH", "HEAD", "OPTIONS"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"],
     allow_headers=[
         "Access-Control-Allow-Headers",
         "Content-Type",
         "Authorization",
         "Access-Control-Allow-Origin",
+        # resumable uploads (see api.api_v1.endpoints.uploads)
+        "Upload-Offset",
+        "Upload-Length",
     ],
+    expose_headers=["Upload-Offset", "Upload-Length", "ETag"],
 )
 
+
+async def start_background_tasks():
+    # full recompute of statistics counters to fix any drift
+    # (run by a single process, the one holding the lease, after startup)
+    start_periodic(
+        "stats-reconcile",
+        Config.stats_reconcile_interval,
+        with_lease(
+            db.client,
+            "stats-reconcile",
+            Config.stats_reconcile_interval,
+            lambda: reconcile_stats(db.client),
+        ),
+        delay=Config.stats_reconcile_delay,
+    )
+    # full recompute of formulas/elements catalog
+    start_periodic(
+        "catalog-reconcile",
+        Config.stats_reconcile_interval,
+        with_lease(
+            db.client,
+            "catalog-reconcile",
+            Config.stats_reconcile_interval,
+            lambda: reconcile_catalog(db.client),
+        ),
+        delay=Config.stats_reconcile_delay,
+    )
+    # full recompute of files references, then delete files without references
+    start_periodic(
+        "blob-refs-reconcile",
+        Config.stats_reconcile_interval,
+        with_lease(
+            db.client,
+            "blob-refs-reconcile",
+            Config.stats_reconcile_interval,
+            lambda: reconcile_blob_refs(db.client),
+        ),
+        delay=Config.stats_reconcile_delay,
+    )
+    start_periodic(
+        "blob-gc",
+        Config.blob_gc_interval,
+        lambda: sweep_blobs(db.client, get_blob_store()),
+        delay=Config.blob_gc_interval,
+    )
+    # delete chunks of resumable uploads never finalized
+    start_periodic(
+        "upload-sessions-cleanup",
+        Config.blob_gc_interval,
+        lambda: delete_expired_sessions(db.client, get_blob_store()),
+    )
+    # processing of uploaded files (or run python -m worker)
+    if Config.jobs_worker_in_api:
+        start_worker(db.client, get_blob_store())
+
+
+async def stop_background_tasks():
+    await stop_periodic_tasks()
+    await stop_worker()
+    shutdown_process_pool()
+
+
 app.add_event_handler("startup", connect_to_mongo)
+app.add_event_handler("startup", start_background_tasks)
+app.add_event_handler("shutdown", stop_background_tasks)
 app.add_event_handler("shutdown", close_mongo_connection)
 
 
@@ -146,12 +232,13 @@ current_user = fastapi_users.current_user(verified=True)
 # TO SERVE FILES
 # http://0.0.0.0:8001/file/hashfile
 @app.api_route("/file/{name_file}", methods=["GET"])
-def get_file(
+async def get_file(
     name_file: str,
+    request: Request,
     # comment row below to remove authentication for this endpoint
     user: UserAuth = Depends(current_user),
 ):
-    """Download file from server
+    """Download file from server (supports Range, If-Range and If-None-Match)
 
     Args:
         name_file (str): file name expressed as <hash>.<extension>
@@ -162,20 +249,7 @@ def get_file(
     Returns:
         stream: binary data of file
     """
-
-    upload_dir = Config.files_dir
-    base_dir = get_dir_uploaded(upload_dir)
-    # path for file to write on file system
-    file_path = base_dir / name_file
-    # print(file_path)
-    isExisting = file_path.is_file()
-    if isExisting:
-        mtype, _ = mimetypes.guess_type(file_path)
-        return FileResponse(file_path)  # , media_type=mtype)
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="File not found!!"
-        )
+    return await blob_response(get_blob_store(), name_file, request)
 
 
 # CATCH ALL ROUTE IT NEEDS TO BE LAST
@@ -0,0 +1,74 @@
+"""Set composition of material formulas (material.composition: reduced
+formula, atoms and atomic fraction of each element, see core.composition)
+on existing projects (compositions saved before reduced formulas were in Hill
+order are updated)
+
+Formulas are parsed once each (parsing is memoized).
+
+Run from app directory:
+    python -m migrations.composition [--batch-size 1000]
+"""
+import argparse
+import asyncio
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from core.composition import composition_document
+from core.config import Config
+
+logger = logging.getLogger("ai4mat")
+
+
+async def migrate(conn: AsyncIOMotorClient, batch_size: int = 1000) -> int:
+    """Set material.composition on documents not having it (or having one
+    computed by a previous version of core.composition)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        batch_size (int, optional): documents updated by each bulk write. Defaults to 1000.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = conn[Config.mongo_db][Config.mongo_coll]
+    cursor = coll.find(
+        {"material": {"$exists": True}},
+        {"material.formula": 1, "material.composition": 1},
+    ).batch_size(batch_size)
+    updated, batch = 0, []
+    async for doc in cursor:
+        material = doc.get("material") or {}
+        composition = composition_document(material.get("formula"))
+        if "composition" in material and material["composition"] == composition:
+            continue
+        batch.append(
+            UpdateOne(
+                {"_id": doc["_id"]}, {"$set": {"material.composition": composition}}
+            )
+        )
+        if len(batch) >= batch_size:
+            result = await coll.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch = []
+    if batch:
+        result = await coll.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+    return updated
+
+
+async def main(batch_size: int):
+    conn = AsyncIOMotorClient(str(Config.mongo_uri))
+    try:
+        updated = await migrate(conn, batch_size)
+        print(f"Composition set on {updated} documents")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
@@ -0,0 +1,72 @@
+"""Backfill periodic table bitmask of material elements
+(material.elements_mask_lo/hi, see core.elements) on existing projects
+
+Run from app directory:
+    python -m migrations.elements_bitmask [--batch-size 500]
+"""
+import argparse
+import asyncio
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from core.config import Config
+from core.elements import elements_mask
+
+logger = logging.getLogger("ai4mat")
+
+
+async def migrate(conn: AsyncIOMotorClient, batch_size: int = 500) -> int:
+    """Set elements bitmask on projects not having it (or having a stale one)
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        batch_size (int, optional): documents updated by each bulk write. Defaults to 500.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = conn[Config.mongo_db][Config.mongo_coll]
+    updated, batch = 0, []
+    cursor = coll.find(
+        {"material": {"$exists": True}},
+        {
+            "material.elements": 1,
+            "material.elements_mask_lo": 1,
+            "material.elements_mask_hi": 1,
+        },
+    ).batch_size(batch_size)
+    async for doc in cursor:
+        material = doc.get("material") or {}
+        lo, hi = elements_mask(material.get("elements"))
+        if (material.get("elements_mask_lo"), material.get("elements_mask_hi")) == (lo, hi):
+            continue
+        batch.append(
+            UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"material.elements_mask_lo": lo, "material.elements_mask_hi": hi}},
+            )
+        )
+        if len(batch) >= batch_size:
+            updated += (await coll.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await coll.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+async def main(batch_size: int):
+    conn = AsyncIOMotorClient(str(Config.mongo_uri))
+    try:
+        updated = await migrate(conn, batch_size)
+        print(f"Elements bitmask set on {updated} documents")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
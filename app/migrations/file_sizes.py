@@ -0,0 +1,98 @@
+"""Backfill numeric size of projects' files (files.size_bytes) and recompute
+storage counters of users and affiliations (see crud.quotas)
+
+Size is read from the blob store, or parsed from the human readable size
+("12.345 MB") when the blob is missing.
+
+Run from app directory:
+    python -m migrations.file_sizes [--batch-size 500]
+"""
+import argparse
+import asyncio
+import logging
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from core.blobstore import BlobStore, blob_key, get_blob_store
+from core.config import Config
+from core.utils import SIZE_UNIT
+from crud.stats import reconcile_stats
+
+logger = logging.getLogger("ai4mat")
+
+
+def parse_str_size(size: Optional[str]) -> Optional[int]:
+    """Bytes from a size formatted by core.utils.get_str_size (e.g. "12.345 MB")"""
+    try:
+        value, unit = (size or "").split()
+        return round(float(value) * 1024 ** (SIZE_UNIT[unit].value - 1))
+    except (ValueError, KeyError):
+        return None
+
+
+async def file_size(store: BlobStore, f: dict) -> Optional[int]:
+    info = None
+    if f.get("hash") and f.get("extention"):
+        info = await store.stat(blob_key(f["hash"], f["extention"]))
+    if info is not None:
+        return info.size
+    logger.warning(f"File {f.get('hash')}.{f.get('extention')} not found")
+    return parse_str_size(f.get("size"))
+
+
+async def migrate(
+    conn: AsyncIOMotorClient, store: BlobStore, batch_size: int = 500
+) -> int:
+    """Set size_bytes on files not having it
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        store (BlobStore): blob store containing files
+        batch_size (int, optional): documents updated by each bulk write. Defaults to 500.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = conn[Config.mongo_db][Config.mongo_coll]
+    updated, batch = 0, []
+    cursor = coll.find(
+        {"files": {"$elemMatch": {"size_bytes": {"$exists": False}}}},
+        {"files.hash": 1, "files.extention": 1, "files.size": 1, "files.size_bytes": 1},
+    ).batch_size(batch_size)
+    async for doc in cursor:
+        sizes = {}
+        for i, f in enumerate(doc["files"]):
+            if "size_bytes" not in f:
+                sizes[i] = await file_size(store, f)
+        batch.append(
+            UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {f"files.{i}.size_bytes": size for i, size in sizes.items()}},
+            )
+        )
+        if len(batch) >= batch_size:
+            updated += (await coll.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await coll.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+async def main(batch_size: int):
+    conn = AsyncIOMotorClient(str(Config.mongo_uri))
+    try:
+        updated = await migrate(conn, get_blob_store(), batch_size)
+        print(f"Files size set on {updated} documents")
+        # storage counters are sums of files.size_bytes
+        await reconcile_stats(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
@@ -0,0 +1,78 @@
+"""Give a new iemap_id to projects sharing it with an older project (or
+having none), so that the unique index on iemap_id can be built
+
+Ids were 6 hex digits (24 bits): collisions are likely on large collections.
+The oldest project (by _id) keeps a duplicated id.
+
+Run from app directory (then restart the API to rebuild indexes):
+    python -m migrations.iemap_ids [--batch-size 500]
+"""
+import argparse
+import asyncio
+import logging
+from uuid import uuid4
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from core.config import Config
+
+logger = logging.getLogger("ai4mat")
+
+
+def new_iemap_id() -> str:
+    # as models.iemap.newProject.set_id
+    return "iemap-" + uuid4().hex
+
+
+async def migrate(conn: AsyncIOMotorClient, batch_size: int = 500) -> int:
+    """Set a new iemap_id on duplicated and missing ids
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        batch_size (int, optional): documents updated by each bulk write. Defaults to 500.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = conn[Config.mongo_db][Config.mongo_coll]
+    updated, batch = 0, []
+    duplicates = coll.aggregate(
+        [
+            {"$sort": {"_id": 1}},
+            {"$group": {"_id": "$iemap_id", "ids": {"$push": "$_id"}}},
+            {"$match": {"$or": [{"_id": None}, {"ids.1": {"$exists": True}}]}},
+        ],
+        allowDiskUse=True,
+    )
+    async for group in duplicates:
+        # projects without id all get one, else the oldest keeps it
+        ids = group["ids"] if group["_id"] is None else group["ids"][1:]
+        for _id in ids:
+            batch.append(
+                UpdateOne({"_id": _id}, {"$set": {"iemap_id": new_iemap_id()}})
+            )
+            if len(batch) >= batch_size:
+                result = await coll.bulk_write(batch, ordered=False)
+                updated += result.modified_count
+                batch = []
+    if batch:
+        result = await coll.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+    return updated
+
+
+async def main(batch_size: int):
+    conn = AsyncIOMotorClient(str(Config.mongo_uri))
+    try:
+        updated = await migrate(conn, batch_size)
+        print(f"New iemap_id set on {updated} documents")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
@@ -0,0 +1,93 @@
+"""Set numeric lattice parameters (material.lattice_values) of projects saved
+with lattice parameters as strings only (see core.lattice)
+
+Strings of a whole batch of documents are converted at once.
+
+Run from app directory:
+    python -m migrations.lattice_values [--batch-size 1000]
+"""
+import argparse
+import asyncio
+import logging
+from typing import List, Optional
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from core.config import Config
+from core.lattice import LATTICE_PARAMS, lattice_floats
+
+logger = logging.getLogger("ai4mat")
+
+
+def source_lattice(doc: dict) -> Optional[dict]:
+    """Lattice of input, else output, as models.iemap.Material.numeric_lattice"""
+    material = doc.get("material") or {}
+    for part in ("input", "output"):
+        lattice = (material.get(part) or {}).get("lattice")
+        if lattice:
+            return lattice
+    return None
+
+
+def lattice_updates(docs: List[dict]) -> List[UpdateOne]:
+    lattices = [source_lattice(doc) for doc in docs]
+    numbers = lattice_floats(
+        (lattice or {}).get(p) for lattice in lattices for p in LATTICE_PARAMS
+    ).reshape(len(docs), len(LATTICE_PARAMS))
+    updates = []
+    for doc, row in zip(docs, numbers):
+        values = None
+        if not np.isnan(row).all():
+            values = {
+                p: None if np.isnan(x) else float(x) for p, x in zip(LATTICE_PARAMS, row)
+            }
+        updates.append(
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"material.lattice_values": values}})
+        )
+    return updates
+
+
+async def migrate(conn: AsyncIOMotorClient, batch_size: int = 1000) -> int:
+    """Set material.lattice_values on documents not having it
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        batch_size (int, optional): documents converted and updated at once. Defaults to 1000.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = conn[Config.mongo_db][Config.mongo_coll]
+    cursor = coll.find(
+        {"material": {"$exists": True}, "material.lattice_values": {"$exists": False}},
+        {"material.input.lattice": 1, "material.output.lattice": 1},
+    ).batch_size(batch_size)
+    updated, batch = 0, []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            result = await coll.bulk_write(lattice_updates(batch), ordered=False)
+            updated += result.modified_count
+            batch = []
+    if batch:
+        result = await coll.bulk_write(lattice_updates(batch), ordered=False)
+        updated += result.modified_count
+    return updated
+
+
+async def main(batch_size: int):
+    conn = AsyncIOMotorClient(str(Config.mongo_uri))
+    try:
+        updated = await migrate(conn, batch_size)
+        print(f"Numeric lattice parameters set on {updated} documents")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
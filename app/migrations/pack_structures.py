@@ -0,0 +1,86 @@
+"""Pack sites, cell and species of materials saved as lists
+(see core.structures): smaller documents, faster to read and validate
+
+Run from app directory:
+    python -m migrations.pack_structures [--batch-size 500]
+"""
+import argparse
+import asyncio
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from core.config import Config
+from core.structures import CellArray, PackedSpecies, SitesArray
+
+logger = logging.getLogger("ai4mat")
+
+FIELDS = {"sites": SitesArray, "cell": CellArray, "species": PackedSpecies}
+
+
+def packed_fields(doc: dict) -> dict:
+    """$set of packed values of doc's material input/output stored as lists"""
+    fields = {}
+    material = doc.get("material") or {}
+    for part in ("input", "output"):
+        structure = material.get(part) or {}
+        for field, packed_type in FIELDS.items():
+            if not isinstance(structure.get(field), list):
+                continue
+            try:
+                packed = packed_type.validate(structure[field])
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Project {doc['_id']} material.{part}.{field}: {e}")
+                continue
+            fields[f"material.{part}.{field}"] = packed.to_bson()
+    return fields
+
+
+async def migrate(conn: AsyncIOMotorClient, batch_size: int = 500) -> int:
+    """Pack structures of documents having sites, cell or species as lists
+
+    Args:
+        conn (AsyncIOMotorClient): Motor MongoDB client connection
+        batch_size (int, optional): documents updated by each bulk write. Defaults to 500.
+
+    Returns:
+        int: number of documents updated
+    """
+    coll = conn[Config.mongo_db][Config.mongo_coll]
+    # packed values are documents: only values still saved as lists are matched
+    query = {
+        "$or": [
+            {f"material.{part}.{field}": {"$type": "array"}}
+            for part in ("input", "output")
+            for field in FIELDS
+        ]
+    }
+    projection = {f"material.{part}": 1 for part in ("input", "output")}
+    updated, batch = 0, []
+    async for doc in coll.find(query, projection).batch_size(batch_size):
+        fields = packed_fields(doc)
+        if fields:
+            batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(batch) >= batch_size:
+            updated += (await coll.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await coll.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+async def main(batch_size: int):
+    conn = AsyncIOMotorClient(str(Config.mongo_uri))
+    try:
+        updated = await migrate(conn, batch_size)
+        print(f"Structures packed on {updated} documents")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
@@ -0,0 +1,44 @@
+"""Move files saved flat in FILESDIR (<sha1>.<ext>) to the configured
+blob store (sharded local layout ab/cd/<sha1>.<ext> or S3 bucket)
+
+Run from app directory:
+    python -m migrations.shard_blobs [--dry-run]
+"""
+import argparse
+import asyncio
+import re
+
+from core.blobstore import BASE_DIR, get_blob_store
+from core.config import Config
+
+# blob keys are <sha1>.<ext>
+BLOB_KEY = re.compile(r"^[0-9a-f]{40}\.[^/]+$")
+
+
+async def migrate(dry_run: bool = False) -> int:
+    """Put every flat file in the blob store (files are moved)
+
+    Args:
+        dry_run (bool, optional): only count files to move. Defaults to False.
+
+    Returns:
+        int: number of files moved
+    """
+    store = get_blob_store()
+    moved = 0
+    for path in sorted((BASE_DIR / Config.files_dir).iterdir()):
+        if not path.is_file() or not BLOB_KEY.match(path.name):
+            continue
+        if not dry_run:
+            # an already existing blob (same content) is kept, the flat copy removed
+            await store.put_file(path, path.name)
+        moved += 1
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    moved = asyncio.run(migrate(args.dry_run))
+    print(f"{moved} files {'to move' if args.dry_run else 'moved'}")
@@ -13,6 +13,11 @@ from fastapi import Form
 from uuid import uuid4
 from re import findall
 
+from core.composition import composition_document
+from core.elements import elements_mask
+from core.lattice import LATTICE_PARAMS, lattice_values
+from core.structures import STRUCTURE_JSON_ENCODERS, CellArray, PackedSpecies, SitesArray
+
 
 class ObjectIdStr(str):
     @classmethod
@@ -82,25 +87,57 @@ class Lattice(BaseModel):
     gamma: str
 
 
+class LatticeValues(BaseModel):
+    """Lattice parameters as numbers (None if not a number)"""
+
+    a: Optional[float]
+    b: Optional[float]
+    c: Optional[float]
+    alpha: Optional[float]
+    beta: Optional[float]
+    gamma: Optional[float]
+
+
+class ElementComposition(BaseModel):
+    element: str
+    count: float
+    # atomic fraction (rounded, see core.composition)
+    fraction: float
+
+
+class Composition(BaseModel):
+    reduced_formula: str
+    atoms: float
+    elements: List[ElementComposition]
+
+
+# sites, species and cell are validated with NumPy and stored packed (see core.structures)
 class InputMaterial(BaseModel):
     lattice: Optional[Lattice]
-    sites: List[List[float]]
-    species: List[str]
-    cell: List[List[float]]
+    sites: SitesArray
+    species: PackedSpecies
+    cell: CellArray
 
 
 class OutputMaterial(BaseModel):
     lattice: Optional[Lattice]
-    sites: List[List[float]]
-    species: List[str]
-    cell: List[List[float]]
+    sites: SitesArray
+    species: PackedSpecies
+    cell: CellArray
 
 
 class Material(BaseModel):
     formula: str
     elements: Optional[List[str]]  # List[Union[str, str]]
+    # periodic table bitmask of elements (see core.elements)
+    elements_mask_lo: Optional[int]
+    elements_mask_hi: Optional[int]
     input: Optional[InputMaterial]
     output: Optional[OutputMaterial]
+    # numeric lattice parameters (of input, else output), see core.lattice
+    lattice_values: Optional[LatticeValues]
+    # parsed formula (None if not a chemical formula), see core.composition
+    composition: Optional[Composition]
 
     @validator("elements", always=True)
     def composite_name(cls, v, values, **kwargs):
@@ -111,6 +148,25 @@ class Material(BaseModel):
         ]
         return elements
 
+    @validator("elements_mask_lo", always=True)
+    def mask_lo(cls, v, values, **kwargs):
+        return elements_mask(values.get("elements"))[0]
+
+    @validator("elements_mask_hi", always=True)
+    def mask_hi(cls, v, values, **kwargs):
+        return elements_mask(values.get("elements"))[1]
+
+    @validator("lattice_values", always=True)
+    def numeric_lattice(cls, v, values, **kwargs):
+        for structure in (values.get("input"), values.get("output")):
+            if structure is not None and structure.lattice is not None:
+                return lattice_values(structure.lattice.dict())
+        return None
+
+    @validator("composition", always=True)
+    def formula_composition(cls, v, values, **kwargs):
+        return composition_document(values.get("formula"))
+
 
 class PropertyFile(BaseModel):
     fullpath: str
@@ -170,6 +226,7 @@ class FileProject(BaseModel):
     # type: fileType
     # isProcessed: bool
     size: Optional[str]
+    size_bytes: Optional[int]  # size as number (storage accounting)
     createdAt: Annotated[
         datetime, Field(default_factory=lambda: datetime.now().utcnow())
     ]
@@ -181,6 +238,33 @@ class FileProject(BaseModel):
         use_enum_values = True
 
 
+class FileByHash(BaseModel):
+    """File already stored on server (same SHA-1), attached without uploading it"""
+
+    hash: str = Field(..., regex="^[0-9a-f]{40}$")  # SHA-1 computed by client
+    name: str
+    extention: str = Field(..., regex="^[A-Za-z0-9]+$")
+
+
+class UploadSessionCreate(BaseModel):
+    """Resumable upload of a file sent in chunks (see api/api_v1/endpoints/uploads.py)"""
+
+    filename: str = Field(..., regex=r"^[^/\\]+\.[A-Za-z0-9]+$")
+    length: int = Field(..., gt=0)  # file size in bytes
+    content_type: str = "application/octet-stream"
+    project_id: Optional[ObjectIdStr]  # project to add the file to once complete
+
+
+class CifArchiveMetadata(BaseModel):
+    """Metadata shared by projects imported from an archive of CIF files
+    (material of each project is read from its CIF file)"""
+
+    project: Project
+    process: Process
+    parameters: List[Parameter] = []
+    properties: List[Property] = []
+
+
 def validate_datetime(cls, values):
     """
     Reusable validator for pydantic models
@@ -204,7 +288,8 @@ class newProject(BaseModel):
     # alternatively use Field with default_factory or PrivateAttr with default_factory
     @validator("iemap_id", pre=True, always=True)
     def set_id(cls, v):
-        return v or "iemap-" + str(uuid4())[:6]
+        # full uuid4: iemap_id is unique (short ids collide on bulk imports)
+        return v or "iemap-" + uuid4().hex
 
     class Config:
         validate_assignment = True
@@ -238,6 +323,10 @@ class ProjectQueryResult(BaseModel):
     properties: Optional[List[Properties]]
     files: Optional[List[FileProject]]
 
+    class Config:
+        # packed structures are decoded to lists only when sent to clients
+        json_encoders = STRUCTURE_JSON_ENCODERS
+
 
 # Put your query arguments in this dict
 query_params = {
@@ -249,8 +338,12 @@ query_params = {
     "publication_dates": (str, None),
     "date_publication": (datetime, None),
     "material_formula": (str, None),
+    "material_reduced_formula": (str, None),
+    # element fractions, e.g. "Li:0.1-0.3,O:>0.5" (see crud.query_plans)
+    "composition": (str, None),
     "material_all_elements": (str, None),
     "material_any_element": (str, None),
+    "material_only_elements": (str, None),
     "iemap_id": (str, None),
     "isExperiment": (bool, None),
     "simulationCode": (str, None),
@@ -261,7 +354,17 @@ query_params = {
     "parameterValue": (Union[str, float], None),
     "propertyName": (str, None),
     "propertyValue": (Union[str, float], None),
+    # numeric lattice ranges: lattice_a_min, lattice_a_max, ... lattice_gamma_max
+    **{
+        f"lattice_{p}_{bound}": (float, None)
+        for p in LATTICE_PARAMS
+        for bound in ("min", "max")
+    },
     "fields": (str, None),
+    # keyset pagination (see core.cursor)
+    "sort": (str, None),
+    "cursor": (str, None),
+    "limit": (int, None),
 }
 
 queryModel = create_model("Query", **query_params)
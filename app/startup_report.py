@@ -0,0 +1,147 @@
+"""Report import time and resident memory of the API process startup
+
+Modules are imported in a fresh interpreter, time and memory are reported by
+top level package (imports done by a package are counted in it).
+
+Run from repository root or app directory:
+    python -m app.startup_report [--module main] [--top 25] [--budget]
+
+With --budget exits with status 1 if startup exceeds BUDGET_SECONDS or
+BUDGET_RSS_MB, or if a FORBIDDEN module is imported (e.g. in CI).
+"""
+import argparse
+import builtins
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+APP_DIR = Path(__file__).resolve().parent
+
+# startup budget of the API process (python -m startup_report --budget)
+BUDGET_SECONDS = 2.0
+BUDGET_RSS_MB = 200
+# heavy scientific dependencies loaded on first use only (see core.parsing)
+FORBIDDEN = ("pymatgen", "scipy", "spglib", "matplotlib", "pandas")
+
+MB = 1024 * 1024
+
+
+def rss() -> int:
+    """Resident memory of current process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # not Linux: peak resident memory (bytes on macOS)
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def first_party() -> set:
+    return {
+        p.stem
+        for p in APP_DIR.iterdir()
+        if p.suffix == ".py" or (p.is_dir() and not p.name.startswith((".", "_")))
+    }
+
+
+def measure(module: str) -> dict:
+    """Import module recording time and memory of each top level package
+    imported (to run in a fresh interpreter)"""
+    own = first_party()
+    packages: Dict[str, List[float]] = {}
+    active: List[str] = []
+    original_import = builtins.__import__
+
+    def tracked_import(name, globals=None, locals=None, fromlist=(), level=0):
+        package = name.split(".")[0]
+        if level or active or package in own or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        active.append(package)
+        start, start_rss = time.perf_counter(), rss()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            active.pop()
+            stats = packages.setdefault(package, [0.0, 0])
+            stats[0] += time.perf_counter() - start
+            stats[1] += rss() - start_rss
+
+    start, start_rss = time.perf_counter(), rss()
+    builtins.__import__ = tracked_import
+    try:
+        __import__(module)
+    finally:
+        builtins.__import__ = original_import
+    return {
+        "module": module,
+        "seconds": time.perf_counter() - start,
+        "rss_start": start_rss,
+        "rss": rss(),
+        "packages": packages,
+        "loaded": sorted({name.split(".")[0] for name in sys.modules}),
+    }
+
+
+def run_measure(module: str) -> dict:
+    # fresh interpreter: modules imported by this script would not be measured
+    output = subprocess.run(
+        [sys.executable, "-m", "startup_report", "--measure", module],
+        cwd=APP_DIR,
+        env={**os.environ, "PYTHONPATH": str(APP_DIR)},
+        capture_output=True,
+        text=True,
+    )
+    if output.returncode != 0:
+        sys.stderr.write(output.stderr)
+        raise SystemExit(f"Cannot import {module}")
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def report(result: dict, top: int):
+    print(f"{'package':<30} {'import ms':>10} {'RSS MB':>8}")
+    packages = sorted(result["packages"].items(), key=lambda p: -p[1][0])
+    for name, (seconds, memory) in packages[:top]:
+        print(f"{name:<30} {seconds * 1000:10.1f} {memory / MB:8.1f}")
+    print(
+        f"{'total ' + result['module']:<30} {result['seconds'] * 1000:10.1f} "
+        f"{(result['rss'] - result['rss_start']) / MB:8.1f}"
+    )
+    print(f"Resident memory after startup: {result['rss'] / MB:.1f} MB")
+
+
+def check_budget(result: dict) -> List[str]:
+    """Budget violations (empty if startup is within budget)"""
+    errors = []
+    if result["seconds"] > BUDGET_SECONDS:
+        errors.append(f"import took {result['seconds']:.2f}s > {BUDGET_SECONDS}s")
+    if result["rss"] > BUDGET_RSS_MB * MB:
+        errors.append(f"resident memory {result['rss'] / MB:.1f} MB > {BUDGET_RSS_MB} MB")
+    for name in FORBIDDEN:
+        if name in result["loaded"]:
+            errors.append(f"{name} imported at startup")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="main", help="module to import")
+    parser.add_argument("--top", type=int, default=25, help="packages reported")
+    parser.add_argument("--budget", action="store_true", help="fail if over budget")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+        sys.exit(0)
+    result = run_measure(args.module)
+    report(result, args.top)
+    if args.budget:
+        errors = check_budget(result)
+        for error in errors:
+            print(f"Startup budget exceeded: {error}", file=sys.stderr)
+        sys.exit(1 if errors else 0)
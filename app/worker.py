@@ -0,0 +1,41 @@
+"""Run background jobs (processing of uploaded files) out of the API process
+
+Run from app directory (set JOBS_WORKER_IN_API=False to run jobs only here):
+    python -m worker [--concurrency 4]
+"""
+import argparse
+import asyncio
+import logging
+from logging.config import dictConfig
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from core.blobstore import get_blob_store
+from core.config import Config
+from core.jobs import Worker
+from core.log_config import logging_config
+from core.processpool import shutdown_process_pool
+from db.indexes import ensure_indexes
+
+logger = logging.getLogger("ai4mat")
+
+
+async def main(concurrency: int):
+    conn = AsyncIOMotorClient(str(Config.mongo_uri))
+    try:
+        await ensure_indexes(conn)
+        await Worker(conn, get_blob_store(), concurrency).run()
+    finally:
+        conn.close()
+        shutdown_process_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=Config.jobs_concurrency)
+    args = parser.parse_args()
+    dictConfig(logging_config)
+    try:
+        asyncio.run(main(args.concurrency))
+    except KeyboardInterrupt:
+        logger.info("Worker stopped")